@@ -0,0 +1,131 @@
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class BatchScheduler:
+    """
+    Dynamic micro-batching in front of a model.
+    Callers submit single preprocessed tensors (224, 224, 3) and get a Future.
+    A worker thread merges queued tensors into one batch (up to max_batch_size,
+    or whatever arrived within max_wait_ms of the first item), runs a single
+    forward pass and hands each caller its own row of the result.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=8, max_wait_ms=5.0):
+        # batch_fn: np.ndarray (B, H, W, C) -> indexable of length B
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._queue = []
+        self._cond = threading.Condition()
+        self._histogram = Counter()
+        self._batches = 0
+        self._items = 0
+        self._running = True
+
+        self._worker = threading.Thread(target=self._run, name="batch-scheduler", daemon=True)
+        self._worker.start()
+
+    def submit(self, img):
+        """
+        Queue one image. Accepts (H, W, C) or (1, H, W, C).
+        Returns a concurrent.futures.Future resolving to this image's result row.
+        """
+        if img.ndim == 4:
+            if img.shape[0] != 1:
+                raise ValueError(f"submit() takes a single image, got batch of {img.shape[0]}")
+            img = img[0]
+
+        future = Future()
+        with self._cond:
+            if not self._running:
+                raise RuntimeError("BatchScheduler is stopped.")
+            self._queue.append((img, future))
+            self._cond.notify()
+        return future
+
+    def submit_many(self, imgs):
+        """
+        Queue several images at once so they land in the same batch(es).
+        Returns one Future per image, in order.
+        """
+        imgs = [img[0] if img.ndim == 4 else img for img in imgs]
+        futures = [Future() for _ in imgs]
+        with self._cond:
+            if not self._running:
+                raise RuntimeError("BatchScheduler is stopped.")
+            self._queue.extend(zip(imgs, futures))
+            self._cond.notify()
+        return futures
+
+    def queue_depth(self):
+        with self._cond:
+            return len(self._queue)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queue_depth": len(self._queue),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "batches": self._batches,
+                "items": self._items,
+                "batch_size_histogram": {str(k): v for k, v in sorted(self._histogram.items())},
+            }
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._worker.join(timeout=5)
+
+    def _next_batch(self):
+        with self._cond:
+            while self._running and not self._queue:
+                self._cond.wait()
+            if not self._queue:
+                return None
+
+            # Wait for the batch to fill, but never longer than max_wait after the first item
+            deadline = time.monotonic() + self.max_wait
+            while self._running and len(self._queue) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = self._queue[:self.max_batch_size]
+            del self._queue[:self.max_batch_size]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            # Skip callers that gave up (e.g. cancelled request)
+            batch = [(img, fut) for img, fut in batch if fut.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            try:
+                stacked = np.stack([img for img, _ in batch]).astype(np.float32, copy=False)
+                results = self.batch_fn(stacked)
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+
+            with self._cond:
+                self._histogram[len(batch)] += 1
+                self._batches += 1
+                self._items += len(batch)
+
+            for i, (_, fut) in enumerate(batch):
+                fut.set_result(results[i])
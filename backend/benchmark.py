@@ -0,0 +1,359 @@
+
+import argparse
+import asyncio
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from preprocessing import preprocess_image
+from report_utils import generate_pdf
+
+# Reproducible benchmarks for the preprocessing -> inference -> report pipeline.
+# Usage: python benchmark.py --save baselines/cpu.json
+#        python benchmark.py --compare baselines/cpu.json [--threshold 0.15]
+#        python benchmark.py --only preprocess,pdf --quick
+#
+# Inputs are synthetic fundus-like images (seeded, so every run sees the same
+# bytes) at camera resolutions. Each case reports per-call latency percentiles
+# and throughput. --save writes the results as a JSON baseline; --compare
+# re-runs and exits 1 if any case's p50 is more than --threshold slower than
+# the baseline. /analyze is timed in-process with storage on a temp directory
+# and no database, so nothing leaves the machine.
+
+BENCHMARKS = ("preprocess", "model", "pdf", "analyze")
+RESOLUTIONS = [(1024, 768), (2048, 1536), (3888, 2592)]
+BATCH_SIZES = [1, 4, 8]
+THREAD_COUNTS = [1, 2, 4]
+
+def synthetic_fundus(width, height, seed=0):
+    """Dark field, orange-red retina disc with vignetting, optic disc, vessels and sensor noise (BGR)."""
+    rng = np.random.RandomState(seed)
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    cx, cy, radius = width / 2, height / 2, 0.46 * min(width, height)
+    dist = np.sqrt((xx - cx) ** 2 + (yy - cy) ** 2) / radius
+
+    shade = np.clip(1.0 - 0.55 * dist ** 2, 0, 1)
+    img = np.zeros((height, width, 3), np.float32)
+    img[..., 2] = 200 * shade  # red
+    img[..., 1] = 90 * shade   # green
+    img[..., 0] = 35 * shade   # blue
+
+    # Optic disc: bright yellowish spot off-centre
+    dx, dy = cx + 0.35 * radius * rng.choice([-1, 1]), cy + rng.uniform(-0.1, 0.1) * radius
+    disc = np.exp(-(((xx - dx) ** 2 + (yy - dy) ** 2) / (2 * (0.08 * radius) ** 2)))
+    img += disc[..., None] * np.array([80, 150, 55], np.float32)
+
+    # Vessels: dark random walks leaving the optic disc
+    vessels = np.zeros((height, width), np.uint8)
+    for _ in range(12):
+        x, y, angle = dx, dy, rng.uniform(0, 2 * np.pi)
+        points = []
+        for _ in range(40):
+            angle += rng.normal(0, 0.15)
+            x += np.cos(angle) * radius / 30
+            y += np.sin(angle) * radius / 30
+            points.append((int(x), int(y)))
+        thickness = max(1, int(radius / 120 * rng.uniform(0.5, 1.5)))
+        cv2.polylines(vessels, [np.array(points, np.int32)], False, 255, thickness)
+    vessels = cv2.GaussianBlur(vessels, (0, 0), max(1.0, radius / 400)).astype(np.float32) / 255
+    img *= (1 - 0.45 * vessels)[..., None]
+
+    img += rng.normal(0, 4, img.shape).astype(np.float32)
+    img[dist > 1] = 0
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+def encode(img, fmt):
+    ok, buf = cv2.imencode(f".{fmt}", img, [cv2.IMWRITE_JPEG_QUALITY, 92] if fmt == "jpg" else [])
+    if not ok:
+        raise ValueError(f"Could not encode {fmt}")
+    return buf.tobytes()
+
+def summarize(name, params, latencies, wall_seconds, items_per_call=1):
+    latencies_ms = np.asarray(latencies) * 1000
+    calls = len(latencies_ms)
+    return {
+        "name": name,
+        "params": params,
+        "calls": calls,
+        "mean_ms": float(np.mean(latencies_ms)),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "min_ms": float(np.min(latencies_ms)),
+        "items_per_sec": calls * items_per_call / wall_seconds if wall_seconds > 0 else None,
+    }
+
+def timed(fn, repeat, threads=1, warmup=1):
+    """Run fn() repeat times per thread after warmup calls. Returns (latencies, wall seconds)."""
+    for _ in range(warmup):
+        fn()
+
+    def worker(_):
+        latencies = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        latencies = [t for chunk in pool.map(worker, range(threads)) for t in chunk]
+    return latencies, time.perf_counter() - start
+
+def report_case(result):
+    params = ", ".join(f"{k}={v}" for k, v in result["params"].items())
+    print(f"{result['name']:<22} {params:<45} p50 {result['p50_ms']:9.2f} ms  "
+          f"p95 {result['p95_ms']:9.2f} ms  {result['items_per_sec'] or 0:8.1f} items/s")
+    return result
+
+def bench_preprocess(images, args):
+    results = []
+    for (width, height), fmt, content in images:
+        for exact in (False, True):
+            for threads in args.threads:
+                latencies, wall = timed(lambda: preprocess_image(content, exact=exact), args.repeat, threads)
+                results.append(report_case(summarize(
+                    "preprocess_image",
+                    {"resolution": f"{width}x{height}", "format": fmt, "exact": exact, "threads": threads},
+                    latencies, wall,
+                )))
+    return results
+
+def bench_model(dr_model, images, args):
+    results = []
+    _, _, content = images[0]
+    batch_img, processed, _ = preprocess_image(content)
+
+    for threads in args.threads:
+        latencies, wall = timed(lambda: dr_model.predict(batch_img, processed), args.repeat, threads)
+        results.append(report_case(summarize("DRModel.predict", {"threads": threads}, latencies, wall)))
+
+    probs = dr_model.predict_proba(batch_img)
+    pred_index = int(np.argmax(probs[0]))
+    latencies, wall = timed(lambda: dr_model.make_gradcam_heatmap(batch_img, pred_index), args.repeat)
+    results.append(report_case(summarize("make_gradcam_heatmap", {}, latencies, wall)))
+
+    for batch_size in args.batch_sizes:
+        batch = np.repeat(batch_img, batch_size, axis=0)
+        latencies, wall = timed(lambda: dr_model.predict_proba(batch), args.repeat)
+        results.append(report_case(summarize(
+            "predict_proba", {"batch_size": batch_size}, latencies, wall, batch_size
+        )))
+        latencies, wall = timed(lambda: dr_model.forward_with_cam(batch), args.repeat)
+        results.append(report_case(summarize(
+            "forward_with_cam", {"batch_size": batch_size}, latencies, wall, batch_size
+        )))
+        latencies, wall = timed(lambda: dr_model.forward_with_all_cams(batch), args.repeat)
+        results.append(report_case(summarize(
+            "forward_with_all_cams", {"batch_size": batch_size}, latencies, wall, batch_size
+        )))
+    return results
+
+def bench_pdf(images, args):
+    _, _, content = images[0]
+    _, processed, _ = preprocess_image(content)
+    overlay = cv2.applyColorMap(processed, cv2.COLORMAP_JET)
+    tips = ["Control blood sugar strictly.", "Monitor blood pressure.", "Follow up in 6-12 months."]
+
+    results = []
+    for threads in args.threads:
+        latencies, wall = timed(
+            lambda: generate_pdf("bench@example.com", "Mild", 0.87, processed, overlay, tips, io.BytesIO()),
+            args.repeat, threads,
+        )
+        results.append(report_case(summarize("generate_pdf", {"threads": threads}, latencies, wall)))
+    return results
+
+def app_workdir(prefix, env=None, override=True):
+    """
+    Temp directory for running main in-process (benchmark.py, loadtest.py).
+    Points ANALYSIS_DIR and OUTBOX_PATH into it, applies env (over existing
+    values unless override=False) and makes it the cwd, so main's relative-path
+    writes (e.g. DEBUG_SAVE_UPLOADS) land there too. Call before importing main.
+    """
+    workdir = tempfile.mkdtemp(prefix=prefix)
+    settings = {
+        "APP_ENV": "dev",
+        "ANALYSIS_DIR": os.path.join(workdir, "analyses"),
+        "OUTBOX_PATH": os.path.join(workdir, "outbox.sqlite3"),
+    }
+    settings.update(env or {})
+    for name, value in settings.items():
+        if override:
+            os.environ[name] = value
+        else:
+            os.environ.setdefault(name, value)
+    os.chdir(workdir)
+    return workdir
+
+def bench_analyze(dr_model, images, args):
+    """End-to-end POST /analyze in-process; storage on a temp dir, no database."""
+    import httpx
+
+    cwd = os.getcwd()
+    workdir = app_workdir("optiretina-bench-", {"STORAGE_BACKEND": "local"})
+    os.environ["LOCAL_STORAGE_DIR"] = os.path.join(workdir, "storage")
+    try:
+        import main
+        from model_loader import BackgroundModelLoader
+
+        main.supabase = None
+        main.model_loader = BackgroundModelLoader(lambda: dr_model)
+        main.model_loader.start()
+        main.model_loader.wait()
+
+        async def run(content, concurrency, repeat):
+            transport = httpx.ASGITransport(app=main.app)
+            latencies = []
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+                async def worker(worker_id):
+                    for i in range(repeat):
+                        # Distinct patient ids so the result cache never short-circuits the pipeline
+                        patient = f"bench-{concurrency}-{worker_id}-{i}-{time.perf_counter_ns()}"
+                        start = time.perf_counter()
+                        response = await client.post(
+                            "/analyze", params={"patient_id": patient},
+                            files={"file": ("fundus.jpg", content, "image/jpeg")},
+                        )
+                        latencies.append(time.perf_counter() - start)
+                        response.raise_for_status()
+
+                await worker(-1)  # warmup
+                latencies.clear()
+                start = time.perf_counter()
+                await asyncio.gather(*[worker(w) for w in range(concurrency)])
+                return latencies, time.perf_counter() - start
+
+        results = []
+        for (width, height), fmt, content in images:
+            if fmt != "jpg":
+                continue
+            for concurrency in args.threads:
+                latencies, wall = asyncio.run(run(content, concurrency, args.repeat))
+                results.append(report_case(summarize(
+                    "POST /analyze", {"resolution": f"{width}x{height}", "concurrency": concurrency},
+                    latencies, wall,
+                )))
+        return results
+    finally:
+        os.chdir(cwd)
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+def run(args):
+    only = set(args.only.split(",")) if args.only else set(BENCHMARKS)
+    unknown = only - set(BENCHMARKS)
+    if unknown:
+        raise SystemExit(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    resolutions = RESOLUTIONS[:1] if args.quick else RESOLUTIONS
+    images = []
+    for i, (width, height) in enumerate(resolutions):
+        img = synthetic_fundus(width, height, seed=i)
+        images.append(((width, height), "jpg", encode(img, "jpg")))
+        if not args.quick:
+            images.append(((width, height), "png", encode(img, "png")))
+
+    results = []
+    if "preprocess" in only:
+        results += bench_preprocess(images, args)
+    if "pdf" in only:
+        results += bench_pdf(images, args)
+    if only & {"model", "analyze"}:
+        from ml_model import DRModel
+        import tensorflow as tf
+
+        dr_model = DRModel(args.model_dir)
+        if not dr_model.model:
+            raise SystemExit("FAILURE: Model not loaded.")
+        dr_model.warmup(sorted(set(args.batch_sizes) | {1}))
+        env_extra = {"tensorflow": tf.__version__, "model_backend": dr_model.backend}
+        if "model" in only:
+            results += bench_model(dr_model, images, args)
+        if "analyze" in only:
+            results += bench_analyze(dr_model, images, args)
+    else:
+        env_extra = {}
+
+    return {
+        "environment": dict(environment(), **env_extra),
+        "settings": {"repeat": args.repeat, "quick": args.quick},
+        "results": results,
+    }
+
+def case_key(result):
+    return result["name"] + " " + json.dumps(result["params"], sort_keys=True)
+
+def compare(current, baseline, threshold):
+    """Print a per-case p50 comparison. Returns the list of regressed case keys."""
+    base_cases = {case_key(r): r for r in baseline["results"]}
+    if baseline["environment"].get("cpu_count") != current["environment"].get("cpu_count"):
+        print("WARNING: baseline was recorded on a machine with a different CPU count.")
+
+    regressions = []
+    print("\n--- Comparison (p50) ---")
+    for result in current["results"]:
+        key = case_key(result)
+        base = base_cases.get(key)
+        if base is None:
+            print(f"  new       {key}")
+            continue
+        ratio = result["p50_ms"] / base["p50_ms"] if base["p50_ms"] else float("inf")
+        status = "REGRESSED" if ratio > 1 + threshold else ("improved" if ratio < 1 - threshold else "ok")
+        print(f"  {status:<9} {key}: {base['p50_ms']:.2f} -> {result['p50_ms']:.2f} ms ({ratio - 1:+.1%})")
+        if status == "REGRESSED":
+            regressions.append(key)
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the OptiRetina pipeline.")
+    parser.add_argument("--only", help=f"Comma-separated subset of {','.join(BENCHMARKS)}")
+    parser.add_argument("--repeat", type=int, default=10, help="Timed calls per case (per thread)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=BATCH_SIZES)
+    parser.add_argument("--threads", type=int, nargs="+", default=THREAD_COUNTS,
+                        help="Caller thread counts (concurrency for /analyze)")
+    parser.add_argument("--quick", action="store_true", help="Smallest resolution, JPEG only")
+    parser.add_argument("--model-dir", default="converted_keras")
+    parser.add_argument("--save", metavar="PATH", help="Write results as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH", help="Baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Allowed p50 slowdown (0.15 = 15%%)")
+    args = parser.parse_args()
+
+    current = run(args)
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2)
+        print(f"Wrote {args.save}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print(f"FAILURE: {len(regressions)} case(s) regressed beyond {args.threshold:.0%}")
+            sys.exit(1)
+        print("SUCCESS: No regressions.")
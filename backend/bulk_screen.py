@@ -0,0 +1,178 @@
+
+import argparse
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import numpy as np
+
+from fileutils import find_images
+from preprocessing import preprocess_image
+
+# Offline bulk screening of an image archive.
+# Usage: python bulk_screen.py /data/archive --output results.csv [--batch-size 32] [--workers 8]
+#
+# Images are decoded in a process pool with bounded prefetch, scored in batches
+# through DRModel's compiled inference path and appended to a CSV as they finish.
+# The CSV doubles as the checkpoint: re-running the same command after a crash
+# skips every image already scored; images that failed to decode are retried
+# (their error rows are dropped on resume). A .parquet output is written from that CSV
+# at the end (requires pyarrow).
+
+def load_and_preprocess(root, rel_path, exact):
+    """Runs in a worker process. Returns (rel_path, tensor or None, is_noisy, error)."""
+    try:
+        with open(os.path.join(root, rel_path), "rb") as f:
+            batch_img, _, is_noisy = preprocess_image(f.read(), exact=exact)
+        return rel_path, batch_img[0], bool(is_noisy), ""
+    except Exception as e:
+        return rel_path, None, False, str(e)
+
+def read_checkpoint(csv_path):
+    """
+    Paths already scored in the output CSV. Drops a torn last line from a crash,
+    and error rows, so failed images are retried and end up with one row each.
+    """
+    if not os.path.exists(csv_path):
+        return set()
+
+    with open(csv_path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+    with open(csv_path, "r", newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        rows = list(reader)
+        columns = reader.fieldnames
+    scored = [row for row in rows if not row.get("error")]
+    if len(scored) < len(rows):
+        print(f"Retrying {len(rows) - len(scored)} image(s) that failed last time.")
+        with open(f"{csv_path}.tmp", "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(scored)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{csv_path}.tmp", csv_path)
+    return {row["path"] for row in scored}
+
+def prefetch(executor, root, paths, exact, depth):
+    """Yield decode results in order, keeping at most `depth` decodes in flight."""
+    pending = []
+    it = iter(paths)
+    for path in it:
+        pending.append(executor.submit(load_and_preprocess, root, path, exact))
+        if len(pending) >= depth:
+            break
+    while pending:
+        result = pending.pop(0).result()
+        nxt = next(it, None)
+        if nxt is not None:
+            pending.append(executor.submit(load_and_preprocess, root, nxt, exact))
+        yield result
+
+def write_parquet(csv_path, parquet_path):
+    try:
+        import pyarrow.csv as pv
+        import pyarrow.parquet as pq
+    except ImportError:
+        print("ERROR: pyarrow is required for .parquet output; results are in", csv_path)
+        return False
+    pq.write_table(pv.read_csv(csv_path), parquet_path)
+    return True
+
+def screen(args):
+    from ml_model import DRModel
+
+    paths = find_images(args.input_dir)
+    csv_path = args.output if args.output.endswith(".csv") else args.output + ".partial.csv"
+    done = read_checkpoint(csv_path)
+    todo = [p for p in paths if p not in done]
+    print(f"Found {len(paths)} images, {len(done)} already screened, {len(todo)} to go.")
+
+    dr_model = DRModel(args.model_dir)
+    dr_model.warmup([args.batch_size])
+    columns = ["path", "prediction", "confidence", "is_noisy", "error"] + [f"prob_{c}" for c in dr_model.classes]
+
+    new_file = not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0
+    out = open(csv_path, "a", newline="", encoding="utf-8")
+    writer = csv.DictWriter(out, fieldnames=columns)
+    if new_file:
+        writer.writeheader()
+
+    def flush(batch):
+        if not batch:
+            return
+        probs = dr_model.predict_proba(np.stack([t for _, t, _ in batch]))
+        for (path, _, is_noisy), p in zip(batch, probs):
+            idx = int(np.argmax(p))
+            row = {
+                "path": path,
+                "prediction": dr_model.classes[idx] if idx < len(dr_model.classes) else "Unknown",
+                "confidence": f"{p[idx]:.6f}",
+                "is_noisy": is_noisy,
+                "error": "",
+            }
+            row.update({f"prob_{c}": f"{v:.6f}" for c, v in zip(dr_model.classes, p)})
+            writer.writerow(row)
+        # Checkpoint: everything written so far survives a crash
+        out.flush()
+        os.fsync(out.fileno())
+
+    start = time.perf_counter()
+    processed = 0
+    last_report = start
+    batch = []
+    ctx = multiprocessing.get_context("spawn")  # don't fork a process holding TensorFlow
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers, mp_context=ctx) as executor:
+            for path, tensor, is_noisy, error in prefetch(executor, args.input_dir, todo, args.exact, args.prefetch):
+                if tensor is None:
+                    writer.writerow({"path": path, "error": error})
+                else:
+                    batch.append((path, tensor, is_noisy))
+                if len(batch) >= args.batch_size:
+                    flush(batch)
+                    batch = []
+                processed += 1
+
+                now = time.perf_counter()
+                if now - last_report >= 10:
+                    print(f"{processed}/{len(todo)} images, {processed / (now - start):.1f} images/sec")
+                    last_report = now
+            flush(batch)
+    finally:
+        out.close()
+
+    elapsed = time.perf_counter() - start
+    rate = processed / elapsed if elapsed > 0 else 0.0
+    print(f"Done: {processed} images in {elapsed:.1f}s ({rate:.1f} images/sec). Results: {csv_path}")
+
+    if args.output.endswith(".parquet"):
+        if write_parquet(csv_path, args.output):
+            print(f"Wrote {args.output}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk DR screening of an image directory.")
+    parser.add_argument("input_dir", help="Directory to scan recursively for fundus images")
+    parser.add_argument("--output", default="screening_results.csv", help="Output .csv or .parquet")
+    parser.add_argument("--model-dir", default="converted_keras")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Decode processes")
+    parser.add_argument("--prefetch", type=int, default=None, help="Decodes in flight (default 4x batch size)")
+    parser.add_argument("--exact", action="store_true", help="Full-resolution decode (audit mode)")
+    args = parser.parse_args()
+    if args.prefetch is None:
+        args.prefetch = 4 * args.batch_size
+
+    if not os.path.isdir(args.input_dir):
+        print(f"ERROR: {args.input_dir} is not a directory")
+        sys.exit(1)
+    screen(args)
+
+if __name__ == "__main__":
+    main()
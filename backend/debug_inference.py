@@ -18,6 +18,7 @@ def debug_prediction():
         # Initialize model
         log("initializing model...")
         dr_model = DRModel("converted_keras")
+        dr_model.warmup()
         
         # Create dummy inputs
         # 1. Random noise (normalized -1 to 1)
@@ -58,7 +59,7 @@ def debug_prediction():
                  # Resize if needed or failed logic, but here we assume correct input
                  pass
 
-            pred = dr_model.model.predict(img_batch, verbose=0)[0]
+            pred = dr_model.predict_proba(img_batch)[0]
             pred_str = ", ".join([f"{p:.4f}" for p in pred])
             log(f"Raw Probabilities: [{pred_str}]")
             
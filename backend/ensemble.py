@@ -0,0 +1,85 @@
+import glob
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+# K-fold models are picked up from the model directory by name
+FOLD_PATTERNS = ("*fold*.h5", "*fold*.keras")
+
+
+def find_fold_models(model_dir):
+    """Sorted paths of the K-fold member models in model_dir (may be empty)."""
+    paths = set()
+    for pattern in FOLD_PATTERNS:
+        paths.update(glob.glob(os.path.join(model_dir, pattern)))
+    return sorted(paths)
+
+
+def parse_weights(spec, count):
+    """
+    "0.3,0.2,0.5" -> normalised weights for `count` members.
+    Empty spec -> uniform (plain mean soft voting).
+    """
+    if not spec:
+        return np.full(count, 1.0 / count, dtype=np.float32)
+    weights = np.array([float(w) for w in spec.split(",") if w.strip()], dtype=np.float32)
+    if len(weights) != count:
+        raise ValueError(f"Got {len(weights)} ensemble weights for {count} models.")
+    if np.any(weights < 0) or weights.sum() <= 0:
+        raise ValueError("Ensemble weights must be non-negative and not all zero.")
+    return weights / weights.sum()
+
+
+class SoftVotingEnsemble:
+    """
+    N fold models over one shared input, combined by (weighted) soft voting.
+    Calling it inside a tf.function traces every member into a single graph,
+    so a batch costs one dispatch instead of N sequential model calls.
+    Exposes the parts of the Keras model API DRModel relies on
+    (input_shape, inputs, __call__).
+    """
+
+    def __init__(self, members, weights=None, names=None):
+        if not members:
+            raise ValueError("Ensemble needs at least one model.")
+        self.members = list(members)
+        self.names = list(names) if names else [f"fold_{i + 1}" for i in range(len(members))]
+        self.weights = parse_weights(None, len(members)) if weights is None else np.asarray(weights, np.float32)
+        self._weights = tf.constant(self.weights)
+        self.input_shape = self.members[0].input_shape
+        self.inputs = self.members[0].inputs
+        self.layers = []
+        self.member_latency_ms = {}
+
+    @staticmethod
+    def _probs(preds):
+        return preds[0] if isinstance(preds, (list, tuple)) else preds
+
+    def member_outputs(self, x, training=False):
+        return [self._probs(m(x, training=training)) for m in self.members]
+
+    def vote(self, member_preds):
+        # (N, B, C) weighted by (N,) -> (B, C)
+        return tf.tensordot(self._weights, tf.stack(member_preds), axes=1)
+
+    def __call__(self, x, training=False):
+        return self.vote(self.member_outputs(x, training=training))
+
+    def profile_members(self, batch_size=1, repeats=5):
+        """
+        Per-member latency in ms (median of `repeats`), measured by running
+        each member on its own. The fused graph doesn't expose this split.
+        """
+        dummy = tf.zeros((batch_size,) + tuple(self.input_shape[1:]), dtype=tf.float32)
+        for name, member in zip(self.names, self.members):
+            fn = tf.function(lambda x, m=member: self._probs(m(x, training=False)))
+            fn(dummy)  # trace
+            timings = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                fn(dummy).numpy()
+                timings.append((time.perf_counter() - start) * 1000.0)
+            self.member_latency_ms[name] = float(np.median(timings))
+        return dict(self.member_latency_ms)
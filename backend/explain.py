@@ -0,0 +1,53 @@
+import numpy as np
+import cv2
+
+# Model-independent post-processing: label selection and Grad-CAM overlays.
+# Kept free of TensorFlow so HTTP workers talking to a model server can use it.
+
+
+def top_label(classes, probabilities):
+    """(label, confidence, class index) for one image's probability vector."""
+    probabilities = np.asarray(probabilities).reshape(-1)
+    pred_index = int(np.argmax(probabilities))
+    confidence = float(probabilities[pred_index])
+    if classes and pred_index < len(classes):
+        label = classes[pred_index]
+    else:
+        label = "Unknown"
+    return label, confidence, pred_index
+
+
+def average_views(view_probabilities):
+    """
+    Test-time augmentation: (views, C) probabilities -> (mean (C,), spread),
+    spread being the std across views of the winning class' probability.
+    """
+    view_probabilities = np.asarray(view_probabilities, dtype=np.float32).reshape(len(view_probabilities), -1)
+    mean = view_probabilities.mean(axis=0)
+    spread = float(view_probabilities[:, int(np.argmax(mean))].std())
+    return mean, spread
+
+
+def render_overlay(original_image_bgr, heatmap):
+    """Blend a [0, 1] low-res heatmap over the original image; no heatmap -> original."""
+    if heatmap is None:
+        return original_image_bgr
+    heatmap = cv2.resize(
+        np.asarray(heatmap, dtype=np.float32),
+        (original_image_bgr.shape[1], original_image_bgr.shape[0])
+    )
+    heatmap = np.uint8(255 * heatmap)
+    heatmap = cv2.applyColorMap(heatmap, cv2.COLORMAP_JET)
+    # heatmap is BGR from applyColorMap, original_image_bgr is BGR
+    return cv2.addWeighted(
+        original_image_bgr, 0.6,
+        heatmap, 0.4,
+        0
+    )
+
+
+def encode_png(image_bgr):
+    ok, data = cv2.imencode(".png", image_bgr)
+    if not ok:
+        raise ValueError("PNG encoding failed")
+    return data.tobytes()
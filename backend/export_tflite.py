@@ -0,0 +1,107 @@
+
+import argparse
+import json
+import os
+import sys
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.framework.convert_to_constants import convert_variables_to_constants_v2
+from fileutils import file_fingerprint, find_images
+from ml_model import DRModel
+from preprocessing import preprocess_image
+from tflite_backend import calibration_record_path
+
+# Export post-training quantized TFLite models from the float Keras model.
+# Usage: python export_tflite.py --calibration-dir /data/fundus_sample [--types int8 float16]
+#
+# int8 is calibrated on images from --calibration-dir (preprocessed exactly like
+# /analyze); float16 needs no calibration. Before serving either one, run
+# verify_quantized.py to produce the parity report DRModel requires.
+
+def calibration_paths(folder, limit):
+    paths = [os.path.join(folder, p) for p in find_images(folder)[:limit]]
+    if not paths:
+        raise ValueError(f"No calibration images found in {folder}")
+    return paths
+
+def representative_dataset(paths):
+    print(f"Calibrating on {len(paths)} images")
+
+    def gen():
+        for path in paths:
+            try:
+                with open(path, "rb") as f:
+                    batch_img, _, _ = preprocess_image(f.read(), exact=True)
+            except Exception as e:
+                print(f"Skipping {path}: {e}")
+                continue
+            yield [batch_img.astype(np.float32)]
+    return gen
+
+def build_converter(dr_model):
+    # Wrap the (possibly ensemble) model so the converter sees one traced function
+    module = tf.Module()
+    module.members = dr_model.members
+    input_shape = [None] + list(dr_model.model.input_shape[1:])
+
+    @tf.function(input_signature=[tf.TensorSpec(input_shape, tf.float32)])
+    def serve(x):
+        preds = dr_model.model(x, training=False)
+        if isinstance(preds, (list, tuple)):
+            preds = preds[0]
+        return preds
+
+    module.serve = serve
+    # Fold the weights into constants so the flatbuffer has no variable reads
+    frozen = convert_variables_to_constants_v2(serve.get_concrete_function())
+    return tf.lite.TFLiteConverter.from_concrete_functions([frozen], module)
+
+def export(args):
+    dr_model = DRModel(args.model_dir)
+    if not dr_model.model:
+        print("FAILURE: Float model not loaded.")
+        return False
+
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    output_dir = args.output_dir or os.path.join(base_dir, args.model_dir)
+
+    for qtype in args.types:
+        converter = build_converter(dr_model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if qtype == "int8":
+            if not args.calibration_dir:
+                print("FAILURE: int8 export needs --calibration-dir")
+                return False
+            calibration = calibration_paths(args.calibration_dir, args.num_calibration)
+            converter.representative_dataset = representative_dataset(calibration)
+            converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+            # Keep float32 input/output so callers pass the same normalized tensors
+        elif qtype == "float16":
+            converter.target_spec.supported_types = [tf.float16]
+        else:
+            print(f"FAILURE: Unknown quantization type {qtype}")
+            return False
+
+        tflite_model = converter.convert()
+        path = os.path.join(output_dir, f"model_{qtype}.tflite")
+        with open(path, "wb") as f:
+            f.write(tflite_model)
+        print(f"Wrote {path} ({len(tflite_model) / 1e6:.2f} MB)")
+        if qtype == "int8":
+            # Content hashes, so verify_quantized.py can refuse a holdout that overlaps them
+            with open(calibration_record_path(path), "w", encoding="utf-8") as f:
+                json.dump({
+                    "calibration_dir": os.path.abspath(args.calibration_dir),
+                    "images": len(calibration),
+                    "fingerprints": sorted({file_fingerprint(p) for p in calibration}),
+                }, f, indent=2)
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export quantized TFLite models.")
+    parser.add_argument("--model-dir", default="converted_keras")
+    parser.add_argument("--calibration-dir", help="Representative fundus images for int8 calibration")
+    parser.add_argument("--num-calibration", type=int, default=200)
+    parser.add_argument("--types", nargs="+", default=["int8", "float16"], choices=["int8", "float16"])
+    parser.add_argument("--output-dir", help="Defaults to the model directory")
+    sys.exit(0 if export(parser.parse_args()) else 1)
@@ -0,0 +1,230 @@
+import asyncio
+import random
+import threading
+import time
+import urllib.parse
+from types import SimpleNamespace
+
+from storage import StorageError
+
+# In-process stand-ins for the Supabase pieces main.py uses: the analysis_history
+# table (insert / upsert / the /history query builder) and object storage.
+# Enabled with FAKE_BACKENDS=1 for offline load tests; optional latency and
+# error injection make them behave a little more like the network.
+
+
+def _split_top_level(expr):
+    """Split a PostgREST logic-tree body on commas outside parentheses and quotes."""
+    parts, depth, quoted, current = [], 0, False, []
+    for i, ch in enumerate(expr):
+        if ch == '"' and (i == 0 or expr[i - 1] != "\\"):
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0 and not quoted:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(ch)
+    parts.append("".join(current))
+    return parts
+
+
+_OPS = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "lt": lambda a, b: a < b,
+    "lte": lambda a, b: a <= b,
+    "gt": lambda a, b: a > b,
+    "gte": lambda a, b: a >= b,
+}
+
+
+def _compare(row, column, op, value):
+    current = row.get(column)
+    if current is None:
+        return False
+    if isinstance(current, (int, float)) and not isinstance(current, bool):
+        value = float(value)
+    else:
+        current = str(current)
+    return _OPS[op](current, value)
+
+
+def _parse_condition(term):
+    """'col.op.value' | 'and(...)' | 'or(...)' -> predicate(row)"""
+    for logic, combine in (("and(", all), ("or(", any)):
+        if term.startswith(logic) and term.endswith(")"):
+            children = [_parse_condition(t) for t in _split_top_level(term[len(logic):-1])]
+            return lambda row: combine(child(row) for child in children)
+    column, op, value = term.split(".", 2)
+    if op not in _OPS:
+        raise ValueError(f"Unsupported operator {op!r}")
+    if value.startswith('"') and value.endswith('"'):
+        value = value[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+    return lambda row: _compare(row, column, op, value)
+
+
+class FakeQuery:
+    """The subset of the postgrest request builder main.py and history.py use."""
+
+    def __init__(self, table):
+        self.table = table
+        self.columns = None
+        self.filters = []
+        self.orders = []
+        self.row_limit = None
+        self.write = None
+        self.count = None
+        self.head = False
+
+    def select(self, columns="*", count=None, head=None):
+        self.columns = None if columns.strip() == "*" else [c.strip() for c in columns.split(",")]
+        self.count = count
+        self.head = bool(head)
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: _compare(row, column, "eq", str(value)))
+        return self
+
+    def gte(self, column, value):
+        self.filters.append(lambda row: _compare(row, column, "gte", str(value)))
+        return self
+
+    def lt(self, column, value):
+        self.filters.append(lambda row: _compare(row, column, "lt", str(value)))
+        return self
+
+    def or_(self, filters):
+        self.filters.append(_parse_condition(f"or({filters})"))
+        return self
+
+    def order(self, column, desc=False):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, count):
+        self.row_limit = count
+        return self
+
+    def insert(self, records):
+        self.write = ("insert", records if isinstance(records, list) else [records], False)
+        return self
+
+    def upsert(self, records, on_conflict="id", ignore_duplicates=False):
+        self.write = ("upsert", records if isinstance(records, list) else [records], ignore_duplicates)
+        return self
+
+    def execute(self):
+        return self.table.execute(self)
+
+
+class FakeTable:
+    def __init__(self, backend):
+        self.backend = backend
+        self.rows = {}  # id -> row
+        self._next_id = 1
+
+    def _store(self, write):
+        kind, records, ignore_duplicates = write
+        stored = []
+        for record in records:
+            record = dict(record)
+            if "id" not in record:
+                record["id"] = self._next_id
+                self._next_id += 1
+            key = str(record["id"])
+            if key in self.rows:
+                if kind == "insert":
+                    raise ValueError(f"duplicate key value violates unique constraint: id={key}")
+                if ignore_duplicates:
+                    continue
+            record.setdefault("created_at", time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime()))
+            self.rows[key] = record
+            stored.append(record)
+        return stored
+
+    def _select(self, query):
+        rows = [row for row in self.rows.values() if all(f(row) for f in query.filters)]
+        if query.head:
+            return []
+        # Apply sort keys last-to-first so the first order() wins
+        for column, desc in reversed(query.orders):
+            rows.sort(key=lambda row: str(row.get(column, "")), reverse=desc)
+        if query.row_limit is not None:
+            rows = rows[:query.row_limit]
+        if query.columns:
+            rows = [{c: row.get(c) for c in query.columns} for row in rows]
+        return rows
+
+    def execute(self, query):
+        self.backend.simulate_network()
+        with self.backend.lock:
+            data = self._store(query.write) if query.write else self._select(query)
+            count = None
+            if query.count and not query.write:
+                count = sum(all(f(row) for f in query.filters) for row in self.rows.values())
+        return SimpleNamespace(data=data, count=count)
+
+
+class FakeSupabase:
+    """Stands in for supabase.Client: table(name) with in-memory rows."""
+
+    def __init__(self, latency_ms=0.0, error_rate=0.0, seed=None):
+        self.latency = latency_ms / 1000.0
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._tables = {}
+
+    def simulate_network(self):
+        if self.latency:
+            time.sleep(self.latency * self._random.uniform(0.5, 1.5))
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise ConnectionError("Injected fake database error")
+
+    def table(self, name):
+        with self.lock:
+            if name not in self._tables:
+                self._tables[name] = FakeTable(self)
+            return FakeQuery(self._tables[name])
+
+
+class FakeStorage:
+    """Same interface as storage.SupabaseStorage, keeping objects in memory."""
+
+    def __init__(self, latency_ms=0.0, error_rate=0.0, seed=None):
+        self.latency = latency_ms / 1000.0
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self.objects = {}  # (bucket, path) -> (content_type, bytes)
+        self.bytes_stored = 0
+
+    def public_url(self, bucket, path):
+        return f"fake://storage/{bucket}/{urllib.parse.quote(path, safe='/')}"
+
+    async def upload(self, bucket, path, data, content_type="application/octet-stream"):
+        if self.latency:
+            await asyncio.sleep(self.latency * self._random.uniform(0.5, 1.5))
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise StorageError(f"Upload of {bucket}/{path} failed: injected fake storage error")
+        previous = self.objects.get((bucket, path))
+        self.bytes_stored += len(data) - (len(previous[1]) if previous else 0)
+        self.objects[(bucket, path)] = (content_type, bytes(data))
+        return self.public_url(bucket, path)
+
+    async def download(self, bucket, path):
+        if self.latency:
+            await asyncio.sleep(self.latency * self._random.uniform(0.5, 1.5))
+        if (bucket, path) not in self.objects:
+            raise KeyError(f"{bucket}/{path}")
+        return self.objects[(bucket, path)][1]
+
+    async def bucket_exists(self, bucket):
+        return True
+
+    async def aclose(self):
+        pass
@@ -0,0 +1,52 @@
+import hashlib
+import os
+import threading
+
+# Small file helpers shared by the server, the model backends and the offline scripts.
+
+_fingerprints = {}
+_fingerprint_lock = threading.Lock()
+
+
+def file_fingerprint(path):
+    """
+    sha256 of a file's contents, memoised on (size, mtime) so it is cheap to
+    call per request and still changes as soon as the file is replaced.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return "missing"
+    stamp = (st.st_size, st.st_mtime_ns)
+    with _fingerprint_lock:
+        cached = _fingerprints.get(path)
+        if cached and cached[0] == stamp:
+            return cached[1]
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    digest = h.hexdigest()[:16]
+    with _fingerprint_lock:
+        _fingerprints[path] = (stamp, digest)
+    return digest
+
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+
+
+def is_image_name(name):
+    """Image file by extension; hidden files (e.g. macOS ._ resource forks) are not."""
+    return name.lower().endswith(IMAGE_EXTENSIONS) and not name.startswith(".")
+
+
+def find_images(root):
+    """Image files under root, recursively, as paths relative to root in a stable order."""
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if is_image_name(name):
+                paths.append(os.path.relpath(os.path.join(dirpath, name), root))
+    return paths
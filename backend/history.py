@@ -0,0 +1,139 @@
+import base64
+import datetime
+import json
+import threading
+import time
+from collections import OrderedDict
+
+# Query helpers for GET /history: keyset pagination over (created_at, id),
+# column projection and filters, plus a short-TTL cache of encoded pages.
+
+HISTORY_FIELDS = (
+    "id", "created_at", "user_email", "filename", "prediction", "confidence",
+    "is_noisy", "tips", "report_url", "image_url",
+)
+# Needed to build the next cursor, so always selected
+KEY_FIELDS = ("created_at", "id")
+
+
+def parse_fields(spec):
+    """Comma-separated column list -> select() string. None/empty selects every known column."""
+    if not spec:
+        return ",".join(HISTORY_FIELDS)
+    fields = [f.strip() for f in spec.split(",") if f.strip()]
+    unknown = [f for f in fields if f not in HISTORY_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return ",".join(list(KEY_FIELDS) + [f for f in fields if f not in KEY_FIELDS])
+
+
+def parse_timestamp(value):
+    """ISO date or datetime, validated and normalised; None passes through."""
+    if value is None:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f"Invalid date {value!r}, expected ISO 8601")
+
+
+def encode_cursor(row):
+    raw = json.dumps([row["created_at"], str(row["id"])]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Opaque cursor -> (created_at, id). ValueError if it is not one of ours."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        parse_timestamp(created_at)
+        return created_at, str(row_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+def _quote(value):
+    # PostgREST logic-tree values with reserved characters (':', ',', '.') must be double-quoted
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _filter(query, user_email=None, prediction=None, since=None, until=None):
+    if user_email:
+        query = query.eq("user_email", user_email)
+    if prediction:
+        query = query.eq("prediction", prediction)
+    if since:
+        query = query.gte("created_at", since)
+    if until:
+        query = query.lt("created_at", until)
+    return query
+
+
+def build_count_query(table, user_email=None, prediction=None, since=None, until=None):
+    """Row count of the history table under the same filters as build_query (result.count, no rows)."""
+    return _filter(table.select("id", count="exact", head=True), user_email, prediction, since, until)
+
+
+def build_query(table, select, limit, cursor=None, user_email=None, prediction=None, since=None, until=None):
+    """
+    Newest-first page of the history table. Fetches limit + 1 rows so the
+    caller can tell whether another page follows.
+    """
+    query = _filter(table.select(select), user_email, prediction, since, until)
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        # Strictly after the last row of the previous page in (created_at, id) order
+        query = query.or_(
+            f"created_at.lt.{_quote(created_at)},"
+            f"and(created_at.eq.{_quote(created_at)},id.lt.{_quote(row_id)})"
+        )
+    return query.order("created_at", desc=True).order("id", desc=True).limit(limit + 1)
+
+
+class TTLCache:
+    """Small LRU whose entries expire after ttl seconds; clear() on writes."""
+
+    def __init__(self, ttl=5.0, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max(1, int(max_entries))
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[1]
+            self._entries.pop(key, None)
+            self._misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "ttl_seconds": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "invalidations": self._invalidations,
+            }
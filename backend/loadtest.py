@@ -0,0 +1,266 @@
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+
+import httpx
+import numpy as np
+
+from fileutils import find_images
+
+# Load generator for /analyze (and /history).
+# Usage: python loadtest.py --concurrency 16 --duration 60            # in-process, offline
+#        python loadtest.py --images /data/sample --rps 20 --duration 120
+#        python loadtest.py --url http://node-1:8000 --concurrency 32 --history-ratio 0.1
+#
+# Without --url the app is started in this process on a loopback port with
+# FAKE_BACKENDS=1 (in-memory table + storage, see fake_supabase.py), so a single
+# machine can be load tested without touching Supabase.
+#
+# --concurrency N runs a closed loop: N clients, each sending its next request
+# as soon as the previous one finished. --rps R runs an open loop: requests
+# start on a fixed schedule and latency is measured from the scheduled start,
+# so a stalled server can't hide its queueing delay (coordinated omission).
+
+def load_corpus(args):
+    """[(filename, bytes, content_type)] from --images, or synthetic fundus JPEGs."""
+    if args.images:
+        corpus = []
+        for path in find_images(args.images)[:args.max_images]:
+            name = os.path.basename(path)
+            with open(os.path.join(args.images, path), "rb") as f:
+                corpus.append((name, f.read(), "image/png" if name.lower().endswith(".png") else "image/jpeg"))
+        if not corpus:
+            raise SystemExit(f"No images found in {args.images}")
+        return corpus
+
+    from benchmark import encode, synthetic_fundus
+    width, height = (int(v) for v in args.resolution.lower().split("x"))
+    return [
+        (f"synthetic_{i}.jpg", encode(synthetic_fundus(width, height, seed=i), "jpg"), "image/jpeg")
+        for i in range(args.synthetic_count)
+    ]
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_in_process_server(args):
+    """Run main.app with fake backends on a loopback port. Returns (base_url, server, thread)."""
+    import uvicorn
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from benchmark import app_workdir
+
+    workdir = app_workdir("optiretina-load-", {
+        "FAKE_BACKENDS": "1",
+        "FAKE_LATENCY_MS": str(args.fake_latency_ms),
+        "LOG_LEVEL": "WARNING",
+    }, override=False)
+    import main
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="uvicorn", daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise SystemExit("In-process server failed to start.")
+        time.sleep(0.05)
+    print(f"In-process server on port {port} (workdir {workdir})")
+    return f"http://127.0.0.1:{port}", server, thread
+
+async def wait_ready(client, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/ready")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise SystemExit(f"Server not ready after {timeout}s")
+
+class Recorder:
+    def __init__(self, measure_from):
+        self.measure_from = measure_from
+        self.samples = []  # (endpoint, outcome, latency seconds, finished at)
+
+    def add(self, endpoint, outcome, latency):
+        now = time.monotonic()
+        if now >= self.measure_from:
+            self.samples.append((endpoint, outcome, latency, now))
+
+async def send(client, args, corpus, rng, recorder, scheduled_at=None):
+    """One request; latency counts from scheduled_at when given (open loop)."""
+    start = scheduled_at if scheduled_at is not None else time.monotonic()
+    if rng.random() < args.history_ratio:
+        endpoint = "GET /history"
+        request = client.get("/history", params={"limit": args.history_limit})
+    else:
+        endpoint = "POST /analyze"
+        name, content, content_type = rng.choice(corpus)
+        # Unique patient per request unless cache hits are wanted
+        patient = "load-test" if args.allow_cache else f"load-{rng.getrandbits(48):012x}"
+        request = client.post(
+            "/analyze", params={"patient_id": patient}, files={"file": (name, content, content_type)}
+        )
+    try:
+        response = await request
+        outcome = str(response.status_code)
+    except httpx.TimeoutException:
+        outcome = "timeout"
+    except httpx.TransportError as e:
+        outcome = type(e).__name__
+    recorder.add(endpoint, outcome, time.monotonic() - start)
+
+async def closed_loop(client, args, corpus, recorder, end):
+    async def user(seed):
+        rng = random.Random(seed)
+        while time.monotonic() < end:
+            await send(client, args, corpus, rng, recorder)
+
+    await asyncio.gather(*[user(args.seed + i) for i in range(args.concurrency)])
+
+async def open_loop(client, args, corpus, recorder, end):
+    rng = random.Random(args.seed)
+    interval = 1.0 / args.rps
+    next_at = time.monotonic()
+    in_flight = set()
+    while next_at < end:
+        await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+        if len(in_flight) >= args.max_in_flight:
+            # Client-side cap reached: count it instead of queueing unboundedly here
+            recorder.add("POST /analyze", "client_overflow", 0.0)
+        else:
+            task = asyncio.create_task(send(client, args, corpus, rng, recorder, scheduled_at=next_at))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        next_at += interval
+    if in_flight:
+        await asyncio.gather(*in_flight)
+
+def summarize(recorder, duration):
+    report = {}
+    by_endpoint = {}
+    for endpoint, outcome, latency, _ in recorder.samples:
+        by_endpoint.setdefault(endpoint, []).append((outcome, latency))
+    for endpoint, samples in sorted(by_endpoint.items()):
+        outcomes = {}
+        for outcome, _ in samples:
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        ok_latencies = np.array([lat for outcome, lat in samples if outcome.startswith("2")]) * 1000
+        errors = len(samples) - len(ok_latencies)
+        report[endpoint] = {
+            "requests": len(samples),
+            "throughput_rps": len(ok_latencies) / duration,
+            "error_rate": errors / len(samples),
+            "outcomes": outcomes,
+            "p50_ms": float(np.percentile(ok_latencies, 50)) if len(ok_latencies) else None,
+            "p95_ms": float(np.percentile(ok_latencies, 95)) if len(ok_latencies) else None,
+            "p99_ms": float(np.percentile(ok_latencies, 99)) if len(ok_latencies) else None,
+            "max_ms": float(ok_latencies.max()) if len(ok_latencies) else None,
+        }
+    return report
+
+def print_report(report, duration):
+    print(f"\n--- Load Test Summary ({duration:.0f}s measured) ---")
+    fmt = lambda v: f"{v:8.1f}" if v is not None else "       -"
+    print(f"{'endpoint':<15} {'reqs':>6} {'ok rps':>8} {'err %':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for endpoint, r in report.items():
+        print(f"{endpoint:<15} {r['requests']:>6} {r['throughput_rps']:8.2f} {100 * r['error_rate']:6.2f} "
+              f"{fmt(r['p50_ms'])} {fmt(r['p95_ms'])} {fmt(r['p99_ms'])} {fmt(r['max_ms'])}")
+        errors = {k: v for k, v in r["outcomes"].items() if not k.startswith("2")}
+        if errors:
+            print(f"{'':<15} errors: {errors}")
+
+async def run(args):
+    corpus = load_corpus(args)
+    print(f"Corpus: {len(corpus)} images, {sum(len(c) for _, c, _ in corpus) / len(corpus) / 1e6:.2f} MB avg")
+
+    server = thread = None
+    base_url = args.url
+    if not base_url:
+        base_url, server, thread = start_in_process_server(args)
+
+    connections = max(args.concurrency, args.max_in_flight if args.rps else 0)
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+            await wait_ready(client, args.ready_timeout)
+            start = time.monotonic()
+            recorder = Recorder(measure_from=start + args.warmup)
+            end = start + args.warmup + args.duration
+            mode = f"{args.rps} rps open loop" if args.rps else f"{args.concurrency} concurrent clients"
+            print(f"Driving {base_url} with {mode} for {args.warmup}s warmup + {args.duration}s")
+            if args.rps:
+                await open_loop(client, args, corpus, recorder, end)
+            else:
+                await closed_loop(client, args, corpus, recorder, end)
+            measured = max(1e-9, time.monotonic() - recorder.measure_from)
+
+            try:
+                health = (await client.get("/health")).json()
+            except (httpx.TransportError, ValueError):
+                health = None
+    finally:
+        if server is not None:
+            server.should_exit = True
+            thread.join(timeout=10)
+
+    report = summarize(recorder, measured)
+    print_report(report, measured)
+    if health:
+        queue = health.get("inference_queue", {})
+        if "batch_size_histogram" in queue:
+            print(f"Server batch sizes: {queue['batch_size_histogram']}")
+        rejected = {name: s["rejected"] for name, s in health.get("stages", {}).items() if s.get("rejected")}
+        if rejected:
+            print(f"Server stage rejections (503): {rejected}")
+    return {
+        "settings": {k: v for k, v in vars(args).items()},
+        "measured_seconds": measured,
+        "endpoints": report,
+        "server_health": health,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the OptiRetina API.")
+    parser.add_argument("--url", help="Target base URL; omit to start the app in-process with fake backends")
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument("--concurrency", type=int, default=8, help="Closed loop: concurrent clients")
+    load.add_argument("--rps", type=float, help="Open loop: request starts per second")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="Open loop client-side cap")
+    parser.add_argument("--duration", type=float, default=30, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="Unmeasured seconds before measuring")
+    parser.add_argument("--history-ratio", type=float, default=0.0, help="Fraction of requests that GET /history")
+    parser.add_argument("--history-limit", type=int, default=50)
+    parser.add_argument("--allow-cache", action="store_true", help="Reuse one patient id so result-cache hits happen")
+    parser.add_argument("--images", help="Directory of images to upload (default: synthetic fundus images)")
+    parser.add_argument("--max-images", type=int, default=200)
+    parser.add_argument("--synthetic-count", type=int, default=8)
+    parser.add_argument("--resolution", default="2048x1536", help="Synthetic image size WxH")
+    parser.add_argument("--fake-latency-ms", type=float, default=20.0, help="In-process fake backend latency")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--ready-timeout", type=float, default=300.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", metavar="PATH", help="Write the summary as JSON")
+    args = parser.parse_args()
+    # The in-process server changes the working directory
+    args.json = os.path.abspath(args.json) if args.json else None
+    args.images = os.path.abspath(args.images) if args.images else None
+
+    result = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"Wrote {args.json}")
+    error_rates = [r["error_rate"] for r in result["endpoints"].values()]
+    sys.exit(0 if result["endpoints"] and max(error_rates) < 1.0 else 1)
@@ -1,22 +1,51 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response, PlainTextResponse
+from starlette.datastructures import UploadFile as FormFile
+from starlette.formparsers import MultiPartException
+from typing import List, Optional
 import uvicorn
+import asyncio
 import shutil
+import io
+import json
+import zipfile
 import os
 import uuid
 import datetime
 import mimetypes
+import time
+import numpy as np
 from dotenv import load_dotenv
 from supabase import create_client, Client
 
 # Load environment variables
 load_dotenv()
 
-from preprocessing import preprocess_image
-from ml_model import DRModel
+from telemetry import REGISTRY, logger, request_id_var, request_spans_var, setup_logging, span, timed
+
+setup_logging()
+
+from preprocessing import TTA_MAX_VIEWS, TTA_TRANSFORMS, model_input, preprocess_with_quality
+from quality import ImageRejected
+from upload_limits import (
+    MAX_BATCH_UPLOAD_BYTES, MAX_UPLOAD_BYTES, RequestSizeLimit, UploadTooLarge, parse_image_form, read_upload
+)
 from report_utils import generate_pdf
+from report_store import AnalysisStore, ReportCache, SingleFlight, Uncached
+from explain import average_views, encode_png, render_overlay, top_label
+from storage import StorageError, storage_from_env
+from outbox import Outbox
+import history
+from batching import BatchScheduler
+from pipeline import StageOverloaded, stage_from_env
+from fileutils import is_image_name
+from result_cache import ResultCache
+from model_loader import BackgroundModelLoader, ModelNotReady
+from model_config import (
+    BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, MODEL_SERVER_ADDRESS, MODEL_SERVER_AUTHKEY, load_dr_model
+)
 
 app = FastAPI(title="OptiRetina Backend")
 
@@ -25,14 +54,14 @@ url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
 
 if not url or not key:
-    print("Warning: Supabase credentials not found in env!")
+    logger.warning("Supabase credentials not found in env!")
     supabase: Client = None
 else:
     try:
         supabase: Client = create_client(url, key)
-        print("Supabase client initialized.")
+        logger.info("Supabase client initialized.")
     except Exception as e:
-        print(f"Failed to init Supabase: {e}")
+        logger.error("Failed to init Supabase: %s", e)
         supabase = None
 
 # CORS
@@ -42,38 +71,360 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Request-ID"],
 )
 
-# Setup directories (Still needed for temporary processing)
-UPLOAD_DIR = "uploads"
-REPORT_DIR = "reports"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-os.makedirs(REPORT_DIR, exist_ok=True)
+# Oversized uploads get 413 before their body is read (MAX_UPLOAD_BYTES / MAX_BATCH_UPLOAD_BYTES)
+app.add_middleware(RequestSizeLimit, limits={"/analyze": MAX_UPLOAD_BYTES, "/analyze/batch": MAX_BATCH_UPLOAD_BYTES})
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "optiretina_request_seconds", "HTTP request latency.", ["method", "route", "status"]
+)
+REQUESTS_IN_FLIGHT = REGISTRY.gauge("optiretina_requests_in_flight", "HTTP requests being handled.", ["method"])
+
+@app.middleware("http")
+async def request_telemetry(request: Request, call_next):
+    """Request id (X-Request-ID, echoed back), latency histogram and one summary log line with span timings."""
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex[:16]
+    request_id_var.set(request_id)
+    spans = {}
+    request_spans_var.set(spans)
+    REQUESTS_IN_FLIGHT.inc(method=request.method)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        elapsed = time.perf_counter() - start
+        REQUESTS_IN_FLIGHT.dec(method=request.method)
+        # Route template, not the raw path, to keep label cardinality bounded
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        REQUEST_SECONDS.observe(elapsed, method=request.method, route=route, status=str(status))
+        if route != "/metrics":
+            timings = " ".join(f"{name}={ms:.1f}ms" for name, ms in spans.items())
+            logger.info("%s %s %s %.1fms %s", request.method, route, status, 1000 * elapsed, timings)
+
+# The request path works on in-memory bytes; DEBUG_SAVE_UPLOADS=1 also keeps
+# a copy of every upload in UPLOAD_DIR for debugging
+DEBUG_SAVE_UPLOADS = os.environ.get("DEBUG_SAVE_UPLOADS", "0") == "1"
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR", "uploads")
+if DEBUG_SAVE_UPLOADS:
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+# Stored analyses, rendered into PDF reports on first GET /reports/{id}.
+# The durable copy is in object storage (ANALYSIS_BUCKET); ANALYSIS_DIR holds
+# this node's copies, deleted after ANALYSIS_RETENTION_DAYS once their storage
+# copy is confirmed, and fetched back on demand
+ANALYSIS_DIR = os.environ.get("ANALYSIS_DIR", "analyses")
+ANALYSIS_BUCKET = os.environ.get("ANALYSIS_BUCKET", "analyses")
+ANALYSIS_RETENTION_DAYS = float(os.environ.get("ANALYSIS_RETENTION_DAYS", "30"))
+# Deployments set APP_ENV=production, which requires PUBLIC_BASE_URL; in dev
+# (the default) links fall back to localhost
+APP_ENV = os.environ.get("APP_ENV", "dev")
+# Base URL clients reach this API on; report links point back here
+PUBLIC_BASE_URL = os.environ.get("PUBLIC_BASE_URL", "").rstrip("/")
+if not PUBLIC_BASE_URL:
+    if APP_ENV == "production":
+        raise RuntimeError("PUBLIC_BASE_URL is not set: report links would point at localhost.")
+    PUBLIC_BASE_URL = "http://localhost:8000"
+    logger.warning("PUBLIC_BASE_URL not set, report links point at %s.", PUBLIC_BASE_URL)
+
+# Object storage: pooled async client for Supabase Storage (STORAGE_BACKEND=local for a directory stand-in)
+storage = storage_from_env(url, key)
+
+if os.environ.get("FAKE_BACKENDS") == "1":
+    # Offline mode (load tests): in-memory table + storage, FAKE_LATENCY_MS / FAKE_ERROR_RATE to make them realistic
+    from fake_supabase import FakeStorage, FakeSupabase
+
+    fake_latency = float(os.environ.get("FAKE_LATENCY_MS", "0"))
+    fake_error_rate = float(os.environ.get("FAKE_ERROR_RATE", "0"))
+    supabase = FakeSupabase(fake_latency, fake_error_rate)
+    storage = FakeStorage(fake_latency, fake_error_rate)
+    logger.warning("FAKE_BACKENDS=1: using in-memory database and storage.")
+
+@app.on_event("shutdown")
+async def close_storage():
+    if storage:
+        await storage.aclose()
 
 # Helper: Upload to Supabase Storage
-def upload_to_supabase(file_path: str, bucket: str, destination_name: str, content_type: str = "image/png"):
-    if not supabase:
+async def upload_to_supabase(content: bytes, bucket: str, destination_name: str, content_type: str = "image/png"):
+    """Upload in-memory bytes; returns the public URL, or None if storage is unavailable or the upload failed."""
+    if not storage:
         return None
     try:
-        with open(file_path, 'rb') as f:
-            supabase.storage.from_(bucket).upload(
-                file=f,
-                path=destination_name,
-                file_options={"content-type": content_type}
-            )
-        # Get Public URL
-        return supabase.storage.from_(bucket).get_public_url(destination_name)
-    except Exception as e:
-        print(f"Upload to Supabase failed: {e}")
+        with span(f"upload_{bucket}"):
+            return await storage.upload(bucket, destination_name, content, content_type)
+    except StorageError as e:
+        logger.warning("Upload to Supabase failed: %s", e)
         return None
 
-# Initialize Model (Global load)
-print("Initializing AI Model...")
-# Initialize Model (Ensemble load)
-print("Initializing AI Ensemble...")
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-MODEL_DIR = os.path.join(BASE_DIR, "converted_keras")
-dr_model = DRModel(MODEL_DIR)
+# Initialize Model (background load)
+# TensorFlow is only imported on the loader thread, so importing main and
+# answering /health doesn't wait for it. /ready turns 200 once the model is warm.
+if MODEL_SERVER_ADDRESS:
+    # Multi-worker mode: a shared model_server.py process owns the model and the
+    # batching; this worker only ships tensors to it through shared memory.
+    from model_server import RemoteModel
+
+    remote_model = RemoteModel(MODEL_SERVER_ADDRESS, MODEL_SERVER_AUTHKEY, pool_size=BATCH_MAX_SIZE)
+    model_loader = BackgroundModelLoader(remote_model.connect)
+    inference_scheduler = remote_model
+    explain_scheduler = remote_model.cam_scheduler()
+else:
+    model_loader = BackgroundModelLoader(load_dr_model)
+    # /analyze only waits for the plain forward pass; Grad-CAM has its own batches
+    inference_scheduler = BatchScheduler(
+        lambda batch: model_loader.get().infer_batch(batch, with_cam=False), BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS
+    )
+    explain_scheduler = BatchScheduler(
+        lambda batch: model_loader.get().infer_batch(batch), BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS
+    )
+
+@app.on_event("startup")
+def start_model_loading():
+    model_loader.start()
+
+@app.on_event("shutdown")
+def stop_model_client():
+    if MODEL_SERVER_ADDRESS:
+        # Release this worker's shared-memory segments
+        remote_model.close()
+
+# Bounded worker pools per pipeline stage, sized via <STAGE>_WORKERS / <STAGE>_QUEUE.
+# Keeps blocking work off the event loop; a full stage answers 503 instead of stalling.
+stages = {
+    "decode": stage_from_env("decode", os.cpu_count() or 2, 32),
+    # Enough inference workers to fill a batch while waiting on the scheduler
+    "inference": stage_from_env("inference", BATCH_MAX_SIZE, 32),
+    "report": stage_from_env("report", 2, 32),
+    "upload": stage_from_env("upload", 8, 64),
+    "history": stage_from_env("history", 4, 32),
+    # Grad-CAM for stored analyses; a full stage just leaves the work to GET /explain/{id}
+    "explain": stage_from_env("explain", 2, 64),
+}
+
+# Image-quality gate (blur, SNR, exposure, disc coverage) before the model:
+# QUALITY_GATE=report (default) only reports the scores and is_noisy, flag
+# answers "Uncertain" without running the model, reject answers 422 without
+# storing anything. Keep report until the thresholds are calibrated on real
+# fundus images (see quality.py): flag/reject withhold diagnoses on their say-so
+QUALITY_GATE = os.environ.get("QUALITY_GATE", "report")
+UNGRADED_LABEL = "Uncertain"
+
+# Test-time augmentation: views scored (in one batch) and averaged per image.
+# Default for requests without ?tta_views=; 1 = off
+TTA_VIEWS = min(max(1, int(os.environ.get("TTA_VIEWS", "1"))), TTA_MAX_VIEWS)
+
+# EXPLAIN_MODE=background computes each analysis' Grad-CAM right after /analyze
+# returns; on_demand waits for the first GET /explain/{id} (or report) to ask for it
+EXPLAIN_MODE = os.environ.get("EXPLAIN_MODE", "background")
+
+# Re-uploads of the same image (same patient, same model) skip the whole pipeline.
+# RESULT_CACHE_DIR enables the on-disk tier; the model fingerprint invalidates both tiers.
+result_cache = ResultCache(
+    version_fn=lambda: model_loader.get().model_fingerprint(),
+    max_bytes=int(os.environ.get("RESULT_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+    disk_dir=os.environ.get("RESULT_CACHE_DIR") or None,
+)
+
+analysis_store = AnalysisStore(ANALYSIS_DIR)
+
+async def upload_analysis(analysis_id, fields_json, images_npz):
+    """Copy an analysis to ANALYSIS_BUCKET and mark it stored, which makes it prunable here."""
+    try:
+        with span("upload_analysis"):
+            # JSON last, as on disk: a restore only trusts complete pairs
+            await storage.upload(ANALYSIS_BUCKET, f"{analysis_id}.npz", images_npz, "application/octet-stream")
+            await storage.upload(ANALYSIS_BUCKET, f"{analysis_id}.json", fields_json, "application/json")
+    except StorageError as e:
+        logger.warning("Analysis %s is only stored on this node for now: %s", analysis_id, e)
+        return False
+    await asyncio.to_thread(analysis_store.mark_stored, analysis_id)
+    return True
+
+async def store_analysis(analysis_id, fields, images):
+    """Save an analysis on this node and, when storage is configured, durably in ANALYSIS_BUCKET."""
+    fields_json, images_npz = AnalysisStore.encode(fields, images)
+    await stages["upload"].run(analysis_store.save_encoded, analysis_id, fields_json, images_npz)
+    if storage:
+        await upload_analysis(analysis_id, fields_json, images_npz)
+
+async def restore_analysis(analysis_id):
+    """
+    Fetch an analysis missing on this node (another worker's, or pruned) back
+    from storage. Unknown ids are left to the store's KeyError.
+    """
+    # Ids come from URLs and become storage paths: same check as the local store
+    if not storage or not AnalysisStore.valid_id(analysis_id) or analysis_store.contains(analysis_id):
+        return
+    try:
+        fields_json = await storage.download(ANALYSIS_BUCKET, f"{analysis_id}.json")
+        images_npz = await storage.download(ANALYSIS_BUCKET, f"{analysis_id}.npz")
+    except KeyError:
+        return
+    await stages["upload"].run(analysis_store.save_encoded, analysis_id, fields_json, images_npz)
+    await asyncio.to_thread(analysis_store.mark_stored, analysis_id)
+
+async def maintain_analyses():
+    """
+    Hourly: retry the bucket upload of analyses whose first upload failed,
+    then prune the ones older than ANALYSIS_RETENTION_DAYS. Only analyses with
+    a confirmed copy in storage are pruned; without storage nothing is.
+    """
+    while True:
+        try:
+            # Skip fresh ones: their first upload may still be running
+            for analysis_id in await asyncio.to_thread(analysis_store.unstored, 600):
+                await upload_analysis(analysis_id, *await asyncio.to_thread(analysis_store.read_encoded, analysis_id))
+            removed = await asyncio.to_thread(analysis_store.prune, ANALYSIS_RETENTION_DAYS * 86400)
+            if removed:
+                logger.info("Pruned %d analyses older than %g days from %s.", removed, ANALYSIS_RETENTION_DAYS, ANALYSIS_DIR)
+        except Exception as e:
+            logger.warning("Maintaining %s failed: %s", ANALYSIS_DIR, e)
+        await asyncio.sleep(3600)
+
+@app.on_event("startup")
+async def start_analysis_retention():
+    if not storage:
+        logger.warning("No object storage: analyses in %s are the only copy and are never pruned.", ANALYSIS_DIR)
+        return
+    try:
+        exists = await storage.bucket_exists(ANALYSIS_BUCKET)
+    except StorageError as e:
+        logger.warning("Could not check storage bucket %r: %s", ANALYSIS_BUCKET, e)
+    else:
+        if not exists:
+            raise RuntimeError(f"Storage bucket {ANALYSIS_BUCKET!r} (ANALYSIS_BUCKET) does not exist; create it first.")
+    task = asyncio.create_task(maintain_analyses())
+    background_tasks.add(task)
+
+def flush_history(records):
+    """Outbox flush: batched, idempotent insert of analysis_history rows."""
+    if not supabase:
+        raise RuntimeError("Supabase not active")
+    with span("db_insert"):
+        supabase.table("analysis_history").upsert(records, on_conflict="id", ignore_duplicates=True).execute()
+    logger.info("%d record(s) saved to Supabase DB.", len(records))
+    # New rows are visible now; cached history pages are stale
+    history_cache.clear()
+
+# Encoded /history pages, briefly cached per query; outbox flushes clear it
+history_cache = history.TTLCache(
+    ttl=float(os.environ.get("HISTORY_CACHE_TTL", "5")),
+    max_entries=int(os.environ.get("HISTORY_CACHE_ENTRIES", "256")),
+)
+HISTORY_DEFAULT_LIMIT = 100
+HISTORY_MAX_LIMIT = 1000
+
+# analysis_history rows are written behind: appended to a local SQLite (WAL)
+# outbox on the request path and flushed to Supabase in batches by a background thread
+history_outbox = Outbox(
+    os.environ.get("OUTBOX_PATH", "outbox.sqlite3"),
+    flush_history,
+    batch_size=int(os.environ.get("OUTBOX_BATCH_SIZE", "100")),
+    flush_interval=float(os.environ.get("OUTBOX_FLUSH_INTERVAL", "1.0")),
+)
+
+@app.on_event("startup")
+def start_outbox():
+    if supabase:
+        history_outbox.start()
+    else:
+        logger.warning("Supabase not active, analysis records stay in the local outbox.")
+
+@app.on_event("shutdown")
+def stop_outbox():
+    history_outbox.stop()
+
+class ExplanationUnavailable(Exception):
+    """The loaded model backend can't produce Grad-CAM heatmaps."""
+
+cam_flight = SingleFlight()
+
+def compute_cams(analysis_id: str):
+    _, images = analysis_store.load(analysis_id)
+    with span("gradcam"):
+        _, heatmaps = explain_scheduler.submit(model_input(images["processed"])).result()
+    if heatmaps is None:
+        raise ExplanationUnavailable(f"Grad-CAM is not available with the {model_loader.get().backend} backend.")
+    # One map per class at model resolution (e.g. 5x7x7); upsampled and colorized only when served
+    cams = np.asarray(heatmaps, dtype=np.float16)
+    analysis_store.save_array(analysis_id, "cams", cams)
+    return cams
+
+def ensure_cams(analysis_id: str):
+    """(classes, h, w) Grad-CAMs of a stored analysis, computed once; KeyError for unknown ids."""
+    try:
+        return analysis_store.load_array(analysis_id, "cams")
+    except KeyError:
+        return cam_flight.run(analysis_id, lambda: compute_cams(analysis_id))
+
+def class_index(label: str) -> int:
+    classes = model_loader.get().classes
+    if label not in classes:
+        raise ValueError(f"Unknown label {label!r}, expected one of {classes}.")
+    return classes.index(label)
+
+def render_explanation(key) -> bytes:
+    analysis_id, label = key
+    fields, images = analysis_store.load(analysis_id)
+    if label is None and fields["prediction"] == UNGRADED_LABEL:
+        raise ValueError("Image failed the quality gate and was not graded; pass ?label= to explain a grade anyway.")
+    index = class_index(label or fields["prediction"])
+    cams = ensure_cams(analysis_id)
+    with span("overlay"):
+        return encode_png(render_overlay(images["processed"], cams[index]))
+
+async def precompute_explanation(analysis_id: str):
+    try:
+        await stages["explain"].run(ensure_cams, analysis_id)
+    except StageOverloaded:
+        logger.debug("Explain stage full, Grad-CAM for %s left to first request.", analysis_id)
+    except Exception as e:
+        logger.warning("Background Grad-CAM for %s failed: %s", analysis_id, e)
+
+background_tasks = set()
+
+def schedule_explanation(analysis_id: str):
+    task = asyncio.create_task(precompute_explanation(analysis_id))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+def render_report(report_id: str) -> bytes:
+    fields, images = analysis_store.load(report_id)
+    gradcam_img = images["processed"]
+    fallback = False
+    if fields["prediction"] != UNGRADED_LABEL:
+        try:
+            index = class_index(fields["prediction"])
+            gradcam_img = render_overlay(images["processed"], ensure_cams(report_id)[index])
+        except ModelNotReady:
+            raise
+        except ExplanationUnavailable as e:
+            # Permanent for this backend: the report without Grad-CAM is the final one
+            logger.info("Report %s without Grad-CAM: %s", report_id, e)
+        except Exception as e:
+            logger.warning("Grad-CAM for report %s failed, serving it without: %s", report_id, e)
+            fallback = True
+    buffer = io.BytesIO()
+    with span("pdf"):
+        generate_pdf(
+            fields["patient_id"], fields["prediction"], fields["confidence"],
+            images["processed"], gradcam_img, fields["tips"], buffer,
+            created_at=datetime.datetime.fromisoformat(fields["created_at"]),
+        )
+    # Not cached, so the next request retries the Grad-CAM
+    return Uncached(buffer.getvalue()) if fallback else buffer.getvalue()
+
+# Reports are rendered lazily and kept in memory (per worker) up to REPORT_CACHE_MAX_BYTES
+report_cache = ReportCache(render_report, int(os.environ.get("REPORT_CACHE_MAX_BYTES", str(64 * 1024 * 1024))))
+# Same for the Grad-CAM overlay PNGs of GET /explain/{id}, keyed by (id, label)
+explanation_cache = ReportCache(
+    render_explanation, int(os.environ.get("EXPLANATION_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+)
 
 HEALTH_TIPS = {
     "No_DR": ["Maintain healthy diet.", "Yearly eye exams.", "Regular exercise."],
@@ -86,131 +437,633 @@ HEALTH_TIPS = {
 
 @app.get("/health")
 def health_check():
+    # Liveness: always "ok" while the process serves; model readiness is reported separately
+    ready = model_loader.state == "ready"
+    inference_queue = inference_scheduler.stats()
     return {
-        "status": "ok", 
-        "model_loaded": dr_model.model is not None,
-        "supabase_connected": supabase is not None
+        # "degraded": model servers' stats are missing or stale (they didn't answer in time)
+        "status": "degraded" if inference_queue.get("degraded") else "ok",
+        "model": model_loader.status(),
+        "model_loaded": ready,
+        "model_backend": model_loader.get().backend if ready else None,
+        "ensemble": model_loader.get().ensemble_info() if ready else None,
+        "supabase_connected": supabase is not None,
+        "inference_queue": inference_queue,
+        # Model servers report their Grad-CAM queue inside inference_queue
+        "explain_queue": None if MODEL_SERVER_ADDRESS else explain_scheduler.stats(),
+        "stages": {name: stage.stats() for name, stage in stages.items()},
+        "result_cache": result_cache.stats(),
+        "report_cache": report_cache.stats(),
+        "explanation_cache": explanation_cache.stats(),
+        "history_outbox": history_outbox.stats(),
+        "history_cache": history_cache.stats()
     }
 
+def collect_metrics():
+    """Scrape-time gauges for state that already lives in the pipeline objects."""
+    ready = model_loader.state == "ready"
+    stage_stats = {name: stage.stats() for name, stage in stages.items()}
+    queue = inference_scheduler.stats()
+    if "model_servers" in queue:
+        servers = [s for s in queue["model_servers"].values() if "error" not in s]
+        queue = {
+            "queue_depth": sum(s["queue_depth"] for s in servers),
+            "batches": sum(s["batches"] for s in servers),
+            "items": sum(s["items"] for s in servers),
+        }
+    outbox = history_outbox.stats()
+    families = [
+        ("optiretina_model_ready", "gauge", "1 once the model is loaded and warm.", [({}, int(ready))]),
+        ("optiretina_model_load_seconds", "gauge", "Time the model took to load and warm up.",
+         [({}, model_loader.load_seconds)]),
+        ("optiretina_stage_in_flight", "gauge", "Jobs running or queued per pipeline stage.",
+         [({"stage": n}, s["in_flight"]) for n, s in stage_stats.items()]),
+        ("optiretina_stage_queued", "gauge", "Jobs waiting for a worker per pipeline stage.",
+         [({"stage": n}, s["queued"]) for n, s in stage_stats.items()]),
+        ("optiretina_stage_rejected_total", "counter", "Jobs rejected because the stage was full.",
+         [({"stage": n}, s["rejected"]) for n, s in stage_stats.items()]),
+        ("optiretina_inference_queue_depth", "gauge", "Images waiting for a batched forward pass.",
+         [({}, queue.get("queue_depth"))]),
+        ("optiretina_inference_batches_total", "counter", "Batched forward passes run.", [({}, queue.get("batches"))]),
+        ("optiretina_inference_items_total", "counter", "Images run through batched forward passes.",
+         [({}, queue.get("items"))]),
+        ("optiretina_outbox_pending", "gauge", "analysis_history rows waiting to be flushed.",
+         [({}, outbox["pending"])]),
+        ("optiretina_outbox_oldest_pending_seconds", "gauge", "Age of the oldest unflushed row.",
+         [({}, outbox["oldest_pending_seconds"])]),
+    ]
+    caches = (("result", result_cache), ("report", report_cache), ("explanation", explanation_cache),
+              ("history", history_cache))
+    for name, cache in caches:
+        stats = cache.stats()
+        families.append((f"optiretina_{name}_cache_hits_total", "counter", f"{name} cache hits.", [({}, stats["hits"])]))
+        if "bytes" in stats:
+            families.append((f"optiretina_{name}_cache_bytes", "gauge", f"{name} cache size.", [({}, stats["bytes"])]))
+    return families
+
+REGISTRY.register_collector(collect_metrics)
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus text exposition of this worker's metrics."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/ready")
+def readiness_check():
+    if model_loader.state != "ready":
+        return JSONResponse(status_code=503, content={"ready": False, **model_loader.status()})
+    return {"ready": True, **model_loader.status()}
+
+def fetch_history_page(select, limit, cursor, user_email, prediction, since, until):
+    """One page of history as pre-encoded JSON rows, plus the cursor of the next page (or None)."""
+    query = history.build_query(
+        supabase.table("analysis_history"), select, limit, cursor, user_email, prediction, since, until
+    )
+    with span("history_query"):
+        rows = query.execute().data
+    next_cursor = history.encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return [json.dumps(row) for row in rows[:limit]], next_cursor
+
+def fetch_history_stats(user_email, since, until):
+    """Total and per-prediction row counts: one count query each, no rows transferred."""
+    table = lambda: supabase.table("analysis_history")
+    with span("history_stats"):
+        total = history.build_count_query(table(), user_email, None, since, until).execute().count
+        by_prediction = {
+            label: history.build_count_query(table(), user_email, label, since, until).execute().count
+            for label in HEALTH_TIPS
+        }
+    return {"total": total, "by_prediction": by_prediction}
+
+@app.get("/history/stats")
+async def get_history_stats(
+    user_email: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+):
+    """Counts for dashboards: {"total": n, "by_prediction": {label: n}}, same filters as /history."""
+    try:
+        since, until = history.parse_timestamp(since), history.parse_timestamp(until)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not supabase:
+        return {"total": 0, "by_prediction": {label: 0 for label in HEALTH_TIPS}}
+
+    cache_key = ("stats", user_email, since, until)
+    stats = history_cache.get(cache_key)
+    if stats is None:
+        try:
+            stats = await stages["history"].run(fetch_history_stats, user_email, since, until)
+        except StageOverloaded as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+        except Exception as e:
+            logger.error("Fetch history stats failed: %s", e)
+            raise HTTPException(status_code=502, detail="History stats unavailable.")
+        history_cache.put(cache_key, stats)
+    return stats
+
 @app.get("/history")
-def get_history():
+async def get_history(
+    limit: int = Query(HISTORY_DEFAULT_LIMIT, ge=1, le=HISTORY_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    user_email: Optional[str] = None,
+    prediction: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    """
+    Newest-first analysis history, one page at a time.
+    The body stays a JSON list of records; pass the X-Next-Cursor response
+    header back as ?cursor= for the next page (no header on the last page).
+    Filters: user_email, prediction, since/until (ISO dates, until exclusive).
+    fields: comma-separated columns to return (id and created_at are always included).
+    """
+    try:
+        select = history.parse_fields(fields)
+        since, until = history.parse_timestamp(since), history.parse_timestamp(until)
+        if cursor:
+            history.decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     if not supabase:
         # Fallback to empty or local logic if needed, but for now returned empty
         return []
-    
+
+    cache_key = (select, limit, cursor, user_email, prediction, since, until)
+    page = history_cache.get(cache_key)
+    if page is None:
+        try:
+            page = await stages["history"].run(
+                fetch_history_page, select, limit, cursor, user_email, prediction, since, until
+            )
+        except StageOverloaded as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+        except Exception as e:
+            logger.error("Fetch history failed: %s", e)
+            return []
+        history_cache.put(cache_key, page)
+    rows, next_cursor = page
+
+    def stream_rows():
+        # Rows are serialized once per cached page and streamed in chunks
+        yield "["
+        for start in range(0, len(rows), 100):
+            yield ("," if start else "") + ",".join(rows[start:start + 100])
+        yield "]"
+
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return StreamingResponse(stream_rows(), media_type="application/json", headers=headers)
+
+@app.get("/reports/{report_id}")
+async def get_report(report_id: str):
+    """PDF report of a stored analysis, rendered on first access and cached."""
     try:
-        # Fetch from 'analysis_history' table
-        response = supabase.table("analysis_history").select("*").order("created_at", desc=True).execute()
-        return response.data
-    except Exception as e:
-        print(f"Fetch history failed: {e}")
-        return []
+        await restore_analysis(report_id)
+        pdf = await stages["report"].run(report_cache.get, report_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Report not found.")
+    except (StorageError, ModelNotReady) as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except StageOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    return Response(
+        content=pdf,
+        media_type="application/pdf",
+        headers={"Content-Disposition": f'inline; filename="report_{report_id}.pdf"'},
+    )
 
-@app.post("/analyze")
-async def analyze_retina(file: UploadFile = File(...), patient_id: str = "Anonymous"):
+@app.get("/explain/{analysis_id}")
+async def get_explanation(analysis_id: str, label: Optional[str] = None):
+    """
+    Grad-CAM overlay (PNG) of a stored analysis; computed on first access if not done yet.
+    label: the DR grade to explain (default: the predicted one). Maps for all
+    grades are computed together, so asking for the others is cheap.
+    """
     try:
-        # 1. Save upload temporarily
-        content = await file.read()
-        file_id = str(uuid.uuid4())
-        filename = f"{file_id}_{file.filename}"
-        file_path = os.path.join(UPLOAD_DIR, filename)
-        
-        with open(file_path, "wb") as f:
-            f.write(content)
-        
-        # 2. Preprocess
-        print("Starting preprocessing...")
-        batch_img, processed_img_cv2, is_noisy = preprocess_image(content)
-        print(f"Preprocessing done. Batch shape: {batch_img.shape}, Original shape: {processed_img_cv2.shape}")
-        
-        # 3. Predict & Explain
-        print("Starting prediction...")
-        label, confidence, gradcam_img = dr_model.predict(batch_img, processed_img_cv2)
-        print(f"Prediction done. Label: {label}, Conf: {confidence}")
-        
-        # 4. Generate Report
-        tips = HEALTH_TIPS.get(label, ["Consult a doctor."])
-        pdf_filename = f"report_{file_id}.pdf"
-        pdf_path = os.path.join(REPORT_DIR, pdf_filename)
-        
-        
-        generate_pdf(patient_id, label, confidence, processed_img_cv2, gradcam_img, tips, pdf_path)
-        
-        # Save to History
-        import json
-        timestamp = datetime.datetime.now().isoformat()
-        record = {
-            "id": file_id,
-            "filename": file.filename,
-            "prediction": label,
-            "confidence": confidence,
-            "tips": tips,
-            "report_url": f"/reports/{pdf_filename}",
-            "image_url": f"/uploads/{filename}",
-            "date": timestamp,
-            "is_noisy": bool(is_noisy)
-        }
-        
-        
-        # 5. Upload to Supabase Storage
-        image_public_url = None
-        pdf_public_url = None
-        
-        if supabase:
-            # Upload Original Image
-            # Determine content type
-            mime_type, _ = mimetypes.guess_type(file.filename)
-            if not mime_type: mime_type = "image/png"
-            
-            # Using the saved temp file for upload is easiest
-            original_url = upload_to_supabase(file_path, "uploads", filename, mime_type)
-            image_public_url = original_url if original_url else f"/uploads/{filename}" # Fallback? No, just broken link if fails
-
-            # Upload Report PDF
-            pdf_url = upload_to_supabase(pdf_path, "reports", pdf_filename, "application/pdf")
-            pdf_public_url = pdf_url if pdf_url else f"/reports/{pdf_filename}"
-        
-        else:
-            # Fallback (should not happen if key provided)
-            print("Supabase not active, skipping upload.")
-            image_public_url = "error_no_db"
-            pdf_public_url = "error_no_db"
-
-        # 6. Save to Supabase Database
-        if supabase:
-            record = {
-                "user_email": patient_id, # Using patient_id as email/user identifier per user request logic
-                "filename": file.filename,
+        await restore_analysis(analysis_id)
+        png = await stages["report"].run(explanation_cache.get, (analysis_id, label))
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Analysis not found.")
+    except StorageError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ExplanationUnavailable as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    except ModelNotReady as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except StageOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    return Response(content=png, media_type="image/png")
+
+def save_upload(file_path: str, content: bytes):
+    with span("save"), open(file_path, "wb") as f:
+        f.write(content)
+
+def grade(decoded, view_probabilities, inference_seconds):
+    """
+    (label, confidence, tta metadata or None) from one image's per-view
+    probabilities; several views (test-time augmentation) are averaged.
+    """
+    if decoded["ungraded"]:
+        # The quality gate kept this image away from the model
+        return UNGRADED_LABEL, 0.0, None
+    probabilities, spread = average_views(view_probabilities)
+    label, confidence, _ = top_label(model_loader.get().classes, probabilities)
+    views = len(view_probabilities)
+    if views == 1:
+        return label, confidence, None
+    return label, confidence, {
+        "views": views,
+        "transforms": [name for name, _ in TTA_TRANSFORMS[:views]],
+        "spread": round(spread, 4),
+        # What the views cost: decode + augmentation, and the batched forward pass
+        "preprocess_ms": decoded["preprocess_ms"],
+        "inference_ms": round(1000 * inference_seconds, 2),
+    }
+
+def run_inference(batch_img):
+    # Waits for the shared batched forward pass (no Grad-CAM on the request path);
+    # all TTA views go in together so they share a batch
+    with span("inference"):
+        futures = inference_scheduler.submit_many(list(batch_img))
+        return [future.result()[0] for future in futures]
+
+async def decode_content(content: bytes, patient_id: str, tta_views: int = 1):
+    """
+    Cache lookup + decode for one upload.
+    Returns {"cached": result} on a cache hit, otherwise the decoded tensors.
+    """
+    # Same bytes + same patient + same model (+ same TTA views) -> reuse the stored result
+    key_parts = (patient_id,) if tta_views == 1 else (patient_id, f"tta{tta_views}")
+    with span("cache_lookup"):
+        cache_key = await stages["decode"].run(result_cache.key, content, *key_parts)
+        cached = await stages["decode"].run(result_cache.get, cache_key)
+    if cached is not None:
+        logger.info("Result cache hit, skipping analysis.")
+        return {"cached": dict(cached, cached=True)}
+
+    # 2. Preprocess (+ TTA views) + quality gate
+    start = time.perf_counter()
+    with span("preprocess"):
+        batch_img, processed_img_cv2, quality = await stages["decode"].run(
+            preprocess_with_quality, content, None, tta_views
+        )
+    preprocess_ms = round(1000 * (time.perf_counter() - start), 2)
+    logger.debug("Preprocessing done. Batch shape: %s, Original shape: %s", batch_img.shape, processed_img_cv2.shape)
+    if quality["noisy"]:
+        logger.info("Quality gate (%s): %s", QUALITY_GATE, quality)
+        if QUALITY_GATE == "reject":
+            raise ImageRejected(quality)
+    return {
+        "cache_key": cache_key,
+        "batch_img": batch_img,
+        "processed_img": processed_img_cv2,
+        "is_noisy": quality["noisy"],
+        "quality": quality,
+        "preprocess_ms": preprocess_ms,
+        # Flagged images skip the model and come back ungraded
+        "ungraded": quality["noisy"] and QUALITY_GATE == "flag",
+    }
+
+async def finish_analysis(decoded, content, original_filename, patient_id, label, confidence, tta=None, file_id=None):
+    """
+    Report, storage upload, DB record and result caching for one analyzed image.
+    Every side effect is keyed on file_id (storage upsert, analysis files,
+    outbox row), so calling it again with the same file_id is safe.
+    """
+    file_id = file_id or str(uuid.uuid4())
+    filename = f"{file_id}_{original_filename}"
+    is_noisy = decoded["is_noisy"]
+    tips = HEALTH_TIPS.get(label, ["Consult a doctor."])
+    pdf_public_url = f"{PUBLIC_BASE_URL}/reports/{file_id}"
+    mime_type, _ = mimetypes.guess_type(original_filename)
+    if not mime_type: mime_type = "image/png"
+
+    # 4. Upload the original straight from memory while the analysis (the PDF
+    # is only rendered if someone opens /reports/{id}) is stored
+    jobs = [
+        upload_to_supabase(content, "uploads", filename, mime_type),
+        timed("store_analysis", store_analysis(
+            file_id,
+            {
+                "patient_id": patient_id,
                 "prediction": label,
                 "confidence": float(confidence),
-                "is_noisy": bool(is_noisy),
-                "tips": tips, # Supabase array(text)
-                "report_url": pdf_public_url,
-                "image_url": image_public_url
-                # created_at is auto
-            }
-            try:
-                supabase.table("analysis_history").insert(record).execute()
-                print("Record saved to Supabase DB.")
-            except Exception as e:
-                print(f"DB Insert failed: {e}")
-
-        # Cleanup Temp Files? optional, but good for serverless. We keep for now for debug.
-
-        return JSONResponse({
-            "success": True,
-            "prediction": label,
-            "confidence": confidence,
-            "is_noisy": bool(is_noisy),
-            "report_url": pdf_public_url, # Frontend uses this link
-            "image_url": image_public_url,
-            "tips": tips
-        })
+                "tips": tips,
+                "created_at": datetime.datetime.now().isoformat(),
+            },
+            {"processed": decoded["processed_img"]},
+        )),
+    ]
+    if DEBUG_SAVE_UPLOADS:
+        jobs.append(stages["upload"].run(save_upload, os.path.join(UPLOAD_DIR, os.path.basename(filename)), content))
+    original_url = (await asyncio.gather(*jobs))[0]
+    if EXPLAIN_MODE == "background" and label != UNGRADED_LABEL:
+        schedule_explanation(file_id)
+    if original_url:
+        image_public_url = original_url
+    else:
+        # Fallback? No, just broken link if fails
+        image_public_url = f"/uploads/{filename}" if storage else "error_no_db"
+    
+    # 5. Save to Supabase Database (via the outbox; the id makes retried inserts idempotent)
+    record = {
+        "id": file_id,
+        "user_email": patient_id, # Using patient_id as email/user identifier per user request logic
+        "filename": original_filename,
+        "prediction": label,
+        "confidence": float(confidence),
+        "is_noisy": bool(is_noisy),
+        "tips": tips, # Supabase array(text)
+        "report_url": pdf_public_url,
+        "image_url": image_public_url,
+        # Set here rather than by the DB, which only sees the row when the outbox flushes
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+    with span("db_enqueue"):
+        await stages["upload"].run(history_outbox.put, record)
+
+    result = {
+        "success": True,
+        "prediction": label,
+        "confidence": confidence,
+        "is_noisy": bool(is_noisy),
+        "quality": decoded["quality"],
+        "report_url": pdf_public_url, # Frontend uses this link
+        "image_url": image_public_url,
+        "explanation_url": f"{PUBLIC_BASE_URL}/explain/{file_id}",
+        "tips": tips
+    }
+    if tta:
+        result["tta"] = tta
+    await stages["decode"].run(result_cache.put, decoded["cache_key"], result)
+    return result
 
+async def analyze_content(content: bytes, original_filename: str, patient_id: str, tta_views: int = 1):
+    """
+    Full analysis of one uploaded image: cache lookup, decode, inference,
+    storage and DB record. Returns the response dict once the forward pass is
+    done; the Grad-CAM is served separately by GET /explain/{id}.
+    Raises StageOverloaded when a pipeline stage is at capacity,
+    ModelNotReady while the model is still loading.
+    """
+    model_loader.get()
+    decoded = await decode_content(content, patient_id, tta_views)
+    if "cached" in decoded:
+        return decoded["cached"]
+
+    # 3. Predict
+    view_probabilities = []
+    start = time.perf_counter()
+    if not decoded["ungraded"]:
+        view_probabilities = await stages["inference"].run(run_inference, decoded["batch_img"])
+    label, confidence, tta = grade(decoded, view_probabilities, time.perf_counter() - start)
+    logger.debug("Prediction done. Label: %s, Conf: %.4f", label, confidence)
+
+    return await finish_analysis(decoded, content, original_filename, patient_id, label, confidence, tta)
+
+# The form is parsed in the handler (parse_image_form) so the image never
+# touches disk; this documents the "file" field it expects
+ANALYZE_REQUEST_BODY = {
+    "required": True,
+    "content": {"multipart/form-data": {"schema": {
+        "type": "object",
+        "properties": {"file": {"type": "string", "format": "binary"}},
+        "required": ["file"],
+    }}},
+}
+
+@app.post("/analyze", openapi_extra={"requestBody": ANALYZE_REQUEST_BODY})
+async def analyze_retina(
+    request: Request,
+    patient_id: str = "Anonymous",
+    tta_views: int = Query(TTA_VIEWS, ge=1, le=TTA_MAX_VIEWS),
+):
+    """
+    Multipart upload with one image in "file".
+    tta_views > 1: average that many augmented views (flips, rotations, brightness) for a second opinion.
+    """
+    try:
+        form = await parse_image_form(request)
+    except (ValueError, MultiPartException) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        file = form.get("file")
+        if not isinstance(file, FormFile):
+            raise HTTPException(status_code=422, detail='Expected an image in the "file" form field.')
+        content = await read_upload(file, MAX_UPLOAD_BYTES)
+        result = await analyze_content(content, file.filename, patient_id, tta_views)
+        return JSONResponse(result)
+
+    except HTTPException:
+        raise
+
+    except StageOverloaded as e:
+        # Backpressure: shed load instead of queueing without bound
+        logger.warning("Rejecting request: %s", e)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except ModelNotReady as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except ImageRejected as e:
+        raise HTTPException(status_code=422, detail={"message": str(e), "quality": e.quality})
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Analysis failed")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        await form.close()
+
+# Batch analysis
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "500"))
+# Images of one batch request in flight at once; enough to fill inference batches
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", str(2 * BATCH_MAX_SIZE)))
+if BATCH_CONCURRENCY < 1:
+    raise RuntimeError(f"BATCH_CONCURRENCY must be at least 1, got {BATCH_CONCURRENCY}")
+# A chunk takes its permits before decoding, so it can never be larger than the semaphore
+BATCH_CHUNK_SIZE = min(BATCH_MAX_SIZE, BATCH_CONCURRENCY)
+BATCH_OVERLOAD_RETRIES = 20
+
+def expand_batch_upload(file: UploadFile):
+    """
+    Turn one uploaded part into (name, read_fn) items.
+    Zip archives expand to their image entries. Everything is read lazily from
+    the spooled upload, so a large batch is never held in memory as a whole.
+    """
+    if not zipfile.is_zipfile(file.file):
+        return [(file.filename, lambda: read_batch_part(file.file))]
+
+    archive = zipfile.ZipFile(file.file)
+    items = []
+    for info in archive.infolist():
+        name = os.path.basename(info.filename)
+        if info.is_dir() or not is_image_name(name):
+            continue
+        items.append((name, lambda info=info: read_archive_entry(archive, info)))
+    return items
+
+def read_batch_part(part):
+    # Same per-image limit as /analyze
+    part.seek(0)
+    content = part.read(MAX_UPLOAD_BYTES + 1)
+    if len(content) > MAX_UPLOAD_BYTES:
+        raise UploadTooLarge(MAX_UPLOAD_BYTES)
+    return content
+
+def read_archive_entry(archive, info):
+    # Same per-image limit as /analyze, checked before decompressing
+    if info.file_size > MAX_UPLOAD_BYTES:
+        raise UploadTooLarge(MAX_UPLOAD_BYTES)
+    return archive.read(info)
+
+@app.post("/analyze/batch")
+async def analyze_batch(
+    files: List[UploadFile] = File(...),
+    patient_id: str = "Anonymous",
+    tta_views: int = Query(TTA_VIEWS, ge=1, le=TTA_MAX_VIEWS),
+):
+    """
+    Analyze many images (or zip archives of images) in one request.
+    Images are decoded in parallel chunks of BATCH_MAX_SIZE and each chunk is
+    handed to the inference scheduler at once, so it runs as a real batch.
+    Streams one NDJSON line per image as it finishes; a failing image reports
+    its own error without aborting the rest. The last line is a summary.
+    """
+    # Parts stay in Starlette's spooled temp files (RequestSizeLimit caps the
+    # total); images are read one at a time, archive entries when decoded
+    items = []
+    for file in files:
+        try:
+            items.extend(expand_batch_upload(file))
+        except zipfile.BadZipFile as e:
+            raise HTTPException(status_code=400, detail=f"{file.filename}: {e}")
+    if not items:
+        raise HTTPException(status_code=400, detail="No images found in upload.")
+    try:
+        model_loader.get()
+    except ModelNotReady as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch has {len(items)} images, limit is {BATCH_MAX_ITEMS}.")
+
+    async def with_retry(fn, *args):
+        for attempt in range(BATCH_OVERLOAD_RETRIES):
+            try:
+                return await fn(*args)
+            except StageOverloaded:
+                # Batch callers wait for capacity rather than failing the item
+                if attempt == BATCH_OVERLOAD_RETRIES - 1:
+                    raise
+                await asyncio.sleep(min(0.1 * 2 ** attempt, 2.0))
+
+    def failure(index, name, e):
+        logger.warning("Batch item %d (%s) failed: %s", index, name, e)
+        return {"index": index, "filename": name, "success": False, "error": str(e)}
+
+    async def read_and_decode(index, name, read_fn):
+        try:
+            content = await with_retry(stages["decode"].run, read_fn)
+            return content, await with_retry(decode_content, content, patient_id, tta_views)
+        except Exception as e:
+            return None, failure(index, name, e)
+
+    async def classify_and_finish(index, name, content, decoded, futures, submitted_at):
+        try:
+            outputs = await asyncio.gather(*[asyncio.wrap_future(f) for f in futures])
+            label, confidence, tta = grade(
+                decoded, [probabilities for probabilities, _ in outputs], time.perf_counter() - submitted_at
+            )
+            # One id for every attempt, so a retry overwrites instead of duplicating
+            file_id = str(uuid.uuid4())
+            result = await with_retry(
+                finish_analysis, decoded, content, name, patient_id, label, confidence, tta, file_id
+            )
+            return dict(result, index=index, filename=name)
+        except Exception as e:
+            return failure(index, name, e)
+
+    results = asyncio.Queue()
+    in_flight = asyncio.Semaphore(BATCH_CONCURRENCY)
+    tasks = set()
+
+    async def produce():
+        # Always ends with a terminal item: None when every item was handed
+        # off, the exception when producing failed (its items never report)
+        error = None
+        try:
+            await produce_items()
+        except Exception as e:
+            logger.exception("Batch producer failed")
+            error = e
+        finally:
+            results.put_nowait(("producer_done", error))
+
+    async def produce_items():
+        async def finish(coro):
+            try:
+                await results.put(await coro)
+            finally:
+                in_flight.release()
+
+        for start in range(0, len(items), BATCH_CHUNK_SIZE):
+            chunk = list(enumerate(items))[start:start + BATCH_CHUNK_SIZE]
+            for _ in chunk:
+                await in_flight.acquire()
+            decoded_chunk = await asyncio.gather(*[read_and_decode(i, name, fn) for i, (name, fn) in chunk])
+
+            to_infer = []
+            for (index, (name, _)), (content, decoded) in zip(chunk, decoded_chunk):
+                if "cached" in decoded:
+                    decoded = dict(decoded["cached"], index=index, filename=name)
+                if content is None or "batch_img" not in decoded:
+                    await results.put(decoded)
+                    in_flight.release()
+                else:
+                    to_infer.append((index, name, content, decoded))
+
+            # One submit per chunk (every view of every image) -> the scheduler sees it together
+            views = [list(d["batch_img"]) if not d["ungraded"] else [] for _, _, _, d in to_infer]
+            submitted_at = time.perf_counter()
+            all_futures = iter(inference_scheduler.submit_many([v for item in views for v in item]))
+            for (index, name, content, decoded), item_views in zip(to_infer, views):
+                futures = [next(all_futures) for _ in item_views]
+                task = asyncio.create_task(
+                    finish(classify_and_finish(index, name, content, decoded, futures, submitted_at))
+                )
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+    async def stream_results():
+        producer = asyncio.create_task(produce())
+        received = failed = 0
+        try:
+            while received < len(items):
+                result = await results.get()
+                if isinstance(result, tuple):
+                    _, error = result
+                    if error is None:
+                        continue  # the rest arrive from their finish tasks
+                    # Items that will never report count as failed
+                    yield json.dumps({
+                        "done": True, "total": len(items), "failed": failed + len(items) - received,
+                        "error": f"Batch aborted: {error}",
+                    }) + "\n"
+                    return
+                received += 1
+                if not result.get("success"):
+                    failed += 1
+                yield json.dumps(result) + "\n"
+            yield json.dumps({"done": True, "total": len(items), "failed": failed}) + "\n"
+        finally:
+            # Client went away: stop producing more work
+            producer.cancel()
+            for task in list(tasks):
+                task.cancel()
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
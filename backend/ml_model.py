@@ -1,7 +1,15 @@
 import tensorflow as tf
 import numpy as np
-import cv2
 import os
+import logging
+
+from ensemble import SoftVotingEnsemble, find_fold_models, parse_weights
+from tflite_backend import TFLiteModel, check_parity_report
+from tfjs_loader import load_tfjs_model, tfjs_model_files
+from fileutils import file_fingerprint
+from explain import average_views, render_overlay, top_label
+
+logger = logging.getLogger("optiretina.model")
 
 # Fix for Teachable Machine Keras export compatibility
 class FixedDepthwiseConv2D(tf.keras.layers.DepthwiseConv2D):
@@ -14,20 +22,77 @@ class FixedDepthwiseConv2D(tf.keras.layers.DepthwiseConv2D):
         return super().call(inputs)
 
 class DRModel:
-    def __init__(self, model_dir="converted_keras"):
+    def __init__(self, model_dir="converted_keras", voting="mean", weights=None,
+                 backend="keras", tflite_model="model_int8.tflite", require_parity=True,
+                 tfjs_dir="tm-my-image-model", cache_dir=None):
+        """
+        voting: "mean" or "weighted" soft voting when the model directory
+        holds K-fold models (*fold*.h5 / *fold*.keras).
+        weights: comma-separated per-fold weights for "weighted" voting.
+        backend: "keras" (float, with Grad-CAM) or "tflite" (quantized file
+        tflite_model in the model directory, no Grad-CAM). A TFLite model only
+        loads with a passing verify_quantized.py report unless require_parity=False.
+        tfjs_dir: Teachable Machine TF.js export (model.json + weights.bin);
+        preferred over keras_model.h5 when present.
+        cache_dir: keep a .keras copy of each h5/.keras model, keyed by the
+        source file hash, so later boots skip the load-then-rebuild fallbacks.
+        """
         self.model = None
         self.model_dir = model_dir
+        self.model_path = None
+        self.model_paths = []
+        self.voting = voting
+        self.voting_weights = weights
+        self.backend = backend
+        self.tflite_model = tflite_model
+        self.require_parity = require_parity
+        self.tfjs_dir = tfjs_dir
+        self.cache_dir = cache_dir
         self.classes = [] # Dynamically loaded
         
-        # Load the single Teachable Machine model
-        self.load_model()
+        # Load the quantized model, the K-fold ensemble, or the single Teachable Machine model
+        if self.backend == "tflite":
+            self.load_tflite_model()
+        elif self.backend == "keras":
+            self.load_model()
+        else:
+            raise ValueError(f"Unknown model backend: {self.backend}")
         self.load_labels()
         
         # For Grad-CAM (optional, validation needed if layer name differs)
         self.last_conv_layer_name = None
-        if self.model:
-            self.last_conv_layer_name = self.find_last_conv_layer(self.model)
+        self._serving_fn = None
+        self._gradcam_fn = None
+        self._all_class_cam_fn = None
+        if self.model and self.backend == "keras":
+            self._serving_fn = self._build_serving_fn()
+            self.last_conv_layer_name = self.find_last_conv_layer(self.members[0])
             print("Last Conv Layer for Grad-CAM:", self.last_conv_layer_name)
+            self._gradcam_fn = self._build_gradcam_fn()
+            self._all_class_cam_fn = self._build_all_class_cam_fn()
+
+    @property
+    def members(self):
+        """The individual Keras models (one unless running an ensemble)."""
+        if isinstance(self.model, SoftVotingEnsemble):
+            return self.model.members
+        if self.backend != "keras":
+            return []
+        return [self.model] if self.model else []
+
+    def ensemble_info(self):
+        if isinstance(self.model, SoftVotingEnsemble):
+            return {
+                "members": self.model.names,
+                "voting": self.voting,
+                "weights": [float(w) for w in self.model.weights],
+                "member_latency_ms": dict(self.model.member_latency_ms),
+            }
+        return {"members": [os.path.basename(p) for p in self.model_paths], "voting": None}
+
+    def model_fingerprint(self):
+        """Content hash of the loaded model files; changes whenever the weights do."""
+        return "-".join(file_fingerprint(p) for p in self.model_paths)
 
     def load_labels(self):
         """
@@ -64,38 +129,126 @@ class DRModel:
             print(f"DEBUG: Labels file not found at {path}. Using default.")
             self.classes = ["No_DR", "Mild", "Moderate", "Severe", "Proliferate_DR"]
 
+    def _source_model_paths(self):
+        """
+        The float model file(s): K-fold members, else the TF.js export
+        (model.json + weight shards), else the single keras_model.h5.
+        """
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        fold_paths = find_fold_models(os.path.join(base_dir, self.model_dir))
+        if fold_paths:
+            return fold_paths
+        if self.tfjs_dir:
+            model_json = os.path.join(base_dir, self.tfjs_dir, "model.json")
+            if os.path.exists(model_json):
+                return tfjs_model_files(model_json)
+        return [os.path.join(base_dir, self.model_dir, "keras_model.h5")]
+
+    def load_tflite_model(self):
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        path = os.path.join(base_dir, self.model_dir, self.tflite_model)
+        print(f"DEBUG: Loading TFLite model from: {path}")
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"TFLite model not found at {path}; run export_tflite.py first.")
+
+        if self.require_parity:
+            report = check_parity_report(path, self._source_model_paths())
+            print(f"DEBUG: Parity report OK (top-1 agreement {report['top1_agreement']:.2%})")
+        else:
+            print("DEBUG: WARNING: serving TFLite model without a parity check.")
+
+        self.model = TFLiteModel(path)
+        self.model_path = path
+        self.model_paths = [path]
+
     def load_model(self):
         print("DEBUG: Entering load_model")
         base_dir = os.path.dirname(os.path.abspath(__file__))
-        path = os.path.join(base_dir, self.model_dir, "keras_model.h5")
+        fold_paths = find_fold_models(os.path.join(base_dir, self.model_dir))
+
+        if len(fold_paths) > 1:
+            # K-fold soft-voting ensemble
+            print(f"DEBUG: Loading {len(fold_paths)}-model ensemble ({self.voting} voting)")
+            weights = parse_weights(self.voting_weights if self.voting == "weighted" else None, len(fold_paths))
+            members = [self._load_keras_file(p) for p in fold_paths]
+            names = [os.path.splitext(os.path.basename(p))[0] for p in fold_paths]
+            self.model = SoftVotingEnsemble(members, weights, names)
+            self.model_paths = fold_paths
+            self.model_path = fold_paths[0]
+            print("DEBUG: Exiting load_model")
+            return
+
+        source_paths = self._source_model_paths()
+        path = source_paths[0]
+        self.model_path = path
+        self.model_paths = source_paths
         
         print(f"DEBUG: Loading model from: {path}")
         
-        if os.path.exists(path):
-            # Attempt 1: Standard load
-            try:
-                print("DEBUG: Attempting standard load_model...")
-                # Map BOTH names just in case
-                custom_objs = {
-                    'DepthwiseConv2D': FixedDepthwiseConv2D,
-                    'FixedDepthwiseConv2D': FixedDepthwiseConv2D
-                }
-                with tf.keras.utils.custom_object_scope(custom_objs):
-                    self.model = tf.keras.models.load_model(path, compile=False)
-                print(f"DEBUG: Model loaded successfully via load_model. Type: {type(self.model)}")
-            except Exception as e:
-                print(f"DEBUG: Standard load failed: {e}")
-                print("DEBUG: Attempting manual build fallback...")
-                try:
-                    self.model = self._build_manual_model(path)
-                    print("DEBUG: Manual build and weight load successful.")
-                except Exception as e2:
-                    print(f"DEBUG: Manual fallback failed: {e2}")
-                    raise e # Raise original error or e2
+        if path.endswith("model.json"):
+            # Native TF.js loader: prebuilt graph, every weight shape-checked
+            self.model = load_tfjs_model(path)
+            print(f"DEBUG: TF.js model loaded. Type: {type(self.model)}")
+        elif os.path.exists(path):
+            self.model = self._load_keras_file(path)
         else:
             print(f"DEBUG: Error: Model file not found at {path}")
         print("DEBUG: Exiting load_model")
 
+    def _load_keras_file(self, path):
+        if not self.cache_dir:
+            return self._load_keras_file_uncached(path)
+
+        cache_path = os.path.join(self.cache_dir, f"{file_fingerprint(path)}.keras")
+        custom_objs = {
+            'DepthwiseConv2D': FixedDepthwiseConv2D,
+            'FixedDepthwiseConv2D': FixedDepthwiseConv2D
+        }
+        if os.path.exists(cache_path):
+            try:
+                with tf.keras.utils.custom_object_scope(custom_objs):
+                    model = tf.keras.models.load_model(cache_path, compile=False)
+                print(f"DEBUG: Loaded cached model {cache_path}")
+                return model
+            except Exception as e:
+                print(f"DEBUG: Cached model unreadable, rebuilding: {e}")
+                os.remove(cache_path)
+
+        model = self._load_keras_file_uncached(path)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = cache_path[:-len(".keras")] + ".tmp.keras"
+            model.save(tmp_path)
+            os.replace(tmp_path, cache_path)
+            print(f"DEBUG: Cached model at {cache_path}")
+        except Exception as e:
+            print(f"DEBUG: Could not cache model: {e}")
+        return model
+
+    def _load_keras_file_uncached(self, path):
+        # Attempt 1: Standard load
+        try:
+            print("DEBUG: Attempting standard load_model...")
+            # Map BOTH names just in case
+            custom_objs = {
+                'DepthwiseConv2D': FixedDepthwiseConv2D,
+                'FixedDepthwiseConv2D': FixedDepthwiseConv2D
+            }
+            with tf.keras.utils.custom_object_scope(custom_objs):
+                model = tf.keras.models.load_model(path, compile=False)
+            print(f"DEBUG: Model loaded successfully via load_model. Type: {type(model)}")
+            return model
+        except Exception as e:
+            print(f"DEBUG: Standard load failed: {e}")
+            print("DEBUG: Attempting manual build fallback...")
+            try:
+                model = self._build_manual_model(path)
+                print("DEBUG: Manual build and weight load successful.")
+                return model
+            except Exception as e2:
+                print(f"DEBUG: Manual fallback failed: {e2}")
+                raise e # Raise original error or e2
+
     def _build_manual_model(self, weights_path):
         """
         Manually reconstructs the TM architecture to bypass Keras 3 loading issues.
@@ -137,102 +290,289 @@ class DRModel:
     def find_last_conv_layer(self, model):
         """
         Attempt to find the last Conv2D layer for Grad-CAM.
-        Teachable Machine usually exports a Sequential model with a Hub layer or just layers.
-        We'll search recursively or linearly.
+        Teachable Machine exports a Sequential whose first layer is the nested
+        MobileNet base, so a nested model containing convolutions counts as the
+        conv layer (its output is the final feature map).
         """
+        def has_conv(layer):
+            if isinstance(layer, tf.keras.layers.Conv2D):
+                return True
+            return any(has_conv(l) for l in getattr(layer, "layers", []))
+
         last_conv = None
         for layer in model.layers:
             if isinstance(layer, tf.keras.layers.Conv2D):
                 last_conv = layer.name
-            # If it's a nested model (like Functional inside Sequential), we might need to dig,
-            # but usually TM Keras export is flat or standard.
+            elif isinstance(layer, tf.keras.Model) and has_conv(layer) and len(layer.output.shape) == 4:
+                last_conv = layer.name
         return last_conv
 
-    def make_gradcam_heatmap(self, img_array, pred_index):
-        if not self.model or not self.last_conv_layer_name:
-             return None
-
-        # Grad-CAM on the single model
-        grad_model = tf.keras.models.Model(
-            inputs=self.model.inputs,
-            outputs=[
-                self.model.get_layer(self.last_conv_layer_name).output,
-                self.model.output
-            ]
-        )
+    def _build_serving_fn(self):
+        """
+        Compiled inference with a fixed input signature.
+        Calling the model directly skips the data adapter / callback setup that
+        model.predict does on every call, which dominates at batch size 1.
+        """
+        input_shape = [None] + list(self.model.input_shape[1:])
 
-        with tf.GradientTape() as tape:
-            conv_out, preds = grad_model(img_array)
-            if isinstance(preds, list):
+        @tf.function(input_signature=[tf.TensorSpec(input_shape, tf.float32)])
+        def serving_fn(x):
+            preds = self.model(x, training=False)
+            if isinstance(preds, (list, tuple)):
                 preds = preds[0]
-            class_score = preds[:, pred_index]
+            return preds
+
+        return serving_fn
+
+    def warmup(self, batch_sizes=(1,)):
+        """
+        Trace the compiled functions and run them once per batch size so the
+        first real request after a deploy doesn't pay tracing/kernel setup cost.
+        """
+        if not self.model:
+            return
+        input_shape = tuple(self.model.input_shape[1:])
+        for batch_size in batch_sizes:
+            dummy = np.zeros((batch_size,) + input_shape, dtype=np.float32)
+            self.predict_proba(dummy)
+            self.forward_with_cam(dummy)
+            if self._all_class_cam_fn is not None:
+                self.forward_with_all_cams(dummy)
+        if isinstance(self.model, SoftVotingEnsemble):
+            latency = self.model.profile_members(batch_sizes[0] if batch_sizes else 1)
+            print(f"Ensemble member latency (ms): {latency}")
+        print(f"Model warmed up for batch sizes: {list(batch_sizes)}")
+
+    def _cam_forward(self, model):
+        """
+        forward(x, tape) -> (conv_out, preds) for one Keras model, with the
+        last conv feature map watched by the tape. None if there is no conv layer.
+        """
+        conv_layer_name = self.find_last_conv_layer(model)
+        if not conv_layer_name:
+            return None
+
+        layers = model.layers
+        names = [l.name for l in layers]
+        if isinstance(model, tf.keras.Sequential) and conv_layer_name in names:
+            # Split the Sequential at the conv layer: features -> head
+            split = names.index(conv_layer_name) + 1
+            feature_layers, head_layers = layers[:split], layers[split:]
 
-        grads = tape.gradient(class_score, conv_out)
-        pooled_grads = tf.reduce_mean(grads, axis=(0, 1, 2))
+            def forward(x, tape):
+                for layer in feature_layers:
+                    x = layer(x, training=False)
+                tape.watch(x)
+                conv_out = x
+                for layer in head_layers:
+                    x = layer(x, training=False)
+                return conv_out, x
+        else:
+            grad_model = tf.keras.models.Model(
+                inputs=model.inputs,
+                outputs=[
+                    model.get_layer(conv_layer_name).output,
+                    model.output
+                ]
+            )
+
+            def forward(x, tape):
+                conv_out, preds = grad_model(x, training=False)
+                if isinstance(preds, list):
+                    preds = preds[0]
+                return conv_out, preds
+
+        return forward
+
+    def _ensemble_cam_forward(self):
+        """
+        forward(x, tape) -> ([conv_out per member], preds) or None without Grad-CAM.
+        For an ensemble the voted score is explained w.r.t. every member's
+        feature map, stacked along the channel axis like one wide conv layer.
+        """
+        forwards = [self._cam_forward(m) for m in self.members]
+        if not forwards or not all(forwards):
+            return None
+
+        def forward(x, tape):
+            convs, preds = zip(*[f(x, tape) for f in forwards])
+            if len(preds) == 1:
+                return list(convs), preds[0]
+            return list(convs), self.model.vote(list(preds))
+
+        return forward
+
+    def _build_gradcam_fn(self):
+        """
+        Build the Grad-CAM graph once at load time.
+        Returns a compiled fn(x, class_index) -> (probs, conv_out, grads), a
+        single pass giving probabilities, activations and gradients together.
+        class_index < 0 means "explain the predicted class".
+        """
+        forward = self._ensemble_cam_forward()
+        if forward is None:
+            return None
+
+        input_shape = [None] + list(self.model.input_shape[1:])
+
+        @tf.function(input_signature=[
+            tf.TensorSpec(input_shape, tf.float32),
+            tf.TensorSpec([None], tf.int32),
+        ])
+        def gradcam_fn(x, class_index):
+            with tf.GradientTape() as tape:
+                convs, preds = forward(x, tape)
+                predicted = tf.argmax(preds, axis=1, output_type=tf.int32)
+                target = tf.where(class_index >= 0, class_index, predicted)
+                # Samples are independent, so the gradient of the summed scores
+                # gives each image its own gradient.
+                class_score = tf.gather(preds, target, axis=1, batch_dims=1)
+            grads = tape.gradient(class_score, convs)
+            return preds, tf.concat(convs, axis=-1), tf.concat(grads, axis=-1)
+
+        return gradcam_fn
+
+    def _build_all_class_cam_fn(self):
+        """
+        Compiled fn(x) -> (probs (B, C), heatmaps (B, C, h, w)): Grad-CAM of
+        every class from one forward pass. batch_jacobian vectorizes the C
+        backward passes (d score_c / d conv for all c at once), and the
+        reduction to heatmaps happens in-graph so only the small maps leave it.
+        """
+        forward = self._ensemble_cam_forward()
+        if forward is None:
+            return None
+
+        input_shape = [None] + list(self.model.input_shape[1:])
+
+        @tf.function(input_signature=[tf.TensorSpec(input_shape, tf.float32)])
+        def all_class_cam_fn(x):
+            with tf.GradientTape(persistent=True) as tape:
+                convs, preds = forward(x, tape)
+            heatmaps = 0.0
+            for conv in convs:
+                # (B, C, h, w, k) -> channel weights (B, C, k)
+                jacobian = tape.batch_jacobian(preds, conv)
+                weights = tf.reduce_mean(jacobian, axis=[2, 3])
+                heatmaps += tf.einsum("bhwk,bck->bchw", conv, weights)
+            del tape
+            heatmaps = tf.nn.relu(heatmaps)
+            heatmaps /= tf.reduce_max(heatmaps, axis=[2, 3], keepdims=True) + 1e-8
+            return preds, heatmaps
+
+        return all_class_cam_fn
+
+    @staticmethod
+    def _heatmaps_from_grads(conv_out, grads):
+        """(B, h, w, k) activations + gradients -> (B, h, w) heatmaps in [0, 1]"""
+        pooled_grads = np.mean(grads, axis=(1, 2), keepdims=True)
+        heatmap = np.sum(conv_out * pooled_grads, axis=-1)
+        heatmap = np.maximum(heatmap, 0)
+        heatmap /= (np.max(heatmap, axis=(1, 2), keepdims=True) + 1e-8)
+        return heatmap
+
+    def forward_with_cam(self, img_batch):
+        """
+        Fused pass: class probabilities and Grad-CAM of the predicted class.
+        Returns (probs (B, C), heatmaps (B, h, w) or None if Grad-CAM is unavailable).
+        """
+        if not self.model:
+            raise Exception("Model not loaded.")
+        if self._gradcam_fn is None:
+            return self.predict_proba(img_batch), None
 
-        conv_out = conv_out[0]
-        heatmap = tf.reduce_sum(conv_out * pooled_grads, axis=-1)
+        img_batch = tf.convert_to_tensor(img_batch, dtype=tf.float32)
+        class_index = -tf.ones([tf.shape(img_batch)[0]], dtype=tf.int32)
+        preds, conv_out, grads = self._gradcam_fn(img_batch, class_index)
+        return preds.numpy(), self._heatmaps_from_grads(conv_out.numpy(), grads.numpy())
 
-        heatmap = tf.maximum(heatmap, 0)
-        heatmap /= (tf.reduce_max(heatmap) + 1e-8)
+    def forward_with_all_cams(self, img_batch):
+        """
+        Class probabilities and Grad-CAM of every class, for the whole batch.
+        Returns (probs (B, C), heatmaps (B, C, h, w) or None if Grad-CAM is unavailable).
+        """
+        if not self.model:
+            raise Exception("Model not loaded.")
+        if self._all_class_cam_fn is None:
+            return self.predict_proba(img_batch), None
+
+        preds, heatmaps = self._all_class_cam_fn(tf.convert_to_tensor(img_batch, dtype=tf.float32))
+        return preds.numpy(), heatmaps.numpy()
+
+    def infer_batch(self, img_batch, with_cam=True):
+        """
+        Per-image (probs, heatmaps) pairs for the batch scheduler, heatmaps
+        being (C, h, w): one Grad-CAM per class, at the cost of one.
+        with_cam=False runs the plain forward pass; heatmaps are then None.
+        """
+        if not with_cam:
+            return [(p, None) for p in self.predict_proba(img_batch)]
+        probs, heatmaps = self.forward_with_all_cams(img_batch)
+        if heatmaps is None:
+            return [(p, None) for p in probs]
+        return list(zip(probs, heatmaps))
+
+    def make_gradcam_heatmap(self, img_array, pred_index):
+        if not self.model or self._gradcam_fn is None:
+             return None
 
-        return heatmap.numpy()
+        img_array = tf.convert_to_tensor(img_array, dtype=tf.float32)
+        class_index = tf.fill([tf.shape(img_array)[0]], tf.cast(pred_index, tf.int32))
+        _, conv_out, grads = self._gradcam_fn(img_array, class_index)
+        return self._heatmaps_from_grads(conv_out.numpy(), grads.numpy())[0]
 
-    def predict(self, img_array, original_image_bgr):
+    def predict_proba(self, img_batch):
+        """
+        Class probabilities for a batch of preprocessed images.
+        img_batch: (B, 224, 224, 3) float32 -> (B, num_classes)
+        """
+        if not self.model:
+            raise Exception("Model not loaded.")
+        if self.backend == "tflite":
+            return self.model.predict(img_batch)
+        img_batch = tf.convert_to_tensor(img_batch, dtype=tf.float32)
+        return self._serving_fn(img_batch).numpy()
+
+    def predict_tta(self, views_batch):
+        """
+        Test-time augmentation: score the (V, 224, 224, 3) augmented views of
+        one image (preprocess_image(..., tta_views=V)) in one batched call.
+        Returns (averaged probabilities (C,), spread across views).
+        """
+        return average_views(self.predict_proba(views_batch))
+
+    def predict(self, img_array, original_image_bgr, probabilities=None, heatmap=None):
         """
         Returns:
             label (str)
             confidence (float)
             gradcam_overlay (np.ndarray)
+
+        probabilities / heatmap: optional precomputed results for this image
+        (e.g. from the batch scheduler), which skip the fused pass here.
         """
         if not self.model:
             raise Exception("Model not loaded.")
 
-        print(f"Running inference on shape: {img_array.shape}")
-        
-        # Inference
-        prediction = self.model.predict(img_array)
+        # Inference (probabilities + Grad-CAM from one fused pass)
+        if probabilities is None:
+            prediction, heatmaps = self.forward_with_cam(img_array)
+            heatmap = heatmaps[0] if heatmaps is not None else None
+        else:
+            prediction = np.asarray(probabilities).reshape(1, -1)
         # prediction shape is (1, 5)
         
-        print("\n--- INFERENCE RESULTS ---")
-        print("Raw Probabilities:", prediction[0])
-        
-        pred_index = np.argmax(prediction[0])
-        confidence = float(prediction[0][pred_index])
-        
-        # Use dynamically loaded classes
-        if self.classes and pred_index < len(self.classes):
-            label = self.classes[pred_index]
-        else:
-            label = "Unknown"
-            
-        print(f"Predicted: {label} ({confidence:.4f})")
-        print("-------------------------\n")
+        label, confidence, pred_index = top_label(self.classes, prediction[0])
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Raw probabilities %s -> %s (%.4f)", np.round(prediction[0], 4).tolist(), label, confidence)
 
         # Grad-CAM
-        heatmap = None
         try:
-            heatmap = self.make_gradcam_heatmap(img_array, pred_index)
-            if heatmap is not None:
-                heatmap = cv2.resize(
-                    heatmap,
-                    (original_image_bgr.shape[1], original_image_bgr.shape[0])
-                )
+            if heatmap is None and probabilities is not None:
+                heatmap = self.make_gradcam_heatmap(img_array, pred_index)
+            overlay = render_overlay(original_image_bgr, heatmap)
         except Exception as e:
-            print(f"Grad-CAM warning: {e}")
-            heatmap = None
-
-        if heatmap is not None:
-            heatmap = np.uint8(255 * heatmap)
-            heatmap = cv2.applyColorMap(heatmap, cv2.COLORMAP_JET)
-            # heatmap is BGR from applyColorMap, original_image_bgr is BGR
-            
-            overlay = cv2.addWeighted(
-                original_image_bgr, 0.6,
-                heatmap, 0.4,
-                0
-            )
-        else:
-             overlay = original_image_bgr
+            logger.warning("Grad-CAM failed: %s", e)
+            overlay = original_image_bgr
 
         return label, confidence, overlay
@@ -0,0 +1,69 @@
+import os
+
+# Model configuration shared by the API process and the standalone model server.
+# TensorFlow is only imported inside load_dr_model(), so importing this is cheap.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_DIR = os.path.join(BASE_DIR, "converted_keras")
+# Serialized copies of loaded models keyed by source file hash (empty to disable)
+MODEL_CACHE_DIR = os.environ.get("MODEL_CACHE_DIR", os.path.join(BASE_DIR, "model_cache")) or None
+
+# Micro-batching: concurrent /analyze calls share one forward pass
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", "5"))
+# Trace + warm the compiled inference path for every batch size the scheduler can form
+WARMUP_BATCH_SIZES = [
+    int(n) for n in os.environ.get("WARMUP_BATCH_SIZES", ",".join(str(n) for n in range(1, BATCH_MAX_SIZE + 1))).split(",")
+    if n.strip()
+]
+
+# Shared model server (model_server.py): "host:port" or a unix socket path.
+# When set, API workers send tensors there instead of loading the model themselves.
+MODEL_SERVER_ADDRESS = os.environ.get("MODEL_SERVER_ADDRESS") or None
+# Shared secret of model server connections. multiprocessing.connection unpickles
+# what it receives, so anyone holding the key can run code on the other side:
+# TCP addresses need an explicit, non-default key; unix sockets fall back to a
+# built-in one (access is governed by the socket file's permissions).
+MODEL_SERVER_AUTHKEY = (os.environ.get("MODEL_SERVER_AUTHKEY") or "").encode() or None
+_UNIX_SOCKET_AUTHKEY = b"optiretina"
+
+
+def parse_address(address):
+    """'host:port' -> (host, port) for TCP, anything else is a unix socket path."""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return (host or "127.0.0.1", int(port))
+    return address
+
+
+def resolve_authkey(address, authkey=MODEL_SERVER_AUTHKEY):
+    """authkey to use for one parsed address; refuses TCP without an explicit secret."""
+    if isinstance(address, tuple):
+        if not authkey or authkey == _UNIX_SOCKET_AUTHKEY:
+            raise RuntimeError(
+                f"Set MODEL_SERVER_AUTHKEY to a secret before using a TCP model server "
+                f"address ({address[0]}:{address[1]})."
+            )
+        return authkey
+    return authkey or _UNIX_SOCKET_AUTHKEY
+
+
+def load_dr_model():
+    from ml_model import DRModel
+
+    print("Initializing AI Model...")
+    # K-fold ensembles: ENSEMBLE_VOTING=mean|weighted, ENSEMBLE_WEIGHTS=w1,w2,...
+    dr_model = DRModel(
+        MODEL_DIR,
+        voting=os.environ.get("ENSEMBLE_VOTING", "mean"),
+        weights=os.environ.get("ENSEMBLE_WEIGHTS") or None,
+        # MODEL_BACKEND=tflite serves TFLITE_MODEL (needs a passing verify_quantized.py report)
+        backend=os.environ.get("MODEL_BACKEND", "keras"),
+        tflite_model=os.environ.get("TFLITE_MODEL", "model_int8.tflite"),
+        require_parity=os.environ.get("ALLOW_UNVERIFIED_TFLITE", "0") != "1",
+        cache_dir=MODEL_CACHE_DIR,
+    )
+    if not dr_model.model:
+        raise RuntimeError("No model file found.")
+    dr_model.warmup(WARMUP_BATCH_SIZES)
+    return dr_model
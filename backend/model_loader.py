@@ -0,0 +1,71 @@
+import threading
+import time
+
+from telemetry import logger
+
+
+class ModelNotReady(Exception):
+    """Raised when a request needs the model before it finished loading."""
+
+    def __init__(self, state, error=None):
+        detail = f"Model is {state}" + (f": {error}" if error else "")
+        super().__init__(detail)
+        self.state = state
+
+
+class BackgroundModelLoader:
+    """
+    Builds the model on a background thread so the server can start answering
+    liveness checks immediately. State goes loading -> ready | failed.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.state = "loading"
+        self.error = None
+        self.load_seconds = None
+        self._model = None
+        self._ready = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._load, name="model-loader", daemon=True)
+            self._thread.start()
+
+    def _load(self):
+        start = time.perf_counter()
+        try:
+            model = self.factory()
+        except Exception as e:
+            logger.exception("Model failed to load")
+            self.error = str(e)
+            self.state = "failed"
+        else:
+            self._model = model
+            self.state = "ready"
+        finally:
+            self.load_seconds = time.perf_counter() - start
+            self._ready.set()
+        logger.info("Model %s after %.1fs", self.state, self.load_seconds)
+
+    def wait(self, timeout=None):
+        """Block until loading finished (either way). Returns True if ready."""
+        self._ready.wait(timeout)
+        return self.state == "ready"
+
+    def get(self):
+        """The loaded model, or ModelNotReady while loading / after a failure."""
+        if self.state != "ready":
+            raise ModelNotReady(self.state, self.error)
+        return self._model
+
+    def status(self):
+        return {
+            "state": self.state,
+            "error": self.error,
+            "load_seconds": self.load_seconds,
+        }
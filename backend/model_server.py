@@ -0,0 +1,441 @@
+import argparse
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Client, Listener
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from batching import BatchScheduler
+from explain import render_overlay, top_label
+from model_config import (
+    BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, MODEL_SERVER_ADDRESS, MODEL_SERVER_AUTHKEY,
+    load_dr_model, parse_address, resolve_authkey,
+)
+from telemetry import setup_logging
+
+logger = logging.getLogger("optiretina.model_server")
+
+# Shared model server for multi-worker deployments.
+# Usage: MODEL_SERVER_ADDRESS=/tmp/optiretina-model.sock python model_server.py
+#        MODEL_SERVER_ADDRESS=/tmp/optiretina-model.sock uvicorn main:app --workers 4
+#        MODEL_SERVER_ADDRESS=10.0.0.5:7070 MODEL_SERVER_AUTHKEY=<secret> ...   # TCP needs a secret
+#
+# One server process owns the model and the batch scheduler, so every web worker's
+# traffic lands in the same batches and the weights live in memory once. Several
+# servers (replicas) can be listed comma-separated in MODEL_SERVER_ADDRESS.
+#
+# Tensors never go through pickle: each client connection owns a SharedMemory
+# segment laid out as [inputs | probabilities | per-class heatmaps] for up to
+# max_batch_size images. The client writes inputs, sends a tiny control message
+# with the segment name and image count, and reads the outputs the server wrote
+# in place.
+# Classification and Grad-CAM requests are batched separately ("cam" flag), so
+# background explanations never slow down the plain forward passes.
+
+
+def _segment_shapes(max_items, input_shape, num_classes, cam_shape):
+    return [
+        (max_items,) + tuple(input_shape),
+        (max_items, num_classes),
+        (max_items,) + tuple(cam_shape or (0,)),
+    ]
+
+
+def segment_size(info):
+    """Bytes of shared memory one connection needs, from the server's hello info."""
+    shapes = _segment_shapes(info["max_batch_size"], info["input_shape"], info["num_classes"], info["cam_shape"])
+    return 4 * sum(int(np.prod(shape)) for shape in shapes)
+
+
+def segment_views(buf, info):
+    """(inputs, probs, cams) float32 views into one shared segment."""
+    shapes = _segment_shapes(info["max_batch_size"], info["input_shape"], info["num_classes"], info["cam_shape"])
+    views, offset = [], 0
+    for shape in shapes:
+        views.append(np.ndarray(shape, dtype=np.float32, buffer=buf, offset=offset))
+        offset += 4 * int(np.prod(shape))
+    return views
+
+
+class ModelServer:
+    """Serves one DRModel replica to any number of client connections."""
+
+    def __init__(self, model, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS):
+        self.model = model
+        self.scheduler = BatchScheduler(
+            lambda batch: model.infer_batch(batch, with_cam=False), max_batch_size, max_wait_ms
+        )
+        self.cam_scheduler = BatchScheduler(model.infer_batch, max_batch_size, max_wait_ms)
+
+        input_shape = tuple(int(d) for d in model.model.input_shape[1:])
+        probs, cams = model.forward_with_all_cams(np.zeros((1,) + input_shape, dtype=np.float32))
+        self.info = {
+            "classes": model.classes,
+            "backend": model.backend,
+            "ensemble": model.ensemble_info(),
+            "model_paths": model.model_paths,
+            # Hashed here: the paths only exist on this host, not in the API workers
+            "model_fingerprint": model.model_fingerprint(),
+            "input_shape": input_shape,
+            "num_classes": int(probs.shape[-1]),
+            "cam_shape": tuple(cams.shape[1:]) if cams is not None else None,
+            "max_batch_size": self.scheduler.max_batch_size,
+            "pid": os.getpid(),
+        }
+
+    def serve_forever(self, address, authkey=MODEL_SERVER_AUTHKEY):
+        authkey = resolve_authkey(address, authkey)
+        if isinstance(address, str) and os.path.exists(address):
+            os.unlink(address)  # stale socket from a previous run
+        with Listener(address, authkey=authkey) as listener:
+            logger.info("Model server listening on %s (pid %d)", address, os.getpid())
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    logger.warning("Model server rejected connection: %s", e)
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), name="model-client", daemon=True).start()
+
+    def _attach(self, name):
+        shm = SharedMemory(name=name)
+        # The client owns (and unlinks) the segment; don't let this process's tracker remove it
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm, segment_views(shm.buf, self.info)
+
+    @staticmethod
+    def _detach(segment):
+        shm, views = segment
+        views.clear()
+        shm.close()
+
+    def _handle(self, conn):
+        segment = None
+        try:
+            while True:
+                msg = conn.recv()
+                op = msg.get("op")
+                if op == "hello":
+                    conn.send(self.info)
+                elif op == "stats":
+                    conn.send(dict(self.scheduler.stats(), explain=self.cam_scheduler.stats()))
+                elif op == "infer":
+                    if segment is None or segment[0].name != msg["shm"]:
+                        if segment is not None:
+                            self._detach(segment)
+                        segment = self._attach(msg["shm"])
+                    conn.send(self._infer(segment[1], msg["count"], msg.get("cam", False)))
+                else:
+                    conn.send({"ok": False, "error": f"Unknown op {op!r}"})
+        except (EOFError, ConnectionError):
+            pass
+        finally:
+            if segment is not None:
+                self._detach(segment)
+            conn.close()
+
+    def _infer(self, views, count, with_cam):
+        inputs, probs_out, cams_out = views
+        if not 0 < count <= len(inputs):
+            return {"ok": False, "error": f"Bad image count {count}"}
+        scheduler = self.cam_scheduler if with_cam else self.scheduler
+        try:
+            # One local copy so no array outlives the shared segment inside the scheduler
+            batch = np.array(inputs[:count])
+            futures = scheduler.submit_many(list(batch))
+            has_cam = with_cam
+            for i, future in enumerate(futures):
+                probs, heatmap = future.result()
+                probs_out[i] = probs
+                if heatmap is None:
+                    has_cam = False
+                else:
+                    cams_out[i] = heatmap
+        except Exception as e:
+            return {"ok": False, "error": str(e)}
+        return {"ok": True, "has_cam": has_cam and self.info["cam_shape"] is not None}
+
+
+class _Channel:
+    """One client connection plus the shared segment it exchanges tensors through."""
+
+    def __init__(self, address, authkey):
+        self.conn = Client(address, authkey=authkey)
+        self.conn.send({"op": "hello"})
+        self.info = self.conn.recv()
+        self.shm = None  # allocated on first inference
+
+    def _segment(self):
+        if self.shm is None:
+            self.shm = SharedMemory(create=True, size=segment_size(self.info))
+            self.inputs, self.probs, self.cams = segment_views(self.shm.buf, self.info)
+
+    def request(self, msg):
+        self.conn.send(msg)
+        return self.conn.recv()
+
+    def infer(self, imgs, with_cam=False):
+        """imgs: list of (H, W, C) / (1, H, W, C) arrays -> [(probs, heatmap | None)]"""
+        self._segment()
+        for i, img in enumerate(imgs):
+            self.inputs[i] = img[0] if img.ndim == 4 else img
+        reply = self.request({"op": "infer", "shm": self.shm.name, "count": len(imgs), "cam": with_cam})
+        if not reply.get("ok"):
+            raise RuntimeError(f"Model server error: {reply.get('error')}")
+        return [
+            (self.probs[i].copy(), self.cams[i].copy() if reply["has_cam"] else None)
+            for i in range(len(imgs))
+        ]
+
+    def close(self):
+        try:
+            self.conn.close()
+        finally:
+            # Always release the segment, even if the socket is already broken
+            if self.shm is not None:
+                self.inputs = self.probs = self.cams = None
+                self.shm.close()
+                self.shm.unlink()
+                self.shm = None
+
+
+class RemoteModel:
+    """
+    Client for one or more model servers. Stands in for both the DRModel
+    (classes, predict, ensemble_info, ...) and the BatchScheduler
+    (submit, submit_many, stats) inside an API worker, so the worker never
+    imports TensorFlow. Connections are pooled; each carries one request at a time.
+    """
+
+    # stats() serves a snapshot up to STATS_TTL old and waits at most STATS_TIMEOUT
+    # for a refresh, so /health and /metrics never hang on an unresponsive server
+    STATS_TTL = 5.0
+    STATS_TIMEOUT = 0.5
+    # A refresh running longer than this is given up on (its thread is left behind)
+    STATS_STUCK_AFTER = 30.0
+
+    def __init__(self, addresses, authkey=MODEL_SERVER_AUTHKEY, pool_size=BATCH_MAX_SIZE):
+        if isinstance(addresses, str):
+            addresses = [a.strip() for a in addresses.split(",") if a.strip()]
+        self.addresses = [parse_address(a) for a in addresses]
+        # Raises at startup for a TCP address without a secret
+        self.authkeys = {address: resolve_authkey(address, authkey) for address in self.addresses}
+        self.pool_size = max(1, int(pool_size))
+        self.info = None
+        self._idle = queue.LifoQueue()
+        self._next_address = itertools.cycle(self.addresses)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(self.pool_size, thread_name_prefix="model-client")
+        self._stats_lock = threading.Lock()
+        self._stats = None  # (collected at, {address: stats})
+        self._stats_refresh = None  # (started at, Event)
+
+    def connect(self):
+        """Handshake with every server (raises if one is down); returns self for the model loader."""
+        infos = []
+        for _ in self.addresses:
+            channel = self._open()
+            infos.append(channel.info)
+            self._idle.put(channel)
+        fingerprints = {(tuple(i["classes"]), i["model_fingerprint"], i["backend"]) for i in infos}
+        if len(fingerprints) != 1:
+            raise RuntimeError(f"Model servers disagree on the loaded model: {fingerprints}")
+        self.info = infos[0]
+        logger.info("Connected to %d model server(s), backend %s", len(self.addresses), self.info["backend"])
+        return self
+
+    def _open(self):
+        with self._lock:
+            address = next(self._next_address)
+        return _Channel(address, self.authkeys[address])
+
+    def _call(self, fn):
+        try:
+            channel = self._idle.get_nowait()
+        except queue.Empty:
+            channel = self._open()
+        reusable = False
+        try:
+            result = fn(channel)
+            reusable = True
+            return result
+        except (EOFError, OSError):
+            # Server went away: drop the connection, the next call reconnects
+            raise
+        except Exception:
+            # Error reply or bad input: the connection and its segment are still fine
+            reusable = True
+            raise
+        finally:
+            if reusable:
+                self._idle.put(channel)
+            else:
+                channel.close()
+
+    # -- DRModel surface -------------------------------------------------
+
+    @property
+    def classes(self):
+        return self.info["classes"]
+
+    @property
+    def backend(self):
+        return self.info["backend"]
+
+    @property
+    def model_paths(self):
+        return self.info["model_paths"]
+
+    def model_fingerprint(self):
+        return self.info["model_fingerprint"]
+
+    def ensemble_info(self):
+        return dict(self.info["ensemble"] or {}, model_servers=len(self.addresses))
+
+    def infer_batch(self, img_batch, with_cam=True):
+        results = []
+        step = self.info["max_batch_size"]
+        for start in range(0, len(img_batch), step):
+            chunk = list(img_batch[start:start + step])
+            results.extend(self._call(lambda channel: channel.infer(chunk, with_cam)))
+        return results
+
+    def predict(self, img_array, original_image_bgr, probabilities=None, heatmap=None):
+        """Same contract as DRModel.predict; the forward pass runs on the server."""
+        if probabilities is None:
+            probabilities, heatmaps = self.infer_batch(img_array)[0]
+            heatmap = heatmaps[int(np.argmax(probabilities))] if heatmaps is not None else None
+        label, confidence, _ = top_label(self.classes, probabilities)
+        try:
+            overlay = render_overlay(original_image_bgr, heatmap)
+        except Exception as e:
+            logger.warning("Grad-CAM failed: %s", e)
+            overlay = original_image_bgr
+        return label, confidence, overlay
+
+    # -- BatchScheduler surface -----------------------------------------
+
+    def submit(self, img, with_cam=False):
+        return self.submit_many([img], with_cam)[0]
+
+    def submit_many(self, imgs, with_cam=False):
+        """One request per max_batch_size chunk, so the server batches them together."""
+        futures = [Future() for _ in imgs]
+        step = self.info["max_batch_size"]
+        for start in range(0, len(imgs), step):
+            chunk, chunk_futures = imgs[start:start + step], futures[start:start + step]
+            self._executor.submit(self._run_chunk, chunk, chunk_futures, with_cam)
+        return futures
+
+    def _run_chunk(self, imgs, futures, with_cam):
+        # Skip callers that gave up (e.g. cancelled request)
+        live = [f for f in futures if f.set_running_or_notify_cancel()]
+        if not live:
+            return
+        try:
+            results = self._call(lambda channel: channel.infer(imgs, with_cam))
+        except Exception as e:
+            for f in live:
+                f.set_exception(e)
+            return
+        for f, result in zip(futures, results):
+            if f in live:
+                f.set_result(result)
+
+    def stats(self):
+        """
+        Batch scheduler stats of every model server, from a cached snapshot
+        refreshed in the background. "degraded" is set when the snapshot is
+        missing or stale because servers didn't answer in time.
+        """
+        now = time.monotonic()
+        with self._stats_lock:
+            snapshot, refresh = self._stats, self._stats_refresh
+            fresh = snapshot is not None and now - snapshot[0] < self.STATS_TTL
+            if not fresh and (refresh is None or now - refresh[0] > self.STATS_STUCK_AFTER):
+                refresh = self._stats_refresh = (now, threading.Event())
+                threading.Thread(
+                    target=self._refresh_stats, args=(refresh,), name="model-stats", daemon=True
+                ).start()
+        if not fresh:
+            refresh[1].wait(self.STATS_TIMEOUT)
+            with self._stats_lock:
+                snapshot = self._stats
+        if snapshot is None:
+            return {
+                "model_servers": {str(a): {"error": "stats not available yet"} for a in self.addresses},
+                "degraded": True,
+            }
+        age = time.monotonic() - snapshot[0]
+        return {
+            "model_servers": snapshot[1],
+            "stats_age_seconds": round(age, 2),
+            "degraded": age >= self.STATS_TTL or any("error" in s for s in snapshot[1].values()),
+        }
+
+    def _refresh_stats(self, refresh):
+        try:
+            servers = self._collect_stats()
+            with self._stats_lock:
+                self._stats = (time.monotonic(), servers)
+        finally:
+            with self._stats_lock:
+                if self._stats_refresh is refresh:
+                    self._stats_refresh = None
+            refresh[1].set()
+
+    def _collect_stats(self):
+        """One short-lived connection per server."""
+        servers = {}
+        for address in self.addresses:
+            try:
+                channel = _Channel(address, self.authkeys[address])
+                try:
+                    servers[str(address)] = dict(channel.request({"op": "stats"}), pid=channel.info["pid"])
+                finally:
+                    channel.close()
+            except Exception as e:
+                servers[str(address)] = {"error": str(e)}
+        return servers
+
+    def cam_scheduler(self):
+        """BatchScheduler-shaped view that asks the servers for Grad-CAM heatmaps too."""
+        return _CamScheduler(self)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+
+
+class _CamScheduler:
+    def __init__(self, remote):
+        self.remote = remote
+
+    def submit(self, img):
+        return self.remote.submit(img, with_cam=True)
+
+    def submit_many(self, imgs):
+        return self.remote.submit_many(imgs, with_cam=True)
+
+    def stats(self):
+        return self.remote.stats()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the DR model to API workers over shared memory.")
+    parser.add_argument("--address", default=MODEL_SERVER_ADDRESS or "/tmp/optiretina-model.sock",
+                        help="host:port or unix socket path (first entry of MODEL_SERVER_ADDRESS)")
+    args = parser.parse_args()
+    setup_logging()
+    address = parse_address(args.address.split(",")[0].strip())
+
+    server = ModelServer(load_dr_model())
+    server.serve_forever(address, MODEL_SERVER_AUTHKEY)
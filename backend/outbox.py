@@ -0,0 +1,150 @@
+import json
+import random
+import sqlite3
+import threading
+import time
+
+from telemetry import logger
+
+
+class Outbox:
+    """
+    Durable write-behind queue for database rows.
+    put() appends a record to a local SQLite (WAL) file and returns at once;
+    a background thread hands due records to flush_fn(records) in batches and
+    deletes them only after flush_fn returned. flush_fn must be idempotent on
+    the record "id" (e.g. an upsert), because a crash between the remote write
+    and the local delete replays the batch.
+
+    Failed records are kept and retried with capped, jittered exponential
+    backoff. The batch size halves on every failure and doubles again on
+    success, so one bad record ends up retried alone instead of holding back
+    the rest, and a database outage costs one small request per retry.
+    """
+
+    def __init__(self, path, flush_fn, batch_size=100, flush_interval=1.0, max_backoff=300.0):
+        self.path = path
+        self.flush_fn = flush_fn
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL: committed rows survive a process crash without an fsync per put
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA busy_timeout=5000")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            " id TEXT PRIMARY KEY,"
+            " payload TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_attempt_at REAL NOT NULL,"
+            " last_error TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (next_attempt_at)")
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._since_flush = 0
+        self._batch_limit = self.batch_size
+        self._flushed = 0
+        self._failures = 0
+        self._last_error = None
+        self._running = False
+        self._thread = None
+
+    def put(self, record):
+        """Queue one record (must carry a unique "id"). Re-queuing an id replaces it."""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO outbox (id, payload, created_at, next_attempt_at) VALUES (?, ?, ?, ?)",
+                (str(record["id"]), json.dumps(record), now, now),
+            )
+            self._since_flush += 1
+            if self._since_flush >= self.batch_size:
+                self._wake.set()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="outbox-flusher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        """Stop the flusher after one last flush attempt."""
+        self._running = False
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                full = self.flush_once()
+            except Exception:
+                logger.exception("Outbox flush crashed")
+                full = False
+            if not self._running:
+                return
+            if not full:
+                self._wake.wait(self.flush_interval)
+                self._wake.clear()
+
+    def flush_once(self):
+        """Flush one batch of due records. Returns True if the batch was full (more may be waiting)."""
+        with self._lock:
+            limit = self._batch_limit
+            rows = self._db.execute(
+                "SELECT id, payload, attempts FROM outbox WHERE next_attempt_at <= ?"
+                " ORDER BY next_attempt_at, created_at LIMIT ?",
+                (time.time(), limit),
+            ).fetchall()
+            self._since_flush = 0
+        if not rows:
+            return False
+
+        try:
+            self.flush_fn([json.loads(payload) for _, payload, _ in rows])
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            now = time.time()
+            with self._lock:
+                for row_id, _, attempts in rows:
+                    delay = min(self.max_backoff, self.flush_interval * 2 ** attempts)
+                    self._db.execute(
+                        "UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                        (attempts + 1, now + random.uniform(0.5, 1.0) * delay, error, row_id),
+                    )
+                self._failures += 1
+                self._last_error = error
+                self._batch_limit = max(1, limit // 2)
+            logger.warning("Outbox flush of %d record(s) failed, will retry: %s", len(rows), error)
+            return False
+
+        with self._lock:
+            self._db.executemany("DELETE FROM outbox WHERE id = ?", [(row_id,) for row_id, _, _ in rows])
+            self._flushed += len(rows)
+            self._batch_limit = min(self.batch_size, limit * 2)
+        return len(rows) == limit
+
+    def stats(self):
+        with self._lock:
+            pending, oldest, max_attempts = self._db.execute(
+                "SELECT COUNT(*), MIN(created_at), MAX(attempts) FROM outbox"
+            ).fetchone()
+            return {
+                "pending": pending,
+                "oldest_pending_seconds": time.time() - oldest if oldest else None,
+                "max_attempts": max_attempts or 0,
+                "flushed": self._flushed,
+                "failed_flushes": self._failures,
+                "batch_limit": self._batch_limit,
+                "last_error": self._last_error,
+                "running": self._thread is not None,
+            }
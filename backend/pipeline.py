@@ -0,0 +1,84 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telemetry import STAGE_QUEUE_SECONDS
+
+
+class StageOverloaded(Exception):
+    """Raised when a stage already holds as much work as it is allowed to queue."""
+
+    def __init__(self, stage):
+        super().__init__(f"Stage '{stage}' is at capacity, try again shortly.")
+        self.stage = stage
+
+
+class Stage:
+    """
+    A bounded worker pool for one step of the analysis pipeline.
+    At most `workers` jobs run at once and at most `max_queue` more may wait;
+    anything beyond that is rejected immediately with StageOverloaded so the
+    caller can shed load instead of piling up latency.
+    """
+
+    def __init__(self, name, workers, max_queue):
+        self.name = name
+        self.workers = max(1, int(workers))
+        self.max_queue = max(0, int(max_queue))
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"stage-{name}")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._rejected = 0
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self._in_flight >= self.workers + self.max_queue:
+                self._rejected += 1
+                raise StageOverloaded(self.name)
+            self._in_flight += 1
+        queued_at = time.perf_counter()
+
+        def job():
+            STAGE_QUEUE_SECONDS.observe(time.perf_counter() - queued_at, stage=self.name)
+            return fn(*args)
+
+        # Carry the caller's context (request id, spans) into the worker thread
+        context = contextvars.copy_context()
+        try:
+            future = self._executor.submit(context.run, job)
+        except BaseException:
+            self._release()
+            raise
+        # Released when the job itself ends (or is cancelled before starting),
+        # not when the caller stops waiting: a cancelled request's job still
+        # occupies a worker until it returns
+        future.add_done_callback(lambda _: self._release())
+        return await asyncio.wrap_future(future)
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "queued": max(0, self._in_flight - self.workers),
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def stage_from_env(name, default_workers, default_queue):
+    """Build a stage sized by <NAME>_WORKERS / <NAME>_QUEUE environment variables."""
+    prefix = name.upper()
+    workers = int(os.environ.get(f"{prefix}_WORKERS", default_workers))
+    max_queue = int(os.environ.get(f"{prefix}_QUEUE", default_queue))
+    return Stage(name, workers, max_queue)
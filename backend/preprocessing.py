@@ -2,8 +2,58 @@ import numpy as np
 import cv2
 from PIL import Image, ImageOps
 import io
+import os
 
-def preprocess_image(image_bytes: bytes):
+from quality import assess_quality
+
+# Exact-match path (full-resolution decode) for audits; fast draft decode otherwise
+PREPROCESS_EXACT = os.environ.get("PREPROCESS_EXACT", "0") == "1"
+
+# Fast path decodes to at least this multiple of the target size before LANCZOS
+DRAFT_OVERSAMPLE = 2
+
+
+def _rotate(degrees):
+    def rotate(image):
+        h, w = image.shape[:2]
+        matrix = cv2.getRotationMatrix2D((w / 2, h / 2), degrees, 1.0)
+        # Black fill matches the dark field around the fundus
+        return cv2.warpAffine(image, matrix, (w, h), flags=cv2.INTER_LINEAR, borderValue=(0, 0, 0))
+    return rotate
+
+
+def _brightness(factor):
+    return lambda image: cv2.convertScaleAbs(image, alpha=factor)
+
+
+# Test-time augmentation views, in the order they are added: view 0 is the
+# plain image, so tta_views=1 is exactly the normal path
+TTA_TRANSFORMS = [
+    ("identity", lambda image: image),
+    ("hflip", lambda image: image[:, ::-1]),
+    ("rot+10", _rotate(10)),
+    ("rot-10", _rotate(-10)),
+    ("bright+10%", _brightness(1.1)),
+    ("bright-10%", _brightness(0.9)),
+    ("vflip", lambda image: image[::-1]),
+    ("hflip+rot+10", lambda image: _rotate(10)(image[:, ::-1])),
+]
+TTA_MAX_VIEWS = len(TTA_TRANSFORMS)
+
+
+def augment_views(image_array, views):
+    """(224, 224, 3) uint8 RGB -> (views, 224, 224, 3) normalized model input."""
+    if not 1 <= views <= TTA_MAX_VIEWS:
+        raise ValueError(f"tta views must be between 1 and {TTA_MAX_VIEWS}, got {views}")
+    stacked = np.stack([np.ascontiguousarray(fn(image_array)) for _, fn in TTA_TRANSFORMS[:views]])
+    return (stacked.astype(np.float32) / 127.5) - 1.0
+
+def preprocess_image(image_bytes: bytes, exact: bool = None):
+    """preprocess_with_quality with just the verdict: (batch_img, image_array_bgr, is_noisy)."""
+    batch_img, image_array_bgr, quality = preprocess_with_quality(image_bytes, exact)
+    return batch_img, image_array_bgr, quality["noisy"]
+
+def preprocess_with_quality(image_bytes: bytes, exact: bool = None, tta_views: int = 1):
     """
     Preprocess image for Teachable Machine model (Keras).
     Logic matches the user's provided snippet:
@@ -11,12 +61,28 @@ def preprocess_image(image_bytes: bytes):
     2. Convert to RGB
     3. ImageOps.fit (Resize & Center Crop) to 224x224
     4. Normalize ((img / 127.5) - 1)
+
+    exact: False lets libjpeg decode JPEGs at 1/2, 1/4 or 1/8 scale in the
+    DCT domain (PIL draft mode) before the final resize, which avoids
+    decoding 3000-5000 px fundus images at full size. True keeps the original
+    full-resolution path. Defaults to the PREPROCESS_EXACT env switch.
+
+    tta_views: > 1 returns that many augmented views (TTA_TRANSFORMS) stacked
+    as batch_img, to be scored in one batched call and averaged.
     """
+    if exact is None:
+        exact = PREPROCESS_EXACT
+
+    size = (224, 224)
+
     # 1. Load image from bytes
-    image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    image = Image.open(io.BytesIO(image_bytes))
+    if not exact:
+        # No-op for non-JPEG formats
+        image.draft("RGB", (size[0] * DRAFT_OVERSAMPLE, size[1] * DRAFT_OVERSAMPLE))
+    image = image.convert("RGB")
 
     # 2. Resize & Crop (Teachable Machine standard)
-    size = (224, 224)
     image = ImageOps.fit(image, size, Image.Resampling.LANCZOS)
 
     # 3. Convert to Numpy Array
@@ -24,17 +90,24 @@ def preprocess_image(image_bytes: bytes):
 
     # 4. Normalize
     # (image_array.astype(np.float32) / 127.5) - 1
-    normalized_image_array = (image_array.astype(np.float32) / 127.5) - 1.0
-
-    # 5. Create Batch (1, 224, 224, 3)
-    batch_img = np.expand_dims(normalized_image_array, axis=0)
+    # 5. Create Batch (views, 224, 224, 3); a single view is (1, 224, 224, 3)
+    batch_img = augment_views(image_array, tta_views)
 
     # Return:
     # - batch_img: for model
     # - image_array_bgr: for OpenCV visualization/saving (converted from RGB)
-    # - is_noisy: Dummy flag (not checking noise anymore)
-    
+    # - quality: blur / SNR / exposure / disc coverage scores, "noisy" if any check failed
+
     # Convert RGB PIL array to BGR for OpenCV compatibility in other parts of the app
     image_array_bgr = cv2.cvtColor(image_array, cv2.COLOR_RGB2BGR)
-    
-    return batch_img, image_array_bgr, False
+
+    return batch_img, image_array_bgr, assess_quality(image_array_bgr)
+
+
+def model_input(processed_bgr):
+    """
+    Rebuild the (1, 224, 224, 3) model input from the stored BGR preview.
+    Exact: both come from the same uint8 array in preprocess_image.
+    """
+    image_array = cv2.cvtColor(processed_bgr, cv2.COLOR_BGR2RGB)
+    return np.expand_dims((image_array.astype(np.float32) / 127.5) - 1.0, axis=0)
@@ -0,0 +1,244 @@
+import io
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+_ID_PATTERN = re.compile(r"^[0-9a-fA-F-]{8,64}$")
+
+
+class AnalysisStore:
+    """
+    Everything needed to render an analysis' report later, kept on local disk:
+    <root>/<id>.json (fields) and <id>.npz (images). Writes are atomic, so a
+    report requested right after /analyze returns never sees half a file.
+    encode()/save_encoded() give the same files as bytes, for copies kept in
+    object storage; mark_stored() records that such a copy exists
+    (<id>.stored), and only those analyses are ever pruned.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def valid_id(analysis_id):
+        # Ids come from URLs; only accept our own uuid-style ids
+        return bool(_ID_PATTERN.fullmatch(analysis_id))
+
+    def _path(self, analysis_id, ext):
+        if not self.valid_id(analysis_id):
+            raise KeyError(analysis_id)
+        return os.path.join(self.root, f"{analysis_id}.{ext}")
+
+    @staticmethod
+    def encode(fields, images):
+        """(json bytes, npz bytes) of one analysis, exactly as save() writes them."""
+        npz = io.BytesIO()
+        np.savez(npz, **images)
+        return json.dumps(fields).encode("utf-8"), npz.getvalue()
+
+    def save(self, analysis_id, fields, images):
+        """fields: JSON-serialisable dict, images: name -> np.ndarray"""
+        self.save_encoded(analysis_id, *self.encode(fields, images))
+
+    def save_encoded(self, analysis_id, fields_json, images_npz):
+        """Store an analysis from encode()'s bytes."""
+        # The JSON goes last: its presence marks the analysis as complete
+        for ext, data in (("npz", images_npz), ("json", fields_json)):
+            path = self._path(analysis_id, ext)
+            with open(f"{path}.tmp", "wb") as f:
+                f.write(data)
+            os.replace(f"{path}.tmp", path)
+
+    def contains(self, analysis_id):
+        try:
+            return os.path.exists(self._path(analysis_id, "json"))
+        except KeyError:
+            return False
+
+    def read_encoded(self, analysis_id):
+        """(json bytes, npz bytes) of a stored analysis; KeyError if there is none."""
+        try:
+            with open(self._path(analysis_id, "json"), "rb") as f:
+                fields_json = f.read()
+            with open(self._path(analysis_id, "npz"), "rb") as f:
+                return fields_json, f.read()
+        except FileNotFoundError:
+            raise KeyError(analysis_id)
+
+    def mark_stored(self, analysis_id):
+        """Record that the analysis is safely kept elsewhere too, so it may be pruned here."""
+        with open(self._path(analysis_id, "stored"), "wb"):
+            pass
+
+    def _analyses(self):
+        """id -> (json mtime, stored, file names) for every complete analysis."""
+        files = {}
+        for name in os.listdir(self.root):
+            files.setdefault(name.partition(".")[0], []).append(name)
+        found = {}
+        for analysis_id, names in files.items():
+            try:
+                mtime = os.path.getmtime(os.path.join(self.root, f"{analysis_id}.json"))
+            except FileNotFoundError:
+                continue
+            found[analysis_id] = (mtime, f"{analysis_id}.stored" in names, names)
+        return found
+
+    def unstored(self, min_age_seconds=0):
+        """Ids of analyses at least min_age_seconds old without a mark_stored() copy."""
+        cutoff = time.time() - min_age_seconds
+        return [i for i, (mtime, stored, _) in self._analyses().items() if not stored and mtime <= cutoff]
+
+    def prune(self, max_age_seconds):
+        """
+        Delete analyses older than max_age_seconds that have a stored copy
+        elsewhere; returns how many went. Unstored ones are never deleted.
+        """
+        cutoff = time.time() - max_age_seconds
+        removed = 0
+        for analysis_id, (mtime, stored, names) in self._analyses().items():
+            if not stored or mtime >= cutoff:
+                continue
+            # The JSON goes first: without it the analysis no longer counts as present
+            for name in sorted(names, key=lambda n: n != f"{analysis_id}.json"):
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except FileNotFoundError:
+                    pass
+            removed += 1
+        return removed
+
+    def save_array(self, analysis_id, name, array):
+        """Attach one derived array (e.g. the Grad-CAM) to an existing analysis."""
+        path = self._path(analysis_id, f"{name}.npy")
+        with open(f"{path}.tmp", "wb") as f:
+            np.save(f, array)
+        os.replace(f"{path}.tmp", path)
+
+    def load_array(self, analysis_id, name):
+        """An array stored with save_array; KeyError if there is none."""
+        try:
+            return np.load(self._path(analysis_id, f"{name}.npy"))
+        except FileNotFoundError:
+            raise KeyError(analysis_id)
+
+    def load(self, analysis_id):
+        """(fields, images) for a stored analysis; KeyError if there is none."""
+        try:
+            with open(self._path(analysis_id, "json"), "r", encoding="utf-8") as f:
+                fields = json.load(f)
+            with np.load(self._path(analysis_id, "npz")) as data:
+                images = {name: data[name] for name in data.files}
+        except FileNotFoundError:
+            raise KeyError(analysis_id)
+        return fields, images
+
+
+class SingleFlight:
+    """Concurrent calls for the same key share one execution of fn."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}  # key -> Future
+        self.shared = 0
+
+    def run(self, key, fn):
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+            else:
+                self.shared += 1
+
+        if not owner:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._in_flight)
+
+
+class Uncached(bytes):
+    """Rendered bytes a ReportCache hands out but doesn't keep (e.g. a degraded fallback)."""
+
+
+class ReportCache:
+    """
+    Rendered report bytes, produced on first request by render_fn(report_id)
+    and kept in a size-bounded LRU. Concurrent requests for a report that is
+    still rendering wait for that one rendering instead of starting their own.
+    render_fn returns Uncached(...) for output the next request should redo.
+    """
+
+    def __init__(self, render_fn, max_bytes=64 * 1024 * 1024):
+        self.render_fn = render_fn
+        self.max_bytes = max(0, int(max_bytes))
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # report_id -> bytes
+        self._bytes = 0
+        self._flight = SingleFlight()
+        self._hits = 0
+        self._renders = 0
+
+    def get(self, report_id):
+        with self._lock:
+            data = self._entries.get(report_id)
+            if data is not None:
+                self._entries.move_to_end(report_id)
+                self._hits += 1
+                return data
+        return self._flight.run(report_id, lambda: self._render(report_id))
+
+    def _render(self, report_id):
+        with self._lock:
+            self._renders += 1
+        data = self.render_fn(report_id)
+        if not isinstance(data, Uncached):
+            self._remember(report_id, data)
+        return data
+
+    def _remember(self, report_id, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(report_id, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[report_id] = data
+            self._bytes += len(data)
+            # Evict least recently used until we fit the byte budget
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "renders": self._renders,
+                "shared_renders": self._flight.shared,
+                "rendering": self._flight.in_flight(),
+            }
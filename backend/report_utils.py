@@ -6,10 +6,12 @@ import os
 import datetime
 from PIL import Image
 
-def generate_pdf(user_id, prediction, confidence, original_img, gradcam_img, health_tips, pdf_path):
+def generate_pdf(user_id, prediction, confidence, original_img, gradcam_img, health_tips, pdf_path, created_at=None):
     """
     Generate a PDF report.
     original_img, gradcam_img: numpy arrays (RGB)
+    pdf_path: file path or binary file-like object (e.g. io.BytesIO)
+    created_at: datetime of the analysis (defaults to now)
     """
     c = canvas.Canvas(pdf_path, pagesize=letter)
     width, height = letter
@@ -20,7 +22,7 @@ def generate_pdf(user_id, prediction, confidence, original_img, gradcam_img, hea
     
     # Metadata
     c.setFont("Helvetica", 12)
-    c.drawString(50, height - 80, f"Date: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    c.drawString(50, height - 80, f"Date: {(created_at or datetime.datetime.now()).strftime('%Y-%m-%d %H:%M:%S')}")
     c.drawString(50, height - 100, f"Patient ID: {user_id}")
     
     # Prediction
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+from telemetry import logger
+
+
+class ResultCache:
+    """
+    Content-addressed cache of finished /analyze responses.
+    Keys are a hash of the uploaded bytes (plus any extra request fields that
+    end up in the report). Entries live in a size-bounded in-memory LRU and,
+    optionally, in JSON files under disk_dir. Everything is namespaced by
+    version_fn() (the model fingerprint), so replacing the model file drops
+    the memory tier and makes old disk entries unreachable.
+    """
+
+    def __init__(self, version_fn, max_bytes=32 * 1024 * 1024, disk_dir=None):
+        self.version_fn = version_fn
+        self.max_bytes = max(0, int(max_bytes))
+        self.disk_dir = disk_dir
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._bytes = 0
+        self._version = None
+        self._hits = 0
+        self._misses = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @staticmethod
+    def key(content, *extra):
+        h = hashlib.sha256(content)
+        for part in extra:
+            h.update(b"\0" + str(part).encode("utf-8"))
+        return h.hexdigest()
+
+    def _check_version(self):
+        """Drop everything cached for a previous model version. Returns current version."""
+        version = self.version_fn()
+        with self._lock:
+            if version == self._version:
+                return version
+            previous, self._version = self._version, version
+            self._entries.clear()
+            self._bytes = 0
+
+        if previous is not None:
+            logger.info("Model changed (%s -> %s), result cache invalidated.", previous, version)
+        if self.disk_dir:
+            # Only the current version's directory is ever read; clear the rest
+            for name in os.listdir(self.disk_dir):
+                if name != version:
+                    shutil.rmtree(os.path.join(self.disk_dir, name), ignore_errors=True)
+        return version
+
+    def _disk_path(self, version, key):
+        return os.path.join(self.disk_dir, version, f"{key}.json")
+
+    def get(self, key):
+        version = self._check_version()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return dict(entry[0])
+
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(version, key), "r", encoding="utf-8") as f:
+                    value = json.load(f)
+                self._remember(key, value)
+                with self._lock:
+                    self._hits += 1
+                return dict(value)
+            except (OSError, ValueError):
+                pass
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def put(self, key, value):
+        version = self._check_version()
+        self._remember(key, value)
+        if self.disk_dir:
+            path = self._disk_path(version, key)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(value, f)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning("Result cache disk write failed: %s", e)
+
+    def _remember(self, key, value):
+        size = len(json.dumps(value))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (dict(value), size)
+            self._bytes += size
+            # Evict least recently used until we fit the byte budget
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "disk_dir": self.disk_dir,
+            }
@@ -0,0 +1,186 @@
+import asyncio
+import os
+import random
+import urllib.parse
+
+import httpx
+
+# Async object storage for uploaded artifacts.
+# SupabaseStorage talks to the Storage REST API over one pooled HTTP/1.1 client;
+# LocalStorage writes to a directory and stands in for it in tests and offline runs.
+
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+
+class StorageError(Exception):
+    """An upload or download failed permanently (after retries, or with a non-retryable status)."""
+
+
+class SupabaseStorage:
+    """
+    Uploads with bounded retries (full-jitter exponential backoff) and
+    per-request timeouts. Uploads use x-upsert, so retrying an upload whose
+    first attempt actually landed is harmless. Public URLs are built locally
+    instead of asking the API for them.
+    """
+
+    def __init__(self, url, key, timeout=10.0, retries=3, backoff=0.25, max_connections=20):
+        self.url = url.rstrip("/")
+        self.key = key
+        self.timeout = httpx.Timeout(timeout, connect=min(timeout, 5.0))
+        self.retries = max(0, int(retries))
+        self.backoff = backoff
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._client = None
+
+    @property
+    def client(self):
+        # Created lazily so it binds to the server's event loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=f"{self.url}/storage/v1",
+                headers={"Authorization": f"Bearer {self.key}", "apikey": self.key},
+                timeout=self.timeout,
+                limits=self.limits,
+            )
+        return self._client
+
+    @staticmethod
+    def _quote(path):
+        return urllib.parse.quote(path, safe="/")
+
+    def public_url(self, bucket, path):
+        return f"{self.url}/storage/v1/object/public/{bucket}/{self._quote(path)}"
+
+    async def _request(self, method, url, **kwargs):
+        """The final response (success or non-retryable status); StorageError once retries run out."""
+        for attempt in range(self.retries + 1):
+            try:
+                response = await self.client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                error = f"{type(e).__name__}: {e}"
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                error = f"HTTP {response.status_code}: {response.text[:200]}"
+            if attempt < self.retries:
+                await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+        raise StorageError(error)
+
+    async def upload(self, bucket, path, data, content_type="application/octet-stream"):
+        """Upload bytes; returns the object's public URL or raises StorageError."""
+        headers = {"content-type": content_type, "x-upsert": "true"}
+        try:
+            response = await self._request("POST", f"/object/{bucket}/{self._quote(path)}", content=data, headers=headers)
+        except StorageError as e:
+            raise StorageError(f"Upload of {bucket}/{path} failed: {e}")
+        if response.status_code >= 300:
+            raise StorageError(f"Upload of {bucket}/{path} failed: HTTP {response.status_code}: {response.text[:200]}")
+        return self.public_url(bucket, path)
+
+    async def download(self, bucket, path):
+        """An object's bytes (authenticated, so private buckets work); KeyError if it doesn't exist."""
+        try:
+            response = await self._request("GET", f"/object/{bucket}/{self._quote(path)}")
+        except StorageError as e:
+            raise StorageError(f"Download of {bucket}/{path} failed: {e}")
+        # Storage answers a missing object with 400 "not_found" as well as 404
+        if response.status_code in (400, 404):
+            raise KeyError(f"{bucket}/{path}")
+        if response.status_code >= 300:
+            raise StorageError(f"Download of {bucket}/{path} failed: HTTP {response.status_code}: {response.text[:200]}")
+        return response.content
+
+    async def bucket_exists(self, bucket):
+        """False when the bucket is missing; StorageError when Storage can't be asked."""
+        try:
+            response = await self._request("GET", f"/bucket/{self._quote(bucket)}")
+        except StorageError as e:
+            raise StorageError(f"Checking bucket {bucket} failed: {e}")
+        if response.status_code in (400, 404):
+            return False
+        if response.status_code >= 300:
+            raise StorageError(f"Checking bucket {bucket} failed: HTTP {response.status_code}: {response.text[:200]}")
+        return True
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class LocalStorage:
+    """Same interface as SupabaseStorage, backed by <root>/<bucket>/<path>."""
+
+    def __init__(self, root, base_url=None):
+        self.root = os.path.abspath(root)
+        self.base_url = base_url.rstrip("/") if base_url else None
+
+    def _file_path(self, bucket, path):
+        full = os.path.abspath(os.path.join(self.root, bucket, path))
+        if not full.startswith(self.root + os.sep):
+            raise StorageError(f"Path escapes storage root: {bucket}/{path}")
+        return full
+
+    def public_url(self, bucket, path):
+        if self.base_url:
+            return f"{self.base_url}/{bucket}/{urllib.parse.quote(path, safe='/')}"
+        return "file://" + self._file_path(bucket, path)
+
+    def _write(self, bucket, path, data):
+        full = self._file_path(bucket, path)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        with open(f"{full}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{full}.tmp", full)
+
+    async def upload(self, bucket, path, data, content_type="application/octet-stream"):
+        try:
+            await asyncio.to_thread(self._write, bucket, path, data)
+        except OSError as e:
+            raise StorageError(f"Upload of {bucket}/{path} failed: {e}")
+        return self.public_url(bucket, path)
+
+    def _read(self, bucket, path):
+        with open(self._file_path(bucket, path), "rb") as f:
+            return f.read()
+
+    async def download(self, bucket, path):
+        try:
+            return await asyncio.to_thread(self._read, bucket, path)
+        except FileNotFoundError:
+            raise KeyError(f"{bucket}/{path}")
+        except OSError as e:
+            raise StorageError(f"Download of {bucket}/{path} failed: {e}")
+
+    async def bucket_exists(self, bucket):
+        # Bucket directories are created by the first upload
+        return True
+
+    async def aclose(self):
+        pass
+
+
+def storage_from_env(supabase_url=None, supabase_key=None):
+    """
+    STORAGE_BACKEND=supabase (default) or local (LOCAL_STORAGE_DIR, LOCAL_STORAGE_URL).
+    Tuning: STORAGE_TIMEOUT seconds, STORAGE_RETRIES, STORAGE_MAX_CONNECTIONS.
+    Returns None when Supabase is selected but not configured.
+    """
+    backend = os.environ.get("STORAGE_BACKEND", "supabase")
+    if backend == "local":
+        return LocalStorage(
+            os.environ.get("LOCAL_STORAGE_DIR", "storage"),
+            os.environ.get("LOCAL_STORAGE_URL") or None,
+        )
+    if backend != "supabase":
+        raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}")
+    if not supabase_url or not supabase_key:
+        return None
+    return SupabaseStorage(
+        supabase_url,
+        supabase_key,
+        timeout=float(os.environ.get("STORAGE_TIMEOUT", "10")),
+        retries=int(os.environ.get("STORAGE_RETRIES", "3")),
+        max_connections=int(os.environ.get("STORAGE_MAX_CONNECTIONS", "20")),
+    )
@@ -0,0 +1,155 @@
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+
+# Teachable Machine image models are MobileNetV2 (alpha 0.35) feature extractors
+# with a two-layer dense head, exported as TF.js layers (model.json + weights.bin).
+
+TFJS_DTYPES = {"float32": np.float32, "int32": np.int32, "uint8": np.uint8, "uint16": np.uint16, "bool": np.bool_}
+
+# TF.js (Keras 2) weight names -> Keras 3 variable names, where they differ
+VARIABLE_ALIASES = {"depthwise_kernel": "kernel"}
+
+
+def tfjs_model_files(model_json_path):
+    """model.json plus its weight shard files, in manifest order."""
+    with open(model_json_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)["weightsManifest"]
+    base = os.path.dirname(model_json_path)
+    return [model_json_path] + [os.path.join(base, p) for group in manifest for p in group["paths"]]
+
+
+def read_tfjs_weights(model_json_path):
+    """
+    Map weight name -> np.ndarray, read straight out of memory-mapped shards.
+    Arrays are views into the shard files unless a weight straddles two shards
+    or is stored quantized.
+    """
+    with open(model_json_path, "r", encoding="utf-8") as f:
+        model_json = json.load(f)
+    base = os.path.dirname(model_json_path)
+
+    weights = {}
+    for group in model_json["weightsManifest"]:
+        shards = [np.memmap(os.path.join(base, p), dtype=np.uint8, mode="r") for p in group["paths"]]
+        bounds = np.cumsum([0] + [len(s) for s in shards])
+        offset = 0
+        for entry in group["weights"]:
+            shape = tuple(entry["shape"])
+            quant = entry.get("quantization")
+            dtype = np.dtype(TFJS_DTYPES[quant["dtype"] if quant else entry["dtype"]])
+            nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+
+            if offset + nbytes > bounds[-1]:
+                raise ValueError(f"Weight {entry['name']} runs past the end of {group['paths']}")
+            first = int(np.searchsorted(bounds, offset, side="right") - 1)
+            last = int(np.searchsorted(bounds, offset + nbytes, side="left") - 1) if nbytes else first
+            if first == last:
+                start = offset - bounds[first]
+                raw = shards[first][start:start + nbytes]
+            else:
+                # Straddles shards: this one weight has to be copied together
+                raw = np.concatenate([
+                    shards[i][max(offset, bounds[i]) - bounds[i]:min(offset + nbytes, bounds[i + 1]) - bounds[i]]
+                    for i in range(first, last + 1)
+                ])
+
+            array = raw.view(dtype).reshape(shape)
+            if quant:
+                array = array.astype(np.float32) * quant["scale"] + quant["min"]
+            weights[entry["name"]] = array
+            offset += nbytes
+
+        if offset != bounds[-1]:
+            raise ValueError(f"Manifest describes {offset} bytes but shards hold {bounds[-1]}")
+    return weights
+
+
+def _topology_head(model_json):
+    """(hidden units, num classes, output bias?) from the exported dense head."""
+    dense = []
+
+    def walk(layer):
+        if layer.get("class_name") == "Dense":
+            dense.append(layer["config"])
+        for child in layer.get("config", {}).get("layers", []) if isinstance(layer.get("config"), dict) else []:
+            walk(child)
+
+    walk(model_json["modelTopology"])
+    if len(dense) != 2:
+        raise ValueError(f"Expected a two-layer dense head, found {len(dense)} Dense layers")
+    return dense[0]["units"], dense[1]["units"], dense[1].get("use_bias", True)
+
+
+def build_tm_model(model_json):
+    """Prebuilt Keras graph matching the Teachable Machine export topology."""
+    hidden_units, num_classes, output_bias = _topology_head(model_json)
+    base = tf.keras.applications.MobileNetV2(
+        input_shape=(224, 224, 3),
+        alpha=0.35,
+        include_top=False,
+        weights=None,
+        name='sequential_1'
+    )
+    gap = tf.keras.layers.GlobalAveragePooling2D(name='global_average_pooling2d_GlobalAveragePooling2D1')
+    head = tf.keras.Sequential([
+        tf.keras.Input(shape=(base.output.shape[-1],)),
+        tf.keras.layers.Dense(hidden_units, activation='relu', name='dense_Dense1'),
+        tf.keras.layers.Dense(num_classes, activation='softmax', use_bias=output_bias, name='dense_Dense2')
+    ], name='sequential_3')
+    return tf.keras.Sequential([tf.keras.Input(shape=(224, 224, 3)), base, gap, head], name='sequential_4')
+
+
+def _named_variables(model):
+    """Every variable keyed the way TF.js names it: '<layer>/<variable>'."""
+    named = {}
+
+    def walk(layer):
+        sublayers = getattr(layer, "layers", None)
+        if sublayers:
+            for sub in sublayers:
+                walk(sub)
+            return
+        for var in layer.weights:
+            named[f"{layer.name}/{var.name}"] = var
+
+    walk(model)
+    return named
+
+
+def load_tfjs_model(model_json_path):
+    """
+    Build the Teachable Machine graph and fill it from the TF.js weights.
+    Every exported tensor must match exactly one model variable with the same
+    shape, and every variable must be covered; anything else raises ValueError
+    instead of silently leaving weights at their random initialisation.
+    """
+    with open(model_json_path, "r", encoding="utf-8") as f:
+        model_json = json.load(f)
+
+    model = build_tm_model(model_json)
+    variables = _named_variables(model)
+    weights = read_tfjs_weights(model_json_path)
+
+    assigned = set()
+    errors = []
+    for name, array in weights.items():
+        layer_name, _, var_name = name.rpartition("/")
+        key = f"{layer_name}/{VARIABLE_ALIASES.get(var_name, var_name)}"
+        var = variables.get(key)
+        if var is None:
+            errors.append(f"{name}: no matching model variable")
+        elif tuple(var.shape) != array.shape:
+            errors.append(f"{name}: shape {array.shape} != model {tuple(var.shape)}")
+        else:
+            var.assign(array)
+            assigned.add(key)
+
+    missing = sorted(set(variables) - assigned)
+    if missing:
+        errors.append(f"model variables without exported weights: {missing}")
+    if errors:
+        raise ValueError("TF.js weights do not match the model:\n  " + "\n  ".join(errors))
+    return model
@@ -0,0 +1,98 @@
+import json
+import os
+import threading
+
+import numpy as np
+import tensorflow as tf
+
+from fileutils import file_fingerprint
+
+# verify_quantized.py writes <model>.tflite.parity.json next to the model
+PARITY_SUFFIX = ".parity.json"
+# export_tflite.py records which images an int8 model was calibrated on in
+# <model>.tflite.calibration.json, so verification can keep its holdout apart
+CALIBRATION_SUFFIX = ".calibration.json"
+
+
+def parity_report_path(tflite_path):
+    return tflite_path + PARITY_SUFFIX
+
+
+def calibration_record_path(tflite_path):
+    return tflite_path + CALIBRATION_SUFFIX
+
+
+def check_parity_report(tflite_path, source_paths):
+    """
+    A quantized model may only serve if verify_quantized.py passed for exactly
+    this .tflite file and the float model it was exported from.
+    Raises ValueError otherwise.
+    """
+    path = parity_report_path(tflite_path)
+    if not os.path.exists(path):
+        raise ValueError(f"No parity report at {path}; run verify_quantized.py first.")
+    with open(path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+
+    if not report.get("passed"):
+        raise ValueError(f"Parity check failed for {tflite_path}: {report.get('reason', 'see report')}")
+    if report.get("tflite_fingerprint") != file_fingerprint(tflite_path):
+        raise ValueError(f"{tflite_path} changed since its parity check.")
+    source = "-".join(file_fingerprint(p) for p in source_paths)
+    if report.get("source_fingerprint") != source:
+        raise ValueError(f"Float model changed since {tflite_path} was verified; re-export and re-verify.")
+    return report
+
+
+class TFLiteModel:
+    """
+    Batched inference on a (possibly int8/float16 quantized) TFLite model.
+    Interpreters are not thread-safe and resizing the input reallocates
+    tensors, so one interpreter is kept per batch size behind a lock.
+    """
+
+    def __init__(self, path, num_threads=None):
+        self.path = path
+        self.num_threads = num_threads
+        self._lock = threading.Lock()
+        self._interpreters = {}
+
+        probe = self._interpreter(1)
+        input_details = probe.get_input_details()[0]
+        self.input_shape = (None,) + tuple(int(d) for d in input_details["shape"][1:])
+        self.input_dtype = input_details["dtype"]
+
+    def _interpreter(self, batch_size):
+        interpreter = self._interpreters.get(batch_size)
+        if interpreter is None:
+            interpreter = tf.lite.Interpreter(model_path=self.path, num_threads=self.num_threads)
+            input_index = interpreter.get_input_details()[0]["index"]
+            shape = list(interpreter.get_input_details()[0]["shape"])
+            if shape[0] != batch_size:
+                interpreter.resize_tensor_input(input_index, [batch_size] + shape[1:])
+            interpreter.allocate_tensors()
+            self._interpreters[batch_size] = interpreter
+        return interpreter
+
+    def predict(self, img_batch):
+        img_batch = np.asarray(img_batch, dtype=np.float32)
+        with self._lock:
+            interpreter = self._interpreter(img_batch.shape[0])
+            input_details = interpreter.get_input_details()[0]
+            output_details = interpreter.get_output_details()[0]
+
+            if input_details["dtype"] != np.float32:
+                # Fully integer model: quantize the normalized input ourselves
+                scale, zero_point = input_details["quantization"]
+                img_batch = np.round(img_batch / scale + zero_point)
+                info = np.iinfo(input_details["dtype"])
+                img_batch = np.clip(img_batch, info.min, info.max).astype(input_details["dtype"])
+
+            interpreter.set_tensor(input_details["index"], img_batch)
+            interpreter.invoke()
+            output = interpreter.get_tensor(output_details["index"])
+
+        if output_details["dtype"] != np.float32:
+            scale, zero_point = output_details["quantization"]
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
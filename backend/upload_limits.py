@@ -0,0 +1,116 @@
+import json
+import os
+
+from starlette.formparsers import MultiPartParser
+
+# Upload size limits for the request path, enforced as early as possible:
+# - RequestSizeLimit answers 413 from the Content-Length header before the body
+#   is read, and stops bodies without one (chunked) once they pass the limit.
+# - read_upload() reads an UploadFile in chunks and stops at the per-file limit.
+# - parse_image_form() parses a single-image upload without spooling it to disk.
+
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+MAX_BATCH_UPLOAD_BYTES = int(os.environ.get("MAX_BATCH_UPLOAD_BYTES", str(512 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = int(os.environ.get("UPLOAD_CHUNK_BYTES", str(256 * 1024)))
+# Room for multipart boundaries, headers and small form fields
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+
+class _InMemoryMultiPartParser(MultiPartParser):
+    # Starlette spools form files above 1 MB to a temp file. Single images are
+    # bounded by MAX_UPLOAD_BYTES, so they stay in memory. Batches keep the
+    # default spooling.
+    spool_max_size = MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, limit):
+        super().__init__(f"Upload exceeds the {limit / (1024 * 1024):.1f} MB limit.")
+        self.limit = limit
+
+
+async def read_upload(file, max_bytes=MAX_UPLOAD_BYTES, chunk_size=UPLOAD_CHUNK_BYTES):
+    """Read an UploadFile into one bytes object, chunk by chunk; UploadTooLarge past max_bytes."""
+    chunks, size = [], 0
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadTooLarge(max_bytes)
+        chunks.append(chunk)
+    return chunks[0] if len(chunks) == 1 else b"".join(chunks)
+
+
+async def parse_image_form(request, max_files=1, max_fields=16):
+    """
+    The multipart form of a single-image upload, with its file kept in memory
+    (the caller closes the form). ValueError for non-multipart bodies.
+    """
+    if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+        raise ValueError("Expected a multipart/form-data upload.")
+    parser = _InMemoryMultiPartParser(request.headers, request.stream(), max_files=max_files, max_fields=max_fields)
+    return await parser.parse()
+
+
+class RequestSizeLimit:
+    """
+    ASGI middleware capping request bodies per path: limits maps an exact
+    path to its maximum upload size in bytes (multipart framing is allowed on
+    top). Other paths are not limited.
+    """
+
+    def __init__(self, app, limits):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+        max_body = limit + MULTIPART_OVERHEAD_BYTES
+
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > max_body:
+            return await self._reject(send, limit)
+
+        received = 0
+        exceeded = started = False
+
+        async def counting_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_body:
+                    exceeded = True
+                    raise UploadTooLarge(limit)
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            if exceeded and not started:
+                return  # the app's error for the cut-off body is replaced by the 413 below
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, guarded_send)
+        except UploadTooLarge:
+            if started:
+                raise
+        if exceeded and not started:
+            await self._reject(send, limit)
+
+    @staticmethod
+    async def _reject(send, limit):
+        body = json.dumps({"detail": str(UploadTooLarge(limit))}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
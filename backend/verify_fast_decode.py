@@ -0,0 +1,105 @@
+
+import os
+import sys
+import time
+import numpy as np
+from benchmark import encode, synthetic_fundus
+from ml_model import DRModel
+from preprocessing import preprocess_image
+
+# Parity check: fast (draft) decode vs. exact full-resolution decode.
+# Usage: python verify_fast_decode.py image_folder
+# The folder should hold real fundus photos covering several DR grades: the
+# check only means something if the model's predictions vary across it.
+# Without a folder, synthetic fundus-like JPEGs at camera resolutions are
+# decoded as a smoke test; the model scores them all alike, so that run
+# can't pass.
+
+MAX_PROB_DRIFT = 0.05   # max allowed |p_fast - p_exact| for any class
+MIN_TOP1_AGREEMENT = 0.98
+# Top-1 flips where the exact top-2 margin is below this are near-ties, reported but not counted
+TIE_MARGIN = 2 * MAX_PROB_DRIFT
+# Below this many distinct predicted classes, or with every top-1 above
+# DEGENERATE_CONFIDENCE, agreement is trivially 100% and proves nothing
+MIN_PREDICTED_CLASSES = 2
+DEGENERATE_CONFIDENCE = 0.99
+
+def load_images(folder):
+    if folder:
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith(('.jpg', '.jpeg', '.png')):
+                with open(os.path.join(folder, name), 'rb') as f:
+                    yield name, f.read()
+    else:
+        sizes = [(3000, 2000), (3888, 2592), (4000, 3000), (5184, 3456)]
+        for i in range(16):
+            w, h = sizes[i % len(sizes)]
+            yield f"synthetic_{i}_{w}x{h}.jpg", encode(synthetic_fundus(w, h, seed=i), "jpg")
+
+def test_parity(folder=None):
+    if not folder:
+        print("WARNING: no image folder given, decoding synthetic images only (smoke test, can't pass).")
+    print("Initializing Model...")
+    dr_model = DRModel()
+    dr_model.warmup()
+
+    drifts = []
+    predicted = []
+    agree = 0
+    decisive = 0
+    t_exact = t_fast = 0.0
+    count = 0
+
+    for name, img_bytes in load_images(folder):
+        start = time.perf_counter()
+        exact_batch, _, _ = preprocess_image(img_bytes, exact=True)
+        t_exact += time.perf_counter() - start
+
+        start = time.perf_counter()
+        fast_batch, _, _ = preprocess_image(img_bytes, exact=False)
+        t_fast += time.perf_counter() - start
+
+        p_exact = dr_model.predict_proba(exact_batch)[0]
+        p_fast = dr_model.predict_proba(fast_batch)[0]
+        drift = float(np.max(np.abs(p_exact - p_fast)))
+        pixel_diff = float(np.mean(np.abs(exact_batch - fast_batch)) * 127.5)
+        drifts.append(drift)
+        predicted.append((int(np.argmax(p_exact)), float(np.max(p_exact))))
+        same_top1 = np.argmax(p_exact) == np.argmax(p_fast)
+        top2 = np.sort(p_exact)[-2:]
+        if top2[1] - top2[0] >= TIE_MARGIN:
+            decisive += 1
+            agree += int(same_top1)
+        count += 1
+        flip = "" if same_top1 else " (top-1 changed)"
+        print(f"{name}: prob drift {drift:.4f}, mean pixel diff {pixel_diff:.2f}/255{flip}")
+
+    if count == 0:
+        print("FAILURE: No images found.")
+        return False
+
+    agreement = agree / decisive if decisive else 1.0
+    print("\n--- Parity Summary ---")
+    print(f"Images: {count}")
+    print(f"Decode time exact: {1000 * t_exact / count:.1f} ms/img, fast: {1000 * t_fast / count:.1f} ms/img")
+    print(f"Max prob drift: {max(drifts):.4f}, mean: {np.mean(drifts):.4f}")
+    print(f"Top-1 agreement: {agreement:.2%} over {decisive} non-tied images")
+
+    classes = {index for index, _ in predicted}
+    names = ", ".join(sorted(dr_model.classes[i] for i in classes))
+    print(f"Predicted classes (exact decode): {names}")
+    degenerate = len(classes) < MIN_PREDICTED_CLASSES or all(p > DEGENERATE_CONFIDENCE for _, p in predicted)
+    if degenerate:
+        print(
+            "FAILURE: Predictions are degenerate (one class or all near-certain), so parity proves nothing. "
+            "Run it on real fundus images covering several grades."
+        )
+        return False
+
+    ok = max(drifts) <= MAX_PROB_DRIFT and agreement >= MIN_TOP1_AGREEMENT
+    print("SUCCESS: Fast decode within tolerance." if ok else "FAILURE: Fast decode drift exceeds tolerance.")
+    return ok
+
+if __name__ == "__main__":
+    folder = sys.argv[1] if len(sys.argv) > 1 else None
+    sys.exit(0 if test_parity(folder) else 1)
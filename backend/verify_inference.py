@@ -14,6 +14,7 @@ def create_dummy_image():
 def test_inference():
     print("Initializing Model...")
     dr_model = DRModel()
+    dr_model.warmup()
     
     print("Creating dummy image...")
     img_bytes = create_dummy_image()
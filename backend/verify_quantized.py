@@ -0,0 +1,153 @@
+
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+from ml_model import DRModel
+from preprocessing import preprocess_image
+from fileutils import file_fingerprint, find_images
+from tflite_backend import TFLiteModel, calibration_record_path, parity_report_path
+
+# Accuracy-parity gate for quantized models.
+# Usage: python verify_quantized.py converted_keras/model_int8.tflite --images /data/fundus_holdout
+#
+# Compares the TFLite model against the float Keras model on the same images and
+# writes <model>.tflite.parity.json. DRModel only serves a TFLite model whose
+# report passed and still matches both model files.
+# The holdout must be real fundus photos covering several grades and none of
+# the int8 calibration images (export_tflite.py records their hashes).
+
+MIN_TOP1_AGREEMENT = 0.98
+MAX_CONFIDENCE_DELTA = 0.05
+# Top-1 flips where the float top-2 margin is below this are near-ties, reported but not counted
+TIE_MARGIN = 2 * MAX_CONFIDENCE_DELTA
+# Fewer non-tied images than this can't support MIN_TOP1_AGREEMENT
+MIN_DECISIVE_IMAGES = 50
+# Same degenerate-prediction guard as verify_fast_decode.py: one predicted
+# class, or every top-1 near-certain, makes agreement trivially 100%
+MIN_PREDICTED_CLASSES = 2
+DEGENERATE_CONFIDENCE = 0.99
+def load_batches(paths, batch_size):
+    for start in range(0, len(paths), batch_size):
+        tensors = []
+        for path in paths[start:start + batch_size]:
+            try:
+                with open(path, "rb") as f:
+                    batch_img, _, _ = preprocess_image(f.read(), exact=True)
+            except Exception as e:
+                print(f"Skipping {path}: {e}")
+                continue
+            tensors.append(batch_img[0])
+        if tensors:
+            yield np.stack(tensors)
+
+def calibration_overlap(tflite_path, paths):
+    """Holdout images that were also int8 calibration images (by content)."""
+    record_path = calibration_record_path(tflite_path)
+    if not os.path.exists(record_path):
+        print(f"WARNING: no calibration record at {record_path}; can't check the holdout is separate.")
+        return []
+    with open(record_path, "r", encoding="utf-8") as f:
+        calibrated = set(json.load(f)["fingerprints"])
+    return [p for p in paths if file_fingerprint(p) in calibrated]
+
+def write_report(tflite_path, report):
+    with open(parity_report_path(tflite_path), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {parity_report_path(tflite_path)}")
+
+def test_parity(args):
+    paths = [os.path.join(args.images, p) for p in find_images(args.images)]
+    overlap = calibration_overlap(args.tflite_model, paths)
+    if overlap:
+        reason = f"{len(overlap)} holdout image(s) were used for calibration, e.g. {overlap[0]}"
+        # Replace any earlier passing report, so DRModel stops serving this model
+        write_report(args.tflite_model, {"passed": False, "reason": reason, "images": len(paths)})
+        print(f"FAILURE: {reason}")
+        return False
+
+    print("Initializing float model...")
+    dr_model = DRModel(args.model_dir)
+    dr_model.warmup([args.batch_size])
+    quantized = TFLiteModel(args.tflite_model)
+
+    float_probs, quant_probs = [], []
+    t_float = t_quant = 0.0
+    for batch in load_batches(paths, args.batch_size):
+        start = time.perf_counter()
+        float_probs.append(dr_model.predict_proba(batch))
+        t_float += time.perf_counter() - start
+        start = time.perf_counter()
+        quant_probs.append(quantized.predict(batch))
+        t_quant += time.perf_counter() - start
+
+    if not float_probs:
+        print("FAILURE: No images found.")
+        return False
+
+    p_float = np.concatenate(float_probs)
+    p_quant = np.concatenate(quant_probs)
+    count = len(p_float)
+
+    top1_float = np.argmax(p_float, axis=1)
+    top1_quant = np.argmax(p_quant, axis=1)
+    sorted_float = np.sort(p_float, axis=1)
+    decisive = (sorted_float[:, -1] - sorted_float[:, -2]) >= TIE_MARGIN
+    agreement = float(np.mean(top1_float[decisive] == top1_quant[decisive])) if decisive.any() else 0.0
+
+    conf_float = p_float[np.arange(count), top1_float]
+    conf_quant = p_quant[np.arange(count), top1_float]
+    max_conf_delta = float(np.max(np.abs(conf_float - conf_quant)))
+    mean_abs_delta = float(np.mean(np.abs(p_float - p_quant)))
+
+    predicted_classes = len(set(top1_float.tolist()))
+    problems = []
+    if decisive.sum() < MIN_DECISIVE_IMAGES:
+        problems.append(f"only {int(decisive.sum())} non-tied images (min {MIN_DECISIVE_IMAGES})")
+    if predicted_classes < MIN_PREDICTED_CLASSES or np.all(conf_float > DEGENERATE_CONFIDENCE):
+        problems.append(
+            f"degenerate predictions ({predicted_classes} class(es), "
+            f"min confidence {float(conf_float.min()):.4f}); use real images covering several grades"
+        )
+    if agreement < MIN_TOP1_AGREEMENT or max_conf_delta > MAX_CONFIDENCE_DELTA:
+        problems.append(
+            f"top-1 agreement {agreement:.2%} (min {MIN_TOP1_AGREEMENT:.0%}), "
+            f"max confidence delta {max_conf_delta:.4f} (max {MAX_CONFIDENCE_DELTA})"
+        )
+    passed = not problems
+    reason = "; ".join(problems)
+
+    print("\n--- Parity Summary ---")
+    print(f"Images: {count} ({int(decisive.sum())} non-tied)")
+    print(f"Top-1 agreement: {agreement:.2%}, predicted classes: {predicted_classes}")
+    print(f"Max confidence delta: {max_conf_delta:.4f}, mean |prob delta|: {mean_abs_delta:.4f}")
+    print(f"Latency float: {1000 * t_float / count:.2f} ms/img, tflite: {1000 * t_quant / count:.2f} ms/img")
+
+    report = {
+        "passed": passed,
+        "reason": reason,
+        "images": count,
+        "decisive_images": int(decisive.sum()),
+        "predicted_classes": predicted_classes,
+        "top1_agreement": agreement,
+        "max_confidence_delta": max_conf_delta,
+        "mean_abs_prob_delta": mean_abs_delta,
+        "float_ms_per_image": 1000 * t_float / count,
+        "tflite_ms_per_image": 1000 * t_quant / count,
+        "tflite_fingerprint": file_fingerprint(args.tflite_model),
+        "source_fingerprint": dr_model.model_fingerprint(),
+    }
+    write_report(args.tflite_model, report)
+
+    print("SUCCESS: Quantized model within tolerance." if passed else f"FAILURE: {reason}")
+    return passed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare a TFLite model against the float model.")
+    parser.add_argument("tflite_model")
+    parser.add_argument("--images", required=True, help="Held-out fundus images (none used for calibration)")
+    parser.add_argument("--model-dir", default="converted_keras")
+    parser.add_argument("--batch-size", type=int, default=16)
+    sys.exit(0 if test_parity(parser.parse_args()) else 1)
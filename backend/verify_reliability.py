@@ -0,0 +1,207 @@
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from benchmark import app_workdir
+
+# Focused checks for the failure paths of the API and its write-behind queue.
+# Usage: python verify_reliability.py [outbox|shedding|cursor|size_limit ...]
+#
+# - outbox: records put by a process that then dies (before and during a flush)
+#   are replayed by the next Outbox on the same file.
+# - shedding: a stage at capacity answers 503 with Retry-After instead of queuing.
+# - cursor: paging /history by X-Next-Cursor returns every row once, newest first,
+#   also across rows sharing a created_at; a tampered cursor is a 400.
+# - size_limit: an oversize /analyze body sent chunked (no Content-Length) gets 413.
+# The app runs in-process with FAKE_BACKENDS=1 in a temp directory.
+
+HISTORY_ROWS = 25
+PAGE_SIZE = 4
+
+_CRASHING_WRITER = """
+import os, sys
+sys.path.insert(0, {backend!r})
+from outbox import Outbox
+
+def crash_mid_flush(records):
+    with open({flushed!r}, "w") as f:
+        f.write(",".join(r["id"] for r in records))
+    os._exit(1)  # after the remote write, before the local delete
+
+outbox = Outbox({path!r}, crash_mid_flush, batch_size=100)
+for i in range({count}):
+    outbox.put({{"id": f"rec-{{i}}", "n": i}})
+if {flush}:
+    outbox.flush_once()
+os._exit(1)  # no stop(), no close()
+"""
+
+
+def crash_writer(path, flushed, count, flush):
+    code = _CRASHING_WRITER.format(
+        backend=os.path.dirname(os.path.abspath(__file__)), path=path, flushed=flushed, count=count, flush=flush
+    )
+    subprocess.run([sys.executable, "-c", code], check=False)
+
+
+def test_outbox():
+    from outbox import Outbox
+
+    ok = True
+    folder = tempfile.mkdtemp(prefix="optiretina-outbox-")
+    for flush in (False, True):
+        path = os.path.join(folder, f"outbox-{flush}.sqlite3")
+        flushed = os.path.join(folder, f"flushed-{flush}.txt")
+        crash_writer(path, flushed, 5, flush)
+        remote = open(flushed).read().split(",") if os.path.exists(flushed) else []
+
+        received = []
+        outbox = Outbox(path, received.extend)
+        outbox.flush_once()
+        pending = outbox.stats()["pending"]
+        outbox.stop()
+        replayed = sorted(r["id"] for r in received)
+        expected = [f"rec-{i}" for i in range(5)]
+        when = "during a flush" if flush else "before flushing"
+        print(f"Crash {when}: {len(remote)} written remotely, {len(replayed)} replayed, {pending} pending")
+        if replayed != expected or pending:
+            print(f"FAILURE: Expected {expected} replayed and nothing pending, got {replayed} / {pending}.")
+            ok = False
+    if ok:
+        print("SUCCESS: Outbox replays every record after a crash.")
+    return ok
+
+
+def test_shedding(main, client):
+    from pipeline import Stage
+
+    stage = Stage("history", workers=1, max_queue=0)
+    original, main.stages["history"] = main.stages["history"], stage
+    release = threading.Event()
+    # Occupy the only worker so the next request finds the stage full
+    blocker = threading.Thread(target=asyncio.run, args=(stage.run(release.wait),), daemon=True)
+    blocker.start()
+    try:
+        while stage.stats()["in_flight"] < 1:
+            time.sleep(0.01)
+        response = client.get("/history", params={"limit": 1, "user_email": f"shed-{uuid.uuid4()}"})
+    finally:
+        release.set()
+        blocker.join()
+        main.stages["history"] = original
+        stage.shutdown()
+
+    print(f"/history at capacity: {response.status_code}, Retry-After {response.headers.get('retry-after')}")
+    print(f"Stage stats: {stage.stats()}")
+    ok = response.status_code == 503 and response.headers.get("retry-after") == "1" and stage.stats()["rejected"] == 1
+    print("SUCCESS: Full stage sheds load with 503." if ok else "FAILURE: Full stage did not answer 503.")
+    return ok
+
+
+def test_cursor(main, client):
+    import history
+
+    user = f"cursor-{uuid.uuid4()}@example.com"
+    table = main.supabase.table("analysis_history")
+    rows = []
+    for i in range(HISTORY_ROWS):
+        # Groups of three share a timestamp, so pages have to break ties on id
+        created_at = f"2026-01-01T00:00:{i // 3:02d}+00:00"
+        rows.append({"id": str(uuid.uuid4()), "created_at": created_at, "user_email": user, "prediction": "No_DR"})
+    table.upsert(rows, on_conflict="id").execute()
+    expected = [r["id"] for r in sorted(rows, key=lambda r: (r["created_at"], r["id"]), reverse=True)]
+
+    ok = True
+    row = rows[0]
+    if history.decode_cursor(history.encode_cursor(row)) != (row["created_at"], row["id"]):
+        print("FAILURE: encode_cursor/decode_cursor do not round-trip.")
+        ok = False
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        params = {"user_email": user, "limit": PAGE_SIZE, "fields": "id"}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/history", params=params)
+        response.raise_for_status()
+        seen.extend(r["id"] for r in response.json())
+        pages += 1
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor or pages > HISTORY_ROWS:
+            break
+    print(f"Paged {len(seen)} of {HISTORY_ROWS} rows in {pages} pages of {PAGE_SIZE}")
+    if seen != expected:
+        missing, repeated = set(expected) - set(seen), len(seen) - len(set(seen))
+        print(f"FAILURE: Pages differ from newest-first order ({len(missing)} missing, {repeated} repeated).")
+        ok = False
+
+    tampered = client.get("/history", params={"user_email": user, "cursor": "not-a-cursor"})
+    print(f"Tampered cursor: {tampered.status_code}")
+    if tampered.status_code != 400:
+        print("FAILURE: A tampered cursor should be rejected with 400.")
+        ok = False
+    if ok:
+        print("SUCCESS: History cursor pages every row exactly once.")
+    return ok
+
+
+def test_size_limit(main, client):
+    from upload_limits import MAX_UPLOAD_BYTES
+
+    chunk = b"0" * (1024 * 1024)
+    sent = 0
+
+    def body():
+        nonlocal sent
+        # A generator body goes out chunked, so only the byte count can trip the limit
+        while sent <= MAX_UPLOAD_BYTES + 2 * len(chunk):
+            sent += len(chunk)
+            yield chunk
+
+    response = client.post(
+        "/analyze", content=body(), headers={"content-type": "multipart/form-data; boundary=x"}
+    )
+    print(f"Chunked {sent / (1024 * 1024):.0f} MB body (limit {MAX_UPLOAD_BYTES / (1024 * 1024):.0f} MB): "
+          f"{response.status_code}")
+    ok = response.status_code == 413
+    print("SUCCESS: Oversize chunked upload rejected with 413." if ok else "FAILURE: Expected 413.")
+    return ok
+
+
+APP_CHECKS = {"shedding": test_shedding, "cursor": test_cursor, "size_limit": test_size_limit}
+
+
+def run(names):
+    results = {}
+    if "outbox" in names:
+        print("\n--- outbox ---")
+        results["outbox"] = test_outbox()
+
+    app_names = [name for name in names if name in APP_CHECKS]
+    if app_names:
+        app_workdir("optiretina-verify-", {"FAKE_BACKENDS": "1", "LOG_LEVEL": "ERROR"})
+        from fastapi.testclient import TestClient
+        import main
+
+        with TestClient(main.app) as client:
+            for name in app_names:
+                print(f"\n--- {name} ---")
+                results[name] = APP_CHECKS[name](main, client)
+
+    print("\n--- Summary ---")
+    for name, ok in results.items():
+        print(f"{name}: {'ok' if ok else 'FAILED'}")
+    return bool(results) and all(results.values())
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or ["outbox", *APP_CHECKS]
+    unknown = [n for n in names if n != "outbox" and n not in APP_CHECKS]
+    if unknown:
+        sys.exit(f"Unknown check(s): {', '.join(unknown)}")
+    sys.exit(0 if run(names) else 1)
@@ -5,7 +5,7 @@ import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { Button } from "@/components/ui/button";
 import { FileText, Search } from "lucide-react";
 import { Input } from "@/components/ui/input";
-import axios from 'axios';
+import { fetchHistoryPage } from '@/lib/history';
 
 interface Record {
   id: string;
@@ -17,23 +17,34 @@ interface Record {
   is_noisy: boolean;
 }
 
+const PREDICTIONS = ['No_DR', 'Mild', 'Moderate', 'Severe', 'Proliferate_DR', 'Uncertain'];
+const PAGE_SIZE = 50;
+
 export default function HistoryPage() {
   const [history, setHistory] = useState<Record[]>([]);
   const [filtered, setFiltered] = useState<Record[]>([]);
   const [search, setSearch] = useState('');
+  const [prediction, setPrediction] = useState('');
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loading, setLoading] = useState(false);
+
+  // One page at a time, filtered by the backend; the text search runs on the loaded rows
+  const loadPage = async (cursor: string | null) => {
+    setLoading(true);
+    try {
+        const page = await fetchHistoryPage<Record>(PAGE_SIZE, prediction ? { prediction } : {}, cursor);
+        setHistory(prev => cursor ? [...prev, ...page.rows] : page.rows);
+        setNextCursor(page.nextCursor);
+    } catch (e) {
+        console.error(e);
+    } finally {
+        setLoading(false);
+    }
+  };
 
   useEffect(() => {
-    const fetchHistory = async () => {
-        try {
-            const res = await axios.get('http://localhost:8000/history');
-            setHistory(res.data);
-            setFiltered(res.data);
-        } catch (e) {
-            console.error(e);
-        }
-    };
-    fetchHistory();
-  }, []);
+    loadPage(null);
+  }, [prediction]);
 
   useEffect(() => {
     const lower = search.toLowerCase();
@@ -52,11 +63,21 @@ export default function HistoryPage() {
       <div className="flex items-center space-x-2 bg-white p-2 rounded-lg border shadow-sm max-w-md">
         <Search className="text-slate-400" />
         <Input 
-            placeholder="Search by filename or result..." 
+            placeholder="Search loaded records by filename or result..." 
             className="border-none focus-visible:ring-0"
             value={search}
             onChange={(e) => setSearch(e.target.value)}
         />
+        <select
+            className="h-9 rounded-md border border-slate-200 bg-white px-2 text-sm text-slate-700"
+            value={prediction}
+            onChange={(e) => setPrediction(e.target.value)}
+        >
+            <option value="">All results</option>
+            {PREDICTIONS.map((p) => (
+                <option key={p} value={p}>{p.replaceAll('_', ' ')}</option>
+            ))}
+        </select>
       </div>
 
       <Card>
@@ -93,7 +114,7 @@ export default function HistoryPage() {
                                     <td className="px-4 py-3">{(rec.confidence * 100).toFixed(1)}%</td>
                                     <td className="px-4 py-3">
                                         {rec.is_noisy ? (
-                                            <span className="text-yellow-600 flex items-center gap-1">⚠️ Noisy</span>
+                                            <span className="text-yellow-600 flex items-center gap-1" title="Advisory: quality checks are not yet calibrated">⚠️ Check quality</span>
                                         ) : (
                                             <span className="text-slate-500">Good</span>
                                         )}
@@ -111,6 +132,13 @@ export default function HistoryPage() {
                     </table>
                   </div>
               )}
+              {nextCursor && (
+                  <div className="flex justify-center">
+                      <Button variant="outline" onClick={() => loadPage(nextCursor)} disabled={loading}>
+                          {loading ? 'Loading...' : 'Load more'}
+                      </Button>
+                  </div>
+              )}
           </div>
         </CardContent>
       </Card>
@@ -5,7 +5,7 @@ import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { Button } from "@/components/ui/button";
 import { FileText, ArrowRight, Activity, Percent } from "lucide-react";
 import Link from 'next/link';
-import axios from 'axios';
+import { fetchHistoryPage, fetchHistoryStats } from '@/lib/history';
 
 interface Record {
   id: string;
@@ -24,13 +24,15 @@ export default function DashboardPage() {
     // Fetch history
     const fetchHistory = async () => {
         try {
-            const res = await axios.get('http://localhost:8000/history');
-            const data = res.data;
-            setHistory(data);
-            
-            // Calculate stats
-            const total = data.length;
-            const healthy = data.filter((r: any) => r.prediction === 'No_DR').length;
+            // Recent list: first page only; stats: counted by the backend
+            const [recent, counts] = await Promise.all([
+                fetchHistoryPage<Record>(100),
+                fetchHistoryStats(),
+            ]);
+            setHistory(recent.rows);
+
+            const total = counts.total;
+            const healthy = counts.by_prediction['No_DR'] ?? 0;
             const dr = total - healthy;
             setStats({ total, healthy, dr });
         } catch (e) {
@@ -14,6 +14,7 @@ interface Result {
   confidence: number;
   report_url: string;
   is_noisy: boolean;
+  quality?: { issues: string[] };
   tips: string[];
 }
 
@@ -154,7 +155,7 @@ export default function UploadPage() {
                         
                         {result.is_noisy && (
                             <div className="bg-yellow-50 text-yellow-800 p-3 rounded text-sm border border-yellow-200">
-                                ⚠️ Low image quality detected. Preprocessing applied logic to enhance clarity.
+                                ⚠️ Image quality may be limited{result.quality?.issues.length ? ` (${result.quality.issues.join(', ').replaceAll('_', ' ')})` : ''}. Advisory only: the quality checks are not yet calibrated on clinical images.
                             </div>
                         )}
                     </CardContent>
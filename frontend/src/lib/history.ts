@@ -0,0 +1,41 @@
+import axios from 'axios';
+
+const API_URL = 'http://localhost:8000';
+
+export interface HistoryParams {
+  user_email?: string;
+  prediction?: string;
+  since?: string;
+  until?: string;
+  // Comma-separated columns; id and created_at always come back
+  fields?: string;
+}
+
+export interface HistoryPage<T> {
+  rows: T[];
+  // Pass back as `cursor` for the next page; null on the last page
+  nextCursor: string | null;
+}
+
+export interface HistoryStats {
+  total: number;
+  by_prediction: { [label: string]: number };
+}
+
+// One page of GET /history, newest first
+export async function fetchHistoryPage<T>(
+  limit: number,
+  params: HistoryParams = {},
+  cursor?: string | null,
+): Promise<HistoryPage<T>> {
+  const res = await axios.get<T[]>(`${API_URL}/history`, {
+    params: { ...params, limit, cursor: cursor || undefined },
+  });
+  return { rows: res.data, nextCursor: res.headers['x-next-cursor'] || null };
+}
+
+// Counts computed by the backend, so dashboards never download the table
+export async function fetchHistoryStats(params: Omit<HistoryParams, 'prediction' | 'fields'> = {}): Promise<HistoryStats> {
+  const res = await axios.get<HistoryStats>(`${API_URL}/history/stats`, { params });
+  return res.data;
+}